@@ -2,14 +2,29 @@
 import pandas as pd
 
 import components
+import covariance
+import montecarlo
+import optimize
+import portfolio
 import template
 
 import streamlit as st
 
+# Label shown in the UI: number of daily returns used for estimates
+WINDOWS = {'3mo': 63, '1Y': 252, '3Y': 756, '5Y': 1260, 'All': None}
+# Label shown in the UI: days simulated ahead
+HORIZONS = {'1mo': 21, '3mo': 63, '6mo': 126, '1Y': 252, '2Y': 504}
+PATHS = [1000, 10000, 100000]
+
 
 class Analysis(template.Page):
 	"""Analysis page"""
 
+	def __init__(self, symbols: list, STATE: st.session_state):
+		super().__init__(symbols, STATE)
+		if not hasattr(STATE, 'covariance'):
+			STATE.covariance = covariance.CovarianceCache()
+
 	def _weight_grid(self, max_cols: int = 8) -> dict:
 		num_symbols = len(self.symbols)
 		max_cols = max_cols if num_symbols >= max_cols else num_symbols
@@ -25,40 +40,265 @@ class Analysis(template.Page):
 		return {s: w for s, w in weights.items() if w != 0}
 
 	@staticmethod
-	def _build_portfolio(weights: dict, data: pd.DataFrame):
-		data = data.loc[weights.keys()]
-		data_dict = {}
-		returns = None
-		for s in weights.keys():
-			df = data.loc[s]
-			wret = (
-					df['adjclose'] / df['adjclose'].shift(1) - 1
-			).fillna(0)*weights[s]
-			if returns is None:
-				returns = wret
-			else:
-				returns = returns.add(wret, fill_value=0)
-			# df['wret'] = wret
-			# data_dict[s] = df
-
-		# data = pd.concat(
-		# 	{k: v for k, v in data_dict.items()}, keys=data_dict.keys()
-		# )[['adjclose', 'wret']]
-		# st.write(data)
-		# st.write((1 + returns).cumprod())
-		return (1 + returns).cumprod()
+	def _build_portfolio(
+		weights: dict,
+		prices: pd.DataFrame,
+		rebalance: str = 'daily',
+		threshold: float = 0.05
+	) -> portfolio.PortfolioResult:
+		return portfolio.build(prices, weights, rebalance, threshold)
+
+	def _correlation(self, symbols: list, end_date) -> None:
+		"""Correlation heatmap of the symbols' daily returns"""
+		import plotly.graph_objs as go
+
+		st.markdown('''### Correlation''')
+		columns = st.columns(3)
+		window = columns[0].selectbox(
+			'Window', options=list(WINDOWS.keys()), index=1,
+			help='Daily returns up to the end of the chart\'s time period'
+		)
+		shrinkage = columns[1].selectbox(
+			'Shrinkage', options=list(covariance.SHRINKAGE.keys()),
+			help='''Pulls the estimate towards a simpler structure, which 
+			makes it more stable when there are many symbols compared to the 
+			number of returns. Ledoit-Wolf picks how far on its own.'''
+		)
+		intensity = columns[2].slider(
+			'Shrinkage intensity', min_value=0.0, max_value=1.0, value=0.5
+		) if shrinkage == 'Constant correlation' else 0.5
+		result = self.STATE.covariance.compute(
+			self.panel,
+			symbols,
+			WINDOWS[window],
+			end_date,
+			covariance.SHRINKAGE[shrinkage],
+			intensity
+		)
+		fig = go.Figure(go.Heatmap(
+			z=result.corr.values,
+			x=result.corr.columns,
+			y=result.corr.index,
+			zmin=-1,
+			zmax=1,
+			colorscale='RdBu'
+		))
+		fig.update_layout(
+			height=max(400, min(1200, 20 * len(result.corr))),
+			yaxis_autorange='reversed',
+			template='seaborn'
+		)
+		st.plotly_chart(figure_or_data=fig, use_container_width=True)
+		counts = result.counts.values
+		st.caption(
+			f'Pairs share {counts.min():,} to {counts.max():,} daily returns' +
+			(f'; shrinkage intensity {result.intensity:.2f}'
+				if result.method != 'none' else '')
+		)
+		if st.checkbox('Show covariance matrix (annualized)'):
+			st.dataframe(result.annualized())
+
+	@staticmethod
+	def _simulation(value: pd.Series) -> None:
+		"""Fan chart and tail risk of the portfolio's simulated value"""
+		import plotly.graph_objs as go
+
+		st.markdown('''### Monte Carlo simulation''')
+		columns = st.columns(5)
+		method = columns[0].selectbox(
+			'Method', options=list(montecarlo.METHODS.keys()),
+			help='''Bootstrap replays randomly picked daily returns from the 
+			chart's time period, block bootstrap replays runs of consecutive 
+			days (keeping volatility clusters), and normal draws returns from 
+			a normal distribution with the same mean and volatility.'''
+		)
+		horizon = HORIZONS[columns[1].selectbox(
+			'Horizon', options=list(HORIZONS.keys()), index=3
+		)]
+		n_paths = columns[2].selectbox(
+			'Paths', options=PATHS, index=1, format_func=lambda x: f'{x:,}'
+		)
+		seed = int(columns[3].number_input('Seed', min_value=0, value=0))
+		block = int(columns[4].number_input(
+			'Block length', min_value=2, max_value=126, value=21
+		)) if method == 'Block bootstrap' else 21
+		try:
+			result = montecarlo.simulate(
+				value.pct_change(),
+				horizon,
+				n_paths,
+				montecarlo.METHODS[method],
+				seed,
+				block
+			)
+		except ValueError as e:
+			st.warning(e)
+			return
+
+		dates = pd.bdate_range(value.index[-1], periods=horizon + 1)
+		bands = result.percentiles * value.iloc[-1]
+		fig = go.Figure()
+		for low, high, opacity in [(5, 95, 0.2), (25, 75, 0.4)]:
+			fig.add_trace(go.Scatter(
+				x=dates, y=bands[high], mode='lines', line_width=0,
+				showlegend=False, hoverinfo='skip'
+			))
+			fig.add_trace(go.Scatter(
+				x=dates, y=bands[low], mode='lines', line_width=0,
+				fill='tonexty', fillcolor=f'rgba(31,119,180,{opacity})',
+				name=f'{low}th to {high}th percentile'
+			))
+		fig.add_trace(go.Scatter(
+			x=dates, y=bands[50], mode='lines', name='Median',
+			line_color='rgb(31,119,180)'
+		))
+		fig.add_trace(go.Scatter(
+			x=value.index[-horizon:], y=value.iloc[-horizon:], mode='lines',
+			name='Portfolio', line_color='gray'
+		))
+		fig.update_layout(
+			height=500, template='seaborn', hovermode='x unified',
+			legend=dict(orientation='h', yanchor='bottom', y=1.02, x=0)
+		)
+		st.plotly_chart(figure_or_data=fig, use_container_width=True)
+		metric_cols = st.columns(4)
+		for i, level in enumerate([0.95, 0.99]):
+			metric_cols[2 * i].metric(
+				f'VaR {level:.0%}', f'{result.var(level):.1%}'
+			)
+			metric_cols[2 * i + 1].metric(
+				f'CVaR {level:.0%}', f'{result.cvar(level):.1%}'
+			)
+		st.caption(
+			f'Losses over {horizon} trading days from {n_paths:,} simulated '
+			'paths; CVaR is the average loss beyond the VaR'
+		)
+
+	def _optimizer_controls(self, method: str) -> dict:
+		"""Settings for an optimizer picked in the weights selectbox"""
+		columns = st.columns(4)
+		settings = {
+			'objective': optimize.OBJECTIVES[method],
+			'window': WINDOWS[columns[0].selectbox(
+				'Estimation window', options=list(WINDOWS.keys()), index=2,
+				help='Daily returns up to the end of the chart\'s time period'
+			)],
+			'shrinkage': covariance.SHRINKAGE[columns[1].selectbox(
+				'Covariance shrinkage',
+				options=list(covariance.SHRINKAGE.keys()),
+				index=1
+			)],
+			'risk_free': columns[3].number_input(
+				'Risk-free rate', min_value=0.0, max_value=0.2, value=0.02,
+				step=0.005, format='%.3f'
+			) if method == 'Maximum Sharpe' else 0.0
+		}
+		bounded = columns[2].checkbox(
+			'Bounded weights', help='''Long only (every weight between 0 and 
+			1) unless checked'''
+		)
+		settings['lower'], settings['upper'] = st.slider(
+			'Weight bounds', min_value=-1.0, max_value=1.0, step=0.01,
+			value=(0.0, max(0.05, round(2 / len(self.symbols), 2)))
+		) if bounded else (0.0, 1.0)
+		return settings
+
+	def _optimize(
+		self, symbols: list, end_date, settings: dict
+	) -> optimize.OptimizationResult:
+		cov = self.STATE.covariance.compute(
+			self.panel,
+			symbols,
+			settings['window'],
+			end_date,
+			settings['shrinkage']
+		)
+		return optimize.optimize(
+			settings['objective'],
+			covariance.panel_returns(
+				self.panel, list(cov.cov.columns), settings['window'], end_date
+			),
+			cov.cov,
+			settings['risk_free'],
+			settings['lower'],
+			settings['upper']
+		)
 
 	def _single_symbol(self, symbol: str):
 		pass
 
 	def _multi_symbols(self, symbols: list):
 		st.markdown('''### Weights''')
-		weights = self._weight_grid(max_cols=6)
+		method = st.selectbox(
+			'Weights', options=['Manual'] + list(optimize.OBJECTIVES.keys()),
+			help='''Type in a weight for every symbol, or let an optimizer 
+			pick them from the symbols' return history. Risk parity gives 
+			every symbol the same share of the portfolio's risk.'''
+		)
+		if method == 'Manual':
+			weights = self._weight_grid(max_cols=6)
+		else:
+			settings = self._optimizer_controls(method)
+		rebalance_cols = st.columns(4)
+		rebalance = rebalance_cols[0].selectbox(
+			'Rebalancing',
+			options=list(portfolio.REBALANCE_MODES.keys()),
+			help='''How often the portfolio is brought back to the weights 
+			above. "Drift threshold" rebalances whenever any weight drifts 
+			further from its target than the threshold.'''
+		)
+		threshold = rebalance_cols[1].number_input(
+			'Drift threshold', min_value=0.005, max_value=1.000, value=0.050,
+			step=0.005, format='%.3f'
+		) if rebalance == 'Drift threshold' else 0.05
 		chart = components.TimeSeriesChart(
 			st,
 			self.symbols,
-			self.data,
+			self.panel,
 			plot_type_controls=False,
-			price_type_controls=False
+			price_type_controls=False,
+			cache=self.STATE.charts,
+			# The portfolio line drawn over it is made of daily bars
+			auto_bar_size=False
 		)
-		chart.add_line(self._build_portfolio(weights, chart.data))
+		if method != 'Manual':
+			try:
+				optimized = self._optimize(symbols, chart.end_date, settings)
+			except ValueError as e:
+				st.warning(e)
+				optimized = None
+			weights = {} if optimized is None else {
+				s: w for s, w in optimized.weights.items() if abs(w) > 1e-6
+			}
+			if optimized is not None:
+				metric_cols = st.columns(4)
+				metric_cols[0].metric(
+					'Expected return', f'{optimized.expected_return:.1%}'
+				)
+				metric_cols[1].metric(
+					'Expected volatility', f'{optimized.volatility:.1%}'
+				)
+				metric_cols[2].metric('Sharpe ratio', f'{optimized.sharpe:.2f}')
+				metric_cols[3].metric('Symbols held', len(weights))
+				with st.expander('Optimized weights'):
+					st.dataframe(
+						optimized.weights[list(weights)]
+						.sort_values(ascending=False).to_frame()
+						.style.format('{:.2%}')
+					)
+		if weights:
+			result = self._build_portfolio(
+				weights,
+				self.panel.matrix(
+					'adjclose', list(weights), chart.start_date, chart.end_date
+				),
+				portfolio.REBALANCE_MODES[rebalance],
+				threshold
+			)
+			chart.add_line(result.value)
+			rebalance_cols[2].metric('Rebalances', len(result.rebalance_dates))
+			rebalance_cols[3].metric(
+				'Turnover per year', f'{result.annual_turnover:.1%}'
+			)
+			self._simulation(result.value)
+		self._correlation(symbols, chart.end_date)
@@ -0,0 +1,314 @@
+"""Rolling analytics over the price panel"""
+import os
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import panel
+
+# Label shown in the UI: metric
+METRICS = {
+	'Rolling return': 'return',
+	'Rolling volatility': 'volatility',
+	'Drawdown': 'drawdown',
+	'Rolling beta': 'beta'
+}
+# Metrics that don't depend on a window
+NO_WINDOW = ['drawdown']
+TRADING_DAYS = 252
+# (symbol, metric, window, benchmark) results kept per session
+MAX_ENTRIES = int(os.environ.get('STOCKTIME_ANALYTICS_MAX_ENTRIES', 2000))
+
+
+def fill_prices(prices: np.ndarray, last_rows: np.ndarray) -> np.ndarray:
+	"""Carry prices forward over gaps, but not past each symbol's last bar.
+
+	The panel's dates are the union of every symbol's dates, so without
+	this a symbol would get a hole on every day another symbol traded and
+	it didn't. A gap counts as a day with a zero return.
+	"""
+	rows = np.arange(len(prices))[:, None]
+	idx = np.maximum.accumulate(np.where(~np.isnan(prices), rows, 0), axis=0)
+	out = np.take_along_axis(prices, idx, axis=0)
+	out[rows > last_rows] = np.nan
+	return out
+
+
+def simple_returns(prices: np.ndarray) -> np.ndarray:
+	"""Returns of a dates x symbols array, NaN in the first row"""
+	out = np.full(prices.shape, np.nan)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out[1:] = prices[1:] / prices[:-1] - 1
+	return out
+
+
+def _window_sums(values: np.ndarray, window: int) -> tuple:
+	"""Sums and counts of the non-NaN values in each trailing window"""
+	valid = ~np.isnan(values)
+	sums = np.cumsum(np.where(valid, values, 0), axis=0)
+	counts = np.cumsum(valid, axis=0)
+	sums[window:] = sums[window:] - sums[:-window]
+	counts[window:] = counts[window:] - counts[:-window]
+	return sums, counts
+
+
+def rolling_return(prices: np.ndarray, window: int) -> np.ndarray:
+	"""Return over the last window bars"""
+	out = np.full(prices.shape, np.nan)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out[window:] = prices[window:] / prices[:-window] - 1
+	return out
+
+
+def rolling_volatility(
+	prices: np.ndarray, window: int, periods: int = TRADING_DAYS
+) -> np.ndarray:
+	"""Annualized standard deviation of the returns over the last window bars"""
+	returns = simple_returns(prices)
+	sums, counts = _window_sums(returns, window)
+	squares, _ = _window_sums(returns * returns, window)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		var = (squares - sums * sums / counts) / (counts - 1)
+	out = np.sqrt(np.clip(var, 0, None) * periods)
+	out[counts < window] = np.nan
+	return out
+
+
+def rolling_beta(
+	prices: np.ndarray, benchmark: np.ndarray, window: int
+) -> np.ndarray:
+	"""Beta against benchmark over the last window bars, from the days both
+	have a return"""
+	returns = simple_returns(prices)
+	bench = simple_returns(benchmark[:, None])
+	both = ~np.isnan(returns) & ~np.isnan(bench)
+	x = np.where(both, bench, np.nan)
+	y = np.where(both, returns, np.nan)
+	sum_x, counts = _window_sums(x, window)
+	sum_y, _ = _window_sums(y, window)
+	sum_xy, _ = _window_sums(x * y, window)
+	sum_xx, _ = _window_sums(x * x, window)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out = (sum_xy - sum_x * sum_y / counts) / (sum_xx - sum_x**2 / counts)
+	out[counts < window] = np.nan
+	return out
+
+
+def drawdown(prices: np.ndarray, peaks: np.ndarray = None) -> np.ndarray:
+	"""Distance below the highest price so far. peaks are the highest prices
+	before the first row, if this is the tail of a longer history."""
+	running = np.fmax.accumulate(
+		prices if peaks is None else np.vstack([peaks, prices]), axis=0
+	)
+	running = running if peaks is None else running[1:]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return prices / running - 1
+
+
+class _Entry:
+	"""A cached metric for one symbol, for the panel's first len(values) rows.
+	price (and bench_price) are the prices on row valid_until, the symbol's
+	last bar when it was computed.
+	"""
+	__slots__ = [
+		'values', 'last_date', 'valid_until', 'price', 'bench_price', 'peak'
+	]
+
+	def __init__(self, values, last_date, valid_until, price, bench_price, peak):
+		self.values = values
+		self.last_date = last_date
+		self.valid_until = valid_until
+		self.price = price
+		self.bench_price = bench_price
+		self.peak = peak
+
+
+class RollingAnalytics:
+	"""Rolling metrics for many symbols, cached per (symbol, window).
+
+	Every symbol that needs computing is done in one vectorized pass over a
+	dates x symbols block cut from the price panel. Once computed, a metric
+	is reused for as long as the panel's dates up to the symbol's last bar
+	and its price on that bar don't change. When new bars arrive only the
+	tail, plus the window before it, is recomputed; a changed price (e.g. a
+	dividend moving adjclose) or dates inserted into the middle of the panel
+	mean starting over.
+	"""
+
+	def __init__(self, max_entries: int = MAX_ENTRIES):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.stats = {'hits': 0, 'tails': 0, 'full': 0}
+
+	def __repr__(self):
+		return f'RollingAnalytics({len(self.entries)} entries, {self.stats})'
+
+	def clear(self) -> None:
+		"""Drop every cached result"""
+		self.entries.clear()
+
+	@staticmethod
+	def _key(symbol: str, metric: str, window: int, benchmark: str) -> tuple:
+		return (
+			symbol,
+			metric,
+			None if metric in NO_WINDOW else window,
+			benchmark if metric == 'beta' else None
+		)
+
+	@staticmethod
+	def _lookback(metric: str, window: int) -> int:
+		"""Rows before the first one recomputed that the metric looks at"""
+		return 0 if metric in NO_WINDOW else window + 1
+
+	@staticmethod
+	def _usable(
+		entry: _Entry,
+		prices: panel.PricePanel,
+		symbol: str,
+		benchmark: str
+	) -> bool:
+		n = len(entry.values)
+		if n > len(prices.dates) or prices.dates[n - 1] != entry.last_date:
+			return False
+		if entry.valid_until < 0:
+			return True
+		row = entry.valid_until
+		return prices.last_value('adjclose', symbol, row) == entry.price and (
+			benchmark is None or np.array_equal(
+				prices.last_value('adjclose', benchmark, row),
+				entry.bench_price, equal_nan=True
+			)
+		)
+
+	@staticmethod
+	def _filled(prices: panel.PricePanel, symbols: list, first: int):
+		"""fill_prices of the symbols' adjclose from row first on, carrying
+		in the prices from before it"""
+		block = prices.values('adjclose', symbols, first).astype('float64')
+		if first and len(block):
+			for k, s in enumerate(symbols):
+				if np.isnan(block[0, k]):
+					block[0, k] = prices.last_value('adjclose', s, first)
+		return fill_prices(
+			block, np.array([prices.bounds[s][1] for s in symbols]) - first
+		)
+
+	@staticmethod
+	def _block(
+		metric: str,
+		prices: np.ndarray,
+		bench: np.ndarray,
+		window: int,
+		peaks: np.ndarray = None
+	) -> np.ndarray:
+		if metric == 'return':
+			return rolling_return(prices, window)
+		if metric == 'volatility':
+			return rolling_volatility(prices, window)
+		if metric == 'drawdown':
+			return drawdown(prices, peaks)
+		if metric == 'beta':
+			return rolling_beta(prices, bench, window)
+		raise ValueError(f'unknown metric "{metric}"')
+
+	def compute(
+		self,
+		prices: panel.PricePanel,
+		metric: str,
+		symbols: list,
+		window: int = 63,
+		benchmark: str = None,
+		start=None,
+		end=None
+	) -> pd.DataFrame:
+		"""dates x symbols frame of a metric between start and end.
+
+		metric is one of METRICS' values and window is in bars. Beta needs
+		a benchmark symbol that is in the panel.
+		"""
+		if metric == 'beta' and benchmark not in prices:
+			raise ValueError('rolling beta needs a benchmark in the panel')
+		symbols = [s for s in symbols if s in prices]
+		bench_symbol = benchmark if metric == 'beta' else None
+		dates = prices.dates
+		n = len(dates)
+		last_rows = np.array([prices.bounds[s][1] for s in symbols])
+
+		# Cache lookups only touch the row each entry was computed up to
+		results = {}
+		starts = {}
+		for j, s in enumerate(symbols):
+			key = self._key(s, metric, window, benchmark)
+			entry = self.entries.get(key)
+			if entry is None or \
+				not self._usable(entry, prices, s, bench_symbol):
+				starts[j] = 0
+			elif entry.valid_until >= last_rows[j] and len(entry.values) == n:
+				results[j] = entry.values
+				self.entries.move_to_end(key)
+				self.stats['hits'] += 1
+			else:
+				starts[j] = entry.valid_until + 1
+
+		# Symbols computed from scratch, then symbols only missing a tail,
+		# each from the prices the window looks back at only
+		for group in [
+			[j for j, x in starts.items() if x == 0],
+			[j for j, x in starts.items() if x > 0]
+		]:
+			if not group:
+				continue
+			first = max(0, min([starts[j] for j in group]) - self._lookback(
+				metric, window
+			))
+			filled = self._filled(prices, [symbols[j] for j in group], first)
+			bench = self._filled(prices, [benchmark], first)[:, 0] \
+				if bench_symbol is not None else None
+			peaks = np.array([
+				self.entries[self._key(symbols[j], metric, window, benchmark)].peak
+				if starts[j] else np.nan for j in group
+			]) if metric == 'drawdown' else None
+			block = self._block(metric, filled, bench, window, peaks)
+			for k, j in enumerate(group):
+				s = symbols[j]
+				key = self._key(s, metric, window, benchmark)
+				values = block[:, k]
+				if starts[j]:
+					old = self.entries[key].values
+					values = np.r_[old[:starts[j]], values[starts[j] - first:]]
+					self.stats['tails'] += 1
+				else:
+					self.stats['full'] += 1
+				valid_until = min(last_rows[j], n - 1)
+				row = valid_until - first
+				self.entries[key] = _Entry(
+					values,
+					dates[n - 1],
+					valid_until,
+					filled[row, k] if valid_until >= 0 else np.nan,
+					bench[row]
+					if bench is not None and valid_until >= 0 else np.nan,
+					np.fmax.reduce(np.r_[
+						peaks[k], filled[:row + 1, k]
+					]) if metric == 'drawdown' and valid_until >= 0 else np.nan
+				)
+				self.entries.move_to_end(key)
+				results[j] = values
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+
+		first, last = 0, n
+		if start is not None:
+			first = dates.searchsorted(pd.Timestamp(start))
+		if end is not None:
+			last = dates.searchsorted(pd.Timestamp(end), side='right')
+		return pd.DataFrame(
+			np.column_stack([
+				results[j][first:last] for j in range(len(symbols))
+			]) if symbols else np.empty((max(0, last - first), 0)),
+			index=dates[first:last],
+			columns=pd.Index(symbols, name='symbol')
+		)
@@ -1,10 +1,16 @@
 """Main app"""
-import analysis
+import importlib
+
+from collections import deque
+
+import cache
 import components
 import data
-import options
-import price
-import template
+import diagnostics
+import facets
+import fetch
+import panel
+import utils
 
 import streamlit as st
 
@@ -27,22 +33,119 @@ if not hasattr(STATE, 'symbols'):
 	STATE.symbols = []
 if not hasattr(STATE, 'symbols_data'):
 	STATE.symbols_data = {}
+if not hasattr(STATE, 'price_panel'):
+	STATE.price_panel = panel.PricePanel()
+if not hasattr(STATE, 'facets'):
+	STATE.facets = facets.FacetIndex()
+if not hasattr(STATE, 'memory'):
+	STATE.memory = cache.MemoryBudget(directory=data.SOURCE.cache_dir)
+if not hasattr(STATE, 'charts'):
+	STATE.charts = components.ChartCache()
+if not hasattr(STATE, 'traces'):
+	STATE.traces = deque(maxlen=diagnostics.MAX_TRACES)
 
 # ------------------------------------------------------------------------------
 # Initialize pages
 # ------------------------------------------------------------------------------
+# Page label: (module, class). A page's module (and whatever it imports) is
+# only imported the first time the page is selected.
 PAGES = {
-	# 'Overview': template.Page,
-	# 'Fundamental': template.Page,
-	'Price Data': price.Price,
-	# 'Analysts': template.Page,
-	'Options': options.Options,
-	'Portfolio Analysis': analysis.Analysis
+	# 'Overview': ('template', 'Page'),
+	# 'Fundamental': ('template', 'Page'),
+	'Price Data': ('price', 'Price'),
+	# 'Analysts': ('template', 'Page'),
+	'Options': ('options', 'Options'),
+	'Portfolio Analysis': ('analysis', 'Analysis')
 }
 
 
+def load_page(name: str) -> type:
+	"""Page class of a PAGES entry"""
+	module, page = PAGES[name]
+	return getattr(importlib.import_module(module), page)
+
+
+def add_symbols(
+	symbols: list, p_cont: st.container, m_cont: st.container
+) -> fetch.FetchResult:
+	"""Get metadata for new symbols, with a progress bar, and add them to
+	the session"""
+	def update_progress(n_done: int, n_total: int, chunk: str):
+		"""Update the progress bar"""
+		info_container.text(f'Got {chunk} ({n_done}/{n_total} chunks)')
+		progress.progress(n_done / n_total)
+
+	info_container = m_cont.empty()
+	progress_cont = p_cont.empty()
+	n_new = len([x for x in symbols if x not in STATE.symbols_data])
+	info_container.text(f'Getting data for {n_new} symbols')
+	progress = progress_cont.progress(0)
+	result = data.get_data(
+		symbols, STATE.symbols_data, on_complete=update_progress
+	)
+	for s, symbol_obj in result.loaded.items():
+		STATE.symbols.append(s)
+		STATE.symbols_data[s] = symbol_obj
+		STATE.facets.add(symbol_obj)
+	info_container.empty()
+	progress_cont.empty()
+
+	STATE.symbols = sorted(STATE.symbols)
+	STATE.symbols_data = {
+		k: STATE.symbols_data[k]
+		for k in sorted(list(STATE.symbols_data.keys()))
+	}
+	return result
+
+
+def show_diagnostics(container: st.container) -> None:
+	"""Where the last rerun's time went, and recent reruns to download"""
+	container.checkbox(
+		'Record timings', value=diagnostics.ENABLED, key='record_timings',
+		help='''Times every stage of each rerun and counts the requests made
+		to Yahoo! Finance, per endpoint. Bytes are the in-memory size of
+		what came back.'''
+	)
+	if not STATE.traces:
+		container.caption('Nothing recorded yet')
+		return
+	trace = STATE.traces[-1]
+	container.markdown(f'''
+	**Last rerun:** {trace.duration * 1e3:,.0f}ms, {len(trace.spans)} spans
+	''')
+	summary = trace.summary()
+	summary[['seconds', 'max']] *= 1e3
+	container.dataframe(summary.rename(
+		columns={'seconds': 'total ms', 'max': 'max ms'}
+	).style.format(
+		{'total ms': '{:,.1f}', 'max ms': '{:,.1f}', 'share': '{:.0%}'}
+	))
+	counters = trace.counter_frame()
+	if not counters.empty:
+		counters['bytes'] = counters['bytes'].map(utils.signify)
+		container.dataframe(counters.style.format({'seconds': '{:.2f}'}))
+	traces = list(STATE.traces)
+	container.download_button(
+		f'Download {len(traces)} reruns as JSON',
+		data=diagnostics.to_json(traces),
+		file_name='stocktime-trace.json',
+		mime='application/json'
+	)
+	container.download_button(
+		'Download as Chrome trace',
+		data=diagnostics.chrome_trace(traces),
+		file_name='stocktime-chrome-trace.json',
+		mime='application/json',
+		help='Opens in chrome://tracing or ui.perfetto.dev'
+	)
+
+
 def main() -> None:
 	"""run app -- FYI this function is mainly sidebar setup"""
+	# A rerun that was cut short leaves its trace behind on the thread
+	diagnostics.stop()
+	if getattr(STATE, 'record_timings', diagnostics.ENABLED):
+		diagnostics.start()
 	# --------------------------------------------------------------------------
 	# Initialize sidebar
 	# --------------------------------------------------------------------------
@@ -84,17 +187,26 @@ def main() -> None:
 			and AaPL will all be read as AAPL.''',
 	)
 	if new_symbols.parsed_input:
-		data.get_data(
-			sorted(new_symbols.parsed_input),
-			input_container,
-			new_symbols.progressmsg_container,
-			STATE
-		)
+		with diagnostics.span(
+			'add symbols', symbols=len(new_symbols.parsed_input)
+		):
+			fetch_result = add_symbols(
+				sorted(new_symbols.parsed_input),
+				input_container,
+				new_symbols.progressmsg_container
+			)
+		if fetch_result.errors:
+			input_container.warning(
+				f'Could not get data for {len(fetch_result.errors)} '
+				f'symbol(s):\n{fetch_result.error_report()}'
+			)
 		info_container.empty()
 		filter_info_container.empty()
 	# --------------------------------------------------------------------------
 	# Symbols filter
 	# --------------------------------------------------------------------------
+	with diagnostics.span('facets sync'):
+		STATE.facets.sync(STATE.symbols_data)
 	select_all = filter_container.checkbox('Select All Symbols') \
 		if STATE.symbols_data else False
 
@@ -112,33 +224,28 @@ def main() -> None:
 			"Exclude" means that all symbols will be selected that ***do not***
 			meet the "Filter by:" criteria.   
 		''')
-		default_symbols = [] \
-			if filter_type == 'Any' else list(STATE.symbols_data.keys())
+		default_symbols = set() \
+			if filter_type == 'Any' else STATE.facets.symbols
 		for filter_group in [
 			{'asset_type': 'Asset Type'},
 			{'home_exchange': 'Exchange'},
 			{'sector': 'Sector', 'industry': 'Industry'},
 			{'country': 'Country', 'state': 'State', 'city': 'City'}
 		]:
-
-			input_objects = STATE.symbols_data if filter_type == 'Any' else \
-				{
-					k: v for k, v in STATE.symbols_data.items()
-					if k in default_symbols
-				}
-
 			symbol_group = components.SymbolsFilter(
 				container=filter_container,
-				input_objects=input_objects,
+				facet_index=STATE.facets,
+				universe=None if filter_type == 'Any' else default_symbols,
 				radio_description='Filter by:',
 				radio_options=filter_group,
 				filter_type=filter_type
 			).output
 
 			if filter_type == 'Any':
-				default_symbols += symbol_group
+				default_symbols |= set(symbol_group)
 			else:
-				default_symbols = symbol_group
+				default_symbols = set(symbol_group)
+		default_symbols = sorted(default_symbols)
 
 	if default_symbols:
 		selected_symbols_container.info('''
@@ -158,10 +265,46 @@ def main() -> None:
 	# Get page to run
 	# --------------------------------------------------------------------------
 	selected_page = sidebar.radio('Selected Page', options=PAGES.keys())
+	memory_container = sidebar.expander('Memory Usage', expanded=False)
+	diagnostics_container = sidebar.expander('Diagnostics', expanded=False)
 	# --------------------------------------------------------------------------
 	# Run selected page
 	# --------------------------------------------------------------------------
-	PAGES[selected_page](selected_symbols, STATE).runpage(STATE)
+	with diagnostics.span('page', page=selected_page):
+		with diagnostics.span('page setup'):
+			page = load_page(selected_page)(selected_symbols, STATE)
+		page.runpage(STATE)
+	# --------------------------------------------------------------------------
+	# Memory usage (after the page, so sections it loaded are counted)
+	# --------------------------------------------------------------------------
+	if STATE.symbols_data:
+		with diagnostics.span('memory report'):
+			report = utils.memory_report(STATE.symbols_data)
+		shared = cache.SHARED.stats()
+		memory_container.markdown(f'''
+		**Symbols:** {utils.signify(report.values.sum())}  
+		**Session budget:** {utils.signify(STATE.memory.max_bytes)} 
+		({STATE.memory.evictions} evictions)  
+		**Price panel:** {utils.signify(STATE.price_panel.nbytes)}  
+		**Shared cache:** {utils.signify(shared['bytes'])} of 
+		{utils.signify(shared['max_bytes'])} ({shared['entries']} entries)  
+		**Charts:** {len(STATE.charts.entries)} cached 
+		({STATE.charts.hits} hits, {STATE.charts.misses} misses)
+		''')
+		memory_container.dataframe(
+			report.sum().map(utils.signify).to_frame('size')
+		)
+		report.insert(0, 'total', report.sum(axis=1))
+		memory_container.dataframe(
+			report.sort_values('total', ascending=False).applymap(utils.signify)
+		)
+	# --------------------------------------------------------------------------
+	# Diagnostics (the rerun is over, apart from drawing them)
+	# --------------------------------------------------------------------------
+	trace = diagnostics.stop()
+	if trace is not None:
+		STATE.traces.append(trace)
+	show_diagnostics(diagnostics_container)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+"""Hot path benchmarks: data loading, filters, charts and portfolios
+
+Usage
+-----
+python benchmarks/hotpaths.py [--symbols 1 10 100 500] [--years 5]
+	[--expiries 8] [--strikes 25] [--repeat 5] [--json results.json]
+	[--compare baseline.json]
+
+Everything runs in this process against the synthetic data source (no
+network), with the caches in a temporary directory, so runs on the same
+machine are comparable across commits. The request rate limiter is
+turned off (unless --rate-limit), since it's there to be polite to
+Yahoo and would otherwise dominate the loading cases. Each case is timed
+--repeat times for every symbol count; the JSON output has the median and
+the minimum of every case. With --compare, cases whose median got slower than
+--threshold times the baseline's are listed and the exit code is 1.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Fixed, so the synthetic data doesn't change from one day to the next
+END_DATE = '2024-12-31'
+CASES = [
+	'get_data',
+	'history_cold',
+	'history_warm',
+	'option_chains',
+	'implied_volatility',
+	'concat_obj_data',
+	'panel_sync',
+	'chart_filter_dates',
+	'plot_line',
+	'plot_ohlc',
+	'chart_cached',
+	'filter_any',
+	'filter_all',
+	'filter_exclude',
+	'portfolio_daily',
+	'portfolio_monthly',
+	'portfolio_threshold'
+]
+
+
+def _time(func, repeat: int, setup=None) -> dict:
+	"""Seconds func takes, setup (untimed) running before every call"""
+	runs = []
+	for _ in range(repeat):
+		args = setup() if setup is not None else ()
+		start = time.perf_counter()
+		func(*args)
+		runs.append(time.perf_counter() - start)
+	return {
+		'median_seconds': statistics.median(runs),
+		'min_seconds': min(runs),
+		'runs': runs
+	}
+
+
+def _commit() -> str:
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', '--short', 'HEAD'],
+			cwd=ROOT, capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run_cases(
+	n_symbols: int,
+	repeat: int,
+	cases: list,
+	cache_dir: str,
+	source,
+	rate_limit: bool = False
+) -> dict:
+	"""Time every case for n_symbols symbols"""
+	import cache
+	import components
+	import data
+	import facets
+	import fetch
+	import panel
+	import pricing
+	import snapshots
+	import utils
+	import streamlit as st
+
+	from analysis import Analysis
+
+	# The benchmark is about the hot paths, not about writing snapshots
+	snapshots.ENABLED = False
+	# fetch.call holds on to the limiter it was defined with, so open it up
+	# rather than replacing it
+	limiter = fetch.RateLimiter() if rate_limit \
+		else fetch.RateLimiter(rate=1e12, capacity=1e12)
+	fetch.LIMITER.rate = limiter.rate
+	fetch.LIMITER.capacity = fetch.LIMITER.tokens = limiter.capacity
+	cache.CACHE_DIR = cache_dir
+	data.set_source(source)
+	symbols = [f'S{i:03d}' for i in range(n_symbols)]
+	results = {}
+
+	def fresh(section: str, cold: bool = False):
+		"""New SymbolData objects with nothing loaded"""
+		cache.SHARED.clear()
+		if cold:
+			shutil.rmtree(data.PRICE_CACHE.directory, ignore_errors=True)
+		objs = [data.SymbolData(s) for s in symbols]
+		if section != 'metadata':
+			data.load_sections(objs, ['metadata'])
+		return (objs,)
+
+	def timed(case: str, func, setup=None):
+		if case in cases:
+			results[case] = _time(func, repeat, setup)
+
+	timed(
+		'get_data',
+		lambda: data.get_data(symbols, {}),
+		lambda: cache.SHARED.clear() or ()
+	)
+	timed(
+		'history_cold',
+		lambda objs: data.load_sections(objs, ['historical_prices']),
+		lambda: fresh('historical_prices', cold=True)
+	)
+	timed(
+		'history_warm',
+		lambda objs: data.load_sections(objs, ['historical_prices']),
+		lambda: fresh('historical_prices')
+	)
+	timed(
+		'option_chains',
+		lambda objs: data.load_sections(objs, ['option_chain']),
+		lambda: fresh('option_chain')
+	)
+
+	# Everything below works on one loaded session
+	cache.SHARED.clear()
+	symbols_data = data.get_data(symbols, {}).loaded
+	objs = list(symbols_data.values())
+	data.load_sections(objs, ['historical_prices', 'option_chain'])
+
+	spots = {x.symbol: float(x.historical_prices['close'].iloc[-1]) for x in objs}
+	asof = {x.symbol: x.historical_prices.index[-1] for x in objs}
+	timed('implied_volatility', lambda: pricing.analyze_chains(
+		{x.symbol: x.option_chain for x in objs}, spots, asof
+	))
+	timed('concat_obj_data', lambda: utils.concat_obj_data(symbols_data))
+	timed(
+		'panel_sync',
+		lambda p: p.sync(symbols_data, symbols),
+		lambda: (panel.PricePanel(),)
+	)
+
+	prices = panel.PricePanel()
+	prices.sync(symbols_data, symbols)
+	chart = components.TimeSeriesChart(st, symbols, prices)
+	periods = ['1wk', '1mo', '3mo', '6mo', '1Y', '2Y', '5Y', '10Y', 'all']
+	timed('chart_filter_dates', lambda: [
+		chart._filter_dates(prices, symbols, p) for p in periods
+	])
+	frame = prices.frame(symbols, start=chart.start_date, end=chart.end_date)
+	timed('plot_line', lambda: chart._plot_time_series(
+		frame, 'line', 'adjclose', True, False
+	))
+	timed('plot_ohlc', lambda: chart._plot_time_series(
+		frame, 'OHLC', 'adjclose', True, False
+	))
+	charts = components.ChartCache()
+	components.TimeSeriesChart(st, symbols, prices, cache=charts)
+	timed('chart_cached', lambda: components.TimeSeriesChart(
+		st, symbols, prices, cache=charts
+	))
+
+	index = facets.FacetIndex()
+	for x in objs:
+		index.add(x)
+	universe = index.symbols
+	sectors = index.options('sector')
+	filter_by = sectors[:max(1, len(sectors) // 2)]
+	for case, method in [
+		('filter_any', components.SymbolsFilter._filter_any),
+		('filter_all', components.SymbolsFilter._filter_all),
+		('filter_exclude', components.SymbolsFilter._filter_exclude)
+	]:
+		timed(case, lambda m=method: m(index, universe, 'sector', filter_by))
+
+	matrix = prices.matrix('adjclose', symbols, chart.start_date, chart.end_date)
+	weights = {s: 1 / len(symbols) for s in symbols}
+	for mode in ['daily', 'monthly', 'threshold']:
+		timed(f'portfolio_{mode}', lambda m=mode: Analysis._build_portfolio(
+			weights, matrix, m
+		))
+	return {
+		'bars': int(sum(len(x.historical_prices) for x in objs)),
+		'contracts': int(sum(len(x.option_chain) for x in objs)),
+		'cases': results
+	}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+	"""(case, symbols, baseline median, median) of every case that got
+	slower than threshold times the baseline"""
+	slower = []
+	for n, entry in results['symbols'].items():
+		old_cases = baseline.get('symbols', {}).get(n, {}).get('cases', {})
+		for case, timing in entry['cases'].items():
+			if case not in old_cases:
+				continue
+			old = old_cases[case]['median_seconds']
+			new = timing['median_seconds']
+			print(
+				f'{case:>20} {n:>4} symbols: {old * 1e3:10.3f}ms -> '
+				f'{new * 1e3:10.3f}ms ({new / old if old else float("inf"):.2f}x)'
+			)
+			if old and new > threshold * old:
+				slower.append((case, n, old, new))
+	return slower
+
+
+def main(argv: list = None) -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument(
+		'--symbols', type=int, nargs='+', default=[1, 10, 100],
+		help='symbol counts to run every case for (1 to 500)'
+	)
+	parser.add_argument(
+		'--years', type=float, default=5, help='years of daily history'
+	)
+	parser.add_argument(
+		'--expiries', type=int, default=8, help='expiries per option chain'
+	)
+	parser.add_argument(
+		'--strikes', type=int, default=25, help='strikes per expiry'
+	)
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument(
+		'--cases', nargs='+', choices=CASES, default=CASES,
+		help='only run these cases'
+	)
+	parser.add_argument(
+		'--rate-limit', action='store_true',
+		help='keep the app\'s request rate limiter on'
+	)
+	parser.add_argument('--json', help='write the results here')
+	parser.add_argument('--compare', help='results of an earlier run')
+	parser.add_argument(
+		'--threshold', type=float, default=1.25,
+		help='slowdown against --compare that counts as a regression'
+	)
+	args = parser.parse_args(argv)
+	if any(not 1 <= n <= 500 for n in args.symbols):
+		parser.error('--symbols must be between 1 and 500')
+
+	os.environ.setdefault('STOCKTIME_SOURCE', 'synthetic')
+	# Not being under `streamlit run` is the point here
+	from streamlit import config
+	config.set_option('global.showWarningOnDirectExecution', False)
+	import numpy as np
+	import pandas as pd
+
+	import sources
+
+	source = sources.SyntheticSource(
+		years=args.years,
+		expiries=args.expiries,
+		strikes=args.strikes,
+		end=END_DATE
+	)
+	results = {
+		'meta': {
+			'commit': _commit(),
+			'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'pandas': pd.__version__,
+			'machine': platform.machine(),
+			'cpus': os.cpu_count(),
+			'params': {
+				'years': args.years,
+				'expiries': args.expiries,
+				'strikes': args.strikes,
+				'repeat': args.repeat,
+				'rate_limit': args.rate_limit,
+				'end_date': END_DATE
+			}
+		},
+		'symbols': {}
+	}
+	with tempfile.TemporaryDirectory(prefix='stocktime-bench-') as cache_dir:
+		for n in args.symbols:
+			entry = run_cases(
+				n, args.repeat, args.cases, cache_dir, source, args.rate_limit
+			)
+			results['symbols'][str(n)] = entry
+			for case, timing in entry['cases'].items():
+				print(
+					f'{case:>20} {n:>4} symbols: '
+					f'{timing["median_seconds"] * 1e3:10.3f}ms median, '
+					f'{timing["min_seconds"] * 1e3:10.3f}ms min'
+				)
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		print(f'\ncompared with {args.compare} ({baseline["meta"].get("commit")})')
+		slower = compare(results, baseline, args.threshold)
+		for case, n, old, new in slower:
+			print(
+				f'  slower: {case} with {n} symbols '
+				f'({new / old:.2f}x, threshold {args.threshold}x)'
+			)
+		return 1 if slower else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
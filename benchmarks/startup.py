@@ -0,0 +1,168 @@
+"""Startup benchmark: import time and time to first render
+
+Usage
+-----
+python benchmarks/startup.py [--runs 5] [--json startup.json]
+
+Import time is measured in fresh interpreters, along with which heavy
+modules importing app.py pulled in (none of them should be). Time to first
+render starts a headless streamlit server, connects to it the way a browser
+does and times the first script run, from connecting until streamlit
+reports the run finished, followed by a few reruns. Uses the synthetic data
+source unless STOCKTIME_SOURCE is set.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that app.py shouldn't import until a page or chart needs them
+HEAVY_MODULES = [
+	'plotly', 'yahooquery', 'price', 'options', 'analysis', 'portfolio'
+]
+IMPORT_SCRIPT = f'''
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({{
+	'seconds': time.perf_counter() - start,
+	'heavy': [x for x in {HEAVY_MODULES!r} if x in sys.modules]
+}}))
+'''
+
+
+def _env() -> dict:
+	env = dict(os.environ)
+	env.setdefault('STOCKTIME_SOURCE', 'synthetic')
+	env['PYTHONPATH'] = os.pathsep.join(
+		[ROOT] + [x for x in [env.get('PYTHONPATH')] if x]
+	)
+	return env
+
+
+def import_time(runs: int) -> dict:
+	"""Seconds to import app.py in a fresh interpreter"""
+	times = []
+	heavy = []
+	for _ in range(runs):
+		out = subprocess.run(
+			[sys.executable, '-c', IMPORT_SCRIPT],
+			cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+		)
+		result = json.loads(out.stdout.strip().splitlines()[-1])
+		times.append(result['seconds'])
+		heavy = result['heavy']
+	return {
+		'median_seconds': statistics.median(times),
+		'min_seconds': min(times),
+		'runs': times,
+		'heavy_modules_imported': heavy
+	}
+
+
+def _free_port() -> int:
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def _wait_for_server(port: int, timeout: float) -> None:
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			with urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz') as r:
+				if r.status == 200:
+					return
+		except OSError:
+			time.sleep(0.05)
+	raise TimeoutError(f'streamlit did not start within {timeout}s')
+
+
+async def _script_runs(port: int, n_runs: int, timeout: float) -> list:
+	"""Seconds each script run takes, as seen from a browser session"""
+	from streamlit.proto.BackMsg_pb2 import BackMsg
+	from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+	from tornado.websocket import websocket_connect
+
+	times = []
+	start = time.perf_counter()
+	conn = await websocket_connect(f'ws://127.0.0.1:{port}/stream')
+	for _ in range(n_runs):
+		msg = BackMsg()
+		msg.rerun_script.query_string = ''
+		await conn.write_message(msg.SerializeToString(), binary=True)
+		while True:
+			raw = await conn.read_message()
+			if raw is None:
+				raise ConnectionError('streamlit closed the connection')
+			fwd = ForwardMsg()
+			fwd.ParseFromString(raw)
+			if fwd.WhichOneof('type') == 'report_finished':
+				break
+			if time.perf_counter() - start > timeout:
+				raise TimeoutError(f'script run took more than {timeout}s')
+		times.append(time.perf_counter() - start)
+		start = time.perf_counter()
+	conn.close()
+	return times
+
+
+def first_render(reruns: int = 5, timeout: float = 120.0) -> dict:
+	"""Server start up, first script run and rerun times"""
+	from tornado.ioloop import IOLoop
+
+	port = _free_port()
+	start = time.perf_counter()
+	server = subprocess.Popen(
+		[
+			sys.executable, '-m', 'streamlit', 'run', 'app.py',
+			'--server.headless', 'true',
+			'--server.port', str(port),
+			'--browser.gatherUsageStats', 'false'
+		],
+		cwd=ROOT, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+	)
+	try:
+		_wait_for_server(port, timeout)
+		ready = time.perf_counter() - start
+		first, *rest = IOLoop.current().run_sync(
+			lambda: _script_runs(port, 1 + reruns, timeout)
+		)
+	finally:
+		server.terminate()
+		server.wait()
+	return {
+		'server_ready_seconds': ready,
+		'first_render_seconds': first,
+		'time_to_first_render_seconds': ready + first,
+		'rerun_median_seconds': statistics.median(rest) if rest else None
+	}
+
+
+def main(argv: list = None) -> dict:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--runs', type=int, default=5)
+	parser.add_argument('--json', help='also write the results here')
+	parser.add_argument(
+		'--skip-render', action='store_true',
+		help="only measure import time (doesn't start a server)"
+	)
+	args = parser.parse_args(argv)
+	results = {'import': import_time(args.runs)}
+	if not args.skip_render:
+		results['render'] = first_render(args.runs)
+	print(json.dumps(results, indent=2))
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=2)
+	return results
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,389 @@
+"""Caches shared by every session: price history on disk and data in memory"""
+import datetime as dt
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from collections import OrderedDict
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get(
+	'STOCKTIME_CACHE_DIR',
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+)
+# Total size the price files are allowed to take up on disk
+MAX_BYTES = int(os.environ.get('STOCKTIME_CACHE_MAX_BYTES', 2 * 1024**3))
+# Cached history younger than this is used without asking Yahoo for new bars
+MAX_AGE = dt.timedelta(
+	minutes=float(os.environ.get('STOCKTIME_CACHE_MAX_AGE_MINUTES', 60*12))
+)
+# Memory the in-process cache is allowed to use across all sessions
+SHARED_MAX_BYTES = int(
+	os.environ.get('STOCKTIME_SHARED_CACHE_MAX_BYTES', 1024**3)
+)
+# Memory one session's price histories and option chains may take up
+SESSION_MAX_BYTES = int(
+	os.environ.get('STOCKTIME_SESSION_MAX_BYTES', 512 * 1024**2)
+)
+# Write evicted sections to disk rather than fetching them again later
+SPILL = os.environ.get('STOCKTIME_SPILL', '1') != '0'
+# Spill directories untouched for this long belong to sessions that ended
+# without cleaning up (like when the server was killed)
+SPILL_MAX_AGE = dt.timedelta(
+	hours=float(os.environ.get('STOCKTIME_SPILL_MAX_AGE_HOURS', 24))
+)
+# How long each SymbolData section stays valid in the in-process cache.
+# Metadata only keeps the exchange names from the price endpoint, not the
+# quote itself, so a day old copy is fine; a section showing live prices
+# would need a TTL of its own here.
+TTL = {
+	'metadata': dt.timedelta(days=1),
+	'historical_prices': dt.timedelta(hours=12),
+	'option_chain': dt.timedelta(minutes=15)
+}
+
+
+class PriceCache:
+	"""Price history stored as one Parquet file per (symbol, interval).
+
+	Files older than max_age are stale: the caller should fetch the bars
+	from last_date() onwards and pass them to append(). prune() deletes the
+	least recently written files once the directory grows past max_bytes.
+	"""
+
+	def __init__(
+		self,
+		directory: str = CACHE_DIR,
+		max_bytes: int = MAX_BYTES,
+		max_age: dt.timedelta = MAX_AGE
+	):
+		self.directory = os.path.join(directory, 'prices')
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self.timings = {'cold': [0, 0.0], 'warm': [0, 0.0]}
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return f'PriceCache({self.directory})'
+
+	def _path(self, symbol: str, interval: str) -> str:
+		name = symbol.replace(os.sep, '_')
+		return os.path.join(self.directory, interval, f'{name}.parquet')
+
+	def load(self, symbol: str, interval: str = '1d') -> pd.DataFrame:
+		"""Cached history, or None if there is none (or it can't be read)"""
+		path = self._path(symbol, interval)
+		if not os.path.exists(path):
+			return None
+		try:
+			return pd.read_parquet(path)
+		except Exception as e:
+			print(f'cache err {symbol}: {e}')
+			os.remove(path)
+			return None
+
+	def is_stale(self, symbol: str, interval: str = '1d') -> bool:
+		"""True if the cached history is missing or older than max_age"""
+		path = self._path(symbol, interval)
+		if not os.path.exists(path):
+			return True
+		age = time.time() - os.path.getmtime(path)
+		return age > self.max_age.total_seconds()
+
+	@staticmethod
+	def last_date(history: pd.DataFrame):
+		"""Date of the last cached bar"""
+		return history.index.max()
+
+	def save(
+		self, symbol: str, history: pd.DataFrame, interval: str = '1d'
+	) -> pd.DataFrame:
+		"""Replace the cached history of a symbol"""
+		write_atomic(self._path(symbol, interval), history.to_parquet)
+		return history
+
+	def append(
+		self,
+		symbol: str,
+		history: pd.DataFrame,
+		new_bars: pd.DataFrame,
+		interval: str = '1d'
+	) -> pd.DataFrame:
+		"""Add newly fetched bars to the cached history of a symbol.
+
+		The last cached bar may have been written mid-session, so bars in
+		new_bars overwrite cached bars with the same date.
+		"""
+		if new_bars is not None and not new_bars.empty:
+			history = pd.concat([
+				history.loc[~history.index.isin(new_bars.index)], new_bars
+			]).sort_index()
+		return self.save(symbol, history, interval)
+
+	def size(self) -> int:
+		"""Bytes used on disk"""
+		return sum(os.path.getsize(path) for path in self._files())
+
+	def _files(self) -> list:
+		if not os.path.isdir(self.directory):
+			return []
+		return [
+			os.path.join(root, f)
+			for root, _, files in os.walk(self.directory)
+			for f in files if f.endswith('.parquet')
+		]
+
+	def prune(self) -> None:
+		"""Delete the least recently written files until under max_bytes,
+		and spill directories left behind by old sessions"""
+		prune_spill(os.path.dirname(self.directory))
+		with self.lock:
+			files = []
+			for path in self._files():
+				try:
+					files.append(
+						(os.path.getmtime(path), os.path.getsize(path), path)
+					)
+				except FileNotFoundError:
+					continue
+			total = sum(size for _, size, _ in files)
+			for _, size, path in sorted(files):
+				if total <= self.max_bytes:
+					break
+				os.remove(path)
+				total -= size
+
+	def record_timing(self, kind: str, n_symbols: int, seconds: float) -> None:
+		"""Keep track of how long cold (full) and warm (cached) loads take"""
+		with self.lock:
+			self.timings[kind][0] += n_symbols
+			self.timings[kind][1] += seconds
+
+	def timing_report(self) -> str:
+		"""Summary of cold and warm load times"""
+		return '; '.join([
+			f'{kind}: {n} symbols in {seconds:.1f}s '
+			f'({seconds / n:.3f}s per symbol)'
+			for kind, (n, seconds) in self.timings.items() if n
+		])
+
+
+def write_atomic(path: str, write) -> None:
+	"""Call write(tmp_path) on a temporary file next to path, then move it
+	into place, so readers never see a half written file. Every call gets
+	its own temporary file, so sessions writing the same path at once
+	can't move each other's unfinished files into place."""
+	directory = os.path.dirname(path)
+	os.makedirs(directory, exist_ok=True)
+	with tempfile.NamedTemporaryFile(
+		dir=directory, prefix=f'{os.path.basename(path)}.', suffix='.tmp',
+		delete=False
+	) as f:
+		tmp_path = f.name
+	try:
+		write(tmp_path)
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+
+def prune_spill(
+	directory: str = CACHE_DIR, max_age: dt.timedelta = SPILL_MAX_AGE
+) -> None:
+	"""Delete session spill directories nothing was written to or read
+	from in max_age"""
+	root = os.path.join(directory, 'spill')
+	if not os.path.isdir(root):
+		return
+	cutoff = time.time() - max_age.total_seconds()
+	for name in os.listdir(root):
+		path = os.path.join(root, name)
+		try:
+			# Restoring a section deletes its file, which counts as a use
+			last_used = max(
+				os.path.getmtime(os.path.join(dirpath, x))
+				for dirpath, dirs, files in os.walk(path)
+				for x in ['.'] + files
+			)
+		except (FileNotFoundError, ValueError):
+			continue
+		if last_used < cutoff:
+			shutil.rmtree(path, ignore_errors=True)
+
+
+def sizeof(value) -> int:
+	"""Rough number of bytes held by a cached value"""
+	if isinstance(value, (pd.DataFrame, pd.Series)):
+		usage = value.memory_usage(deep=True)
+		return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+	if isinstance(value, dict):
+		return sys.getsizeof(value) + sum(
+			sizeof(k) + sizeof(v) for k, v in value.items()
+		)
+	if isinstance(value, (list, tuple, set)):
+		return sys.getsizeof(value) + sum(sizeof(x) for x in value)
+	return sys.getsizeof(value)
+
+
+class SharedCache:
+	"""In-memory cache of SymbolData sections shared by every session.
+
+	Entries are keyed by (symbol, section) and expire after the section's
+	TTL. When the total size goes over max_bytes, the least recently used
+	entries are evicted. Sessions keep references to the cached objects
+	rather than copies, so cached values must never be modified in place.
+	"""
+
+	def __init__(self, max_bytes: int = SHARED_MAX_BYTES, ttl: dict = None):
+		self.max_bytes = max_bytes
+		self.ttl = ttl if ttl is not None else TTL
+		self.entries = OrderedDict()
+		self.bytes = 0
+		self.hits = {}
+		self.misses = {}
+		self.evictions = 0
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return f'SharedCache({len(self.entries)} entries, {self.bytes} bytes)'
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key: tuple) -> bool:
+		"""(symbol, section) is cached and not expired, without counting it"""
+		with self.lock:
+			entry = self.entries.get(key)
+			return entry is not None and time.monotonic() <= entry[1]
+
+	def _count(self, counter: dict, section: str) -> None:
+		counter[section] = counter.get(section, 0) + 1
+
+	def get(self, symbol: str, section: str):
+		"""Cached value, or None if it was never cached or has expired"""
+		key = (symbol, section)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and time.monotonic() > entry[1]:
+				self._remove(key)
+				entry = None
+			if entry is None:
+				self._count(self.misses, section)
+				return None
+			self.entries.move_to_end(key)
+			self._count(self.hits, section)
+			return entry[0]
+
+	def put(self, symbol: str, section: str, value) -> None:
+		"""Cache a value, evicting the least recently used if over budget"""
+		key = (symbol, section)
+		ttl = self.ttl.get(section, max(self.ttl.values()))
+		size = sizeof(value)
+		with self.lock:
+			if key in self.entries:
+				self._remove(key)
+			if size > self.max_bytes:
+				return
+			expires = time.monotonic() + ttl.total_seconds()
+			self.entries[key] = (value, expires, size)
+			self.bytes += size
+			while self.bytes > self.max_bytes:
+				self._remove(next(iter(self.entries)))
+				self.evictions += 1
+
+	def _remove(self, key: tuple) -> None:
+		_, _, size = self.entries.pop(key)
+		self.bytes -= size
+
+	def clear(self) -> None:
+		"""Drop every entry"""
+		with self.lock:
+			self.entries.clear()
+			self.bytes = 0
+
+	def stats(self) -> dict:
+		"""Hit/miss counters per section plus overall usage"""
+		with self.lock:
+			sections = sorted(set(self.hits) | set(self.misses))
+			return {
+				'entries': len(self.entries),
+				'bytes': self.bytes,
+				'max_bytes': self.max_bytes,
+				'evictions': self.evictions,
+				'sections': {
+					x: {
+						'hits': self.hits.get(x, 0),
+						'misses': self.misses.get(x, 0)
+					} for x in sections
+				}
+			}
+
+
+# One instance per server process, so every session shares it
+SHARED = SharedCache()
+
+
+class MemoryBudget:
+	"""Per-session limit on memory held by heavy SymbolData sections.
+
+	Pages touch() the symbols they show. Once the sections held add up to
+	more than max_bytes, victims() names the least recently used symbols to
+	let go of. Evicted sections are written under spill_dir if it is set,
+	which is deleted along with the budget when the session ends.
+	"""
+
+	def __init__(
+		self,
+		max_bytes: int = SESSION_MAX_BYTES,
+		spill: bool = SPILL,
+		directory: str = CACHE_DIR
+	):
+		self.max_bytes = max_bytes
+		self.spill_dir = os.path.join(
+			directory, 'spill', uuid.uuid4().hex
+		) if spill else None
+		if self.spill_dir is not None:
+			weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+		self.recent = OrderedDict()
+		self.evictions = 0
+
+	def __repr__(self):
+		return f'MemoryBudget({self.max_bytes} bytes, {self.evictions} evictions)'
+
+	def touch(self, symbols: list) -> None:
+		"""Mark symbols as just used"""
+		for s in symbols:
+			self.recent[s] = None
+			self.recent.move_to_end(s)
+
+	def victims(self, sizes: dict, pinned: list = None) -> list:
+		"""Least recently used symbols to evict to get sizes under budget.
+
+		sizes maps each symbol to the bytes its heavy sections hold. Symbols
+		never touched go first, pinned ones are never picked.
+		"""
+		excess = sum(sizes.values()) - self.max_bytes
+		if excess <= 0:
+			return []
+		pinned = set(pinned or [])
+		order = [s for s in sizes if s not in self.recent] + \
+			[s for s in self.recent if s in sizes]
+		out = []
+		for s in order:
+			if excess <= 0:
+				break
+			if s in pinned or not sizes[s]:
+				continue
+			out.append(s)
+			excess -= sizes[s]
+		for s in out:
+			self.recent.pop(s, None)
+		return out
@@ -1,13 +1,32 @@
 """Components built around streamlit widgets"""
+import os
 import random
+import time
+
+from collections import OrderedDict
 
 import datetime as dt
-import plotly.graph_objs as go
+import data
+import diagnostics
+import downsample
+import facets
+import intraday
+import panel
 import pandas as pd
 import streamlit as st
 
-from copy import deepcopy
-from typing import Dict
+
+# Most points sent to the browser for one chart, and for one series in it
+POINT_BUDGET = 60000
+MAX_POINTS_PER_SERIES = 3000
+# Above this many points lines are drawn with WebGL
+WEBGL_THRESHOLD = 10000
+# Bars per symbol the bar size is picked for, about one per pixel of a wide
+# chart (fewer when the points budget is split between many symbols)
+CHART_BARS = int(os.environ.get('STOCKTIME_CHART_BARS', 1000))
+# Charts kept per session by ChartCache
+MAX_CHARTS = int(os.environ.get('STOCKTIME_CHART_CACHE_ENTRIES', 8))
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adjclose']
 
 
 class SymbolsInput:
@@ -87,16 +106,21 @@ class SymbolsInput:
 
 class SymbolsFilter:
 	"""Component with radio buttons and a dropdown."""
+	@diagnostics.timed('SymbolsFilter')
 	def __init__(
 		self,
 		container: st.container,
-		input_objects: Dict[str, object] = None,
+		facet_index: facets.FacetIndex = None,
+		universe: set = None,
 		title: str = None,
 		title_importance: int = 4,
 		radio_description: str = '',
 		radio_options: dict = None,
-		filter_type: bool = True
+		filter_type: str = 'Any'
 	):
+		"""universe is the set of symbols to filter (all indexed symbols if
+		None), output is a sorted list of the ones that pass.
+		"""
 		self.output = []
 		if title:
 			container.markdown(f'''{"#"*title_importance} {title}''')
@@ -106,9 +130,8 @@ class SymbolsFilter:
 				options=[x for x in radio_options.keys()],
 				format_func=lambda x: radio_options[x]
 			)
-			options = sorted(list({
-					getattr(x, radio) for x in input_objects.values()
-			}))
+			options = facet_index.options(radio, universe)
+			universe = facet_index.symbols if universe is None else universe
 			filter_by = container.multiselect(
 				f'{radio_options[radio]} selection:',
 				options=options,
@@ -118,41 +141,66 @@ class SymbolsFilter:
 					'Exclude': []
 				}[filter_type]
 			)
-			self.output = {
+			self.output = sorted({
 				'Any': self._filter_any,
 				'All': self._filter_all,
 				'Exclude': self._filter_exclude
-			}[filter_type](input_objects, radio, filter_by)
+			}[filter_type](facet_index, universe, radio, filter_by))
 
 	@staticmethod
 	def _filter_any(
-		input_objects: Dict[str, object], attr: str, filter_by: list
-	) -> list:
-		out = []
-		for k, v in input_objects.items():
-			if getattr(v, attr) in filter_by:
-				out.append(k)
-		return out
+		facet_index: facets.FacetIndex, universe: set, attr: str, filter_by: list
+	) -> set:
+		return facet_index.lookup(attr, filter_by) & universe
 
 	@staticmethod
 	def _filter_all(
-		input_objects: Dict[str, object], attr: str, filter_by: list
-	) -> list:
-		out = deepcopy(input_objects)
-		for k, v in input_objects.items():
-			if getattr(v, attr) not in filter_by:
-				del out[k]
-		return list(out.keys())
+		facet_index: facets.FacetIndex, universe: set, attr: str, filter_by: list
+	) -> set:
+		return facet_index.lookup(attr, filter_by) & universe
 
 	@staticmethod
 	def _filter_exclude(
-		input_objects: Dict[str, object], attr: str, filter_by
-	) -> list:
-		out = deepcopy(input_objects)
-		for k, v in input_objects.items():
-			if getattr(v, attr) in filter_by:
-				del out[k]
-		return list(out.keys())
+		facet_index: facets.FacetIndex, universe: set, attr: str, filter_by: list
+	) -> set:
+		return universe - facet_index.lookup(attr, filter_by)
+
+
+class ChartCache:
+	"""TimeSeriesChart figures kept per (symbols, dates, controls, panel
+	version), so a rerun caused by some other widget doesn't rebuild them.
+
+	Entries are never changed once stored: a chart that adds traces to a
+	cached figure works on a copy.
+	"""
+
+	def __init__(self, max_entries: int = MAX_CHARTS):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __repr__(self):
+		return (
+			f'ChartCache({len(self.entries)} entries, '
+			f'{self.hits} hits, {self.misses} misses)'
+		)
+
+	def get(self, key: tuple):
+		"""Cached (figure, data, line trace type, points sent, points
+		available, bar size), or None"""
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return self.entries[key]
+		self.misses += 1
+		return None
+
+	def put(self, key: tuple, value: tuple) -> None:
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
 
 
 class TimeSeriesChart:
@@ -162,27 +210,38 @@ class TimeSeriesChart:
 		self,
 		container: st.container,
 		symbols: list,
-		data: pd.DataFrame,
+		data: panel.PricePanel,
 		plot_type_controls: bool = True,
 		price_type_controls: bool = True,
-		normalize_control: bool = True
+		normalize_control: bool = True,
+		cache: ChartCache = None,
+		auto_bar_size: bool = True
 	):
-		"""Note: data is a MultiIndex dataframe.
-		There are two indices: symbol and dt.datetime.
+		"""Note: data is the session's price panel. self.data ends up as a
+		MultiIndex dataframe with two indices: symbol and dt.datetime.
+		With a cache, the figure and self.data are reused for as long as
+		the controls and the panel stay the same; treat them as read only.
+
+		With auto_bar_size, bars are as fine as the visible range allows
+		without drawing more than CHART_BARS per symbol: daily bars merged
+		into weeks or months for long ranges and, once the "Intraday bars"
+		box is ticked, intraday bars (fetched into data.INTRADAY_STORE) for
+		short ones. Without it bars are always daily.
 		"""
 		self.container = container
 		num_cols = 2 + price_type_controls + plot_type_controls
 		columns = self.container.columns(num_cols)
 		checkbox_container = columns[num_cols - 1].container()
 		start_date, end_date = self._filter_dates(
-			data, columns[0].selectbox(
+			data, symbols, columns[0].selectbox(
 				'Select a time period',
 				options=[
 					'1Y',
 					'6mo',
 					'3mo',
 					'1mo',
-					'1wk',
+					'1wk'
+				] + (['5d', '1d'] if auto_bar_size else []) + [
 					'2Y',
 					'5Y',
 					'10Y',
@@ -190,14 +249,12 @@ class TimeSeriesChart:
 					'manual'
 		]))
 		self.symbols = symbols
-		self.data = data.loc[[
-			x for x in data.index
-			if (x[1] >= start_date) and (x[1] <= end_date)
-		]]
+		self.start_date = start_date
+		self.end_date = end_date
 		plot_type = \
 			columns[1].selectbox(
 				'Select a plot type', ['line', 'OHLC'],
-				help='Select "OHLC" again to regenerate candle colors'
+				help='Candle colors are picked at random for each symbol'
 			) \
 			if plot_type_controls else 'line'
 		price_type = \
@@ -210,15 +267,49 @@ class TimeSeriesChart:
 				'Normalize', value=True if len(symbols) > 1 else False,
 				help='Current data point divided by the first data point'
 			) if normalize_control else True
-		self.data = self._plot_time_series(
-			plot_type, price_type, norm, checkbox_container.checkbox(
-				'Log Y-Axis', help='Plots the y-variable on a logarithmic axis'
-		))
-
-	def _filter_dates(self, data: pd.DataFrame, time_period: str) -> tuple:
-		dates = [x[1] for x in data.index]
-		min_date = min(dates)
-		max_date = max(dates)
+		log = checkbox_container.checkbox(
+			'Log Y-Axis', help='Plots the y-variable on a logarithmic axis'
+		)
+		self.points = min(
+			MAX_POINTS_PER_SERIES, POINT_BUDGET // max(1, len(symbols))
+		) if checkbox_container.checkbox(
+			'Downsample', value=True, help=f'''
+			Sends at most {MAX_POINTS_PER_SERIES} points per symbol to the 
+			browser, keeping the peaks and troughs (candles are merged). 
+			Turn off to see every bar.'''
+		) else None
+		use_intraday = checkbox_container.checkbox(
+			'Intraday bars', help='''
+			Draws short time periods with minute or hourly bars, fetched from 
+			Yahoo! Finance the first time they are shown.'''
+		) if auto_bar_size else False
+		bar = self._bar_size(start_date, end_date, use_intraday) \
+			if auto_bar_size else '1d'
+		# Keyed on the bar asked for, which _bars may fall back from, and
+		# on the store as it was before loading: both lookup and store
+		# have to use the same key for the entry to ever be hit
+		key = (
+			tuple(symbols), start_date, end_date, plot_type, price_type, norm,
+			log, self.points, bar, id(data), data.version
+		) + self._intraday_key(end_date, bar)
+		cached = cache.get(key) if cache is not None else None
+		if cached is None:
+			prices, used = self._bars(data, symbols, start_date, end_date, bar)
+			cached = self._plot_time_series(
+				prices, plot_type, price_type, norm, log, used
+			) + (used,)
+			if cache is not None:
+				cache.put(key, cached)
+		self.fig, self.data, self.line_trace, n_sent, n_available, \
+			self.bar_size = cached
+		self._shared = cache is not None
+		self._render(plot_type, n_sent, n_available)
+
+	@diagnostics.timed('TimeSeriesChart filter dates')
+	def _filter_dates(
+		self, data: panel.PricePanel, symbols: list, time_period: str
+	) -> tuple:
+		min_date, max_date = data.date_range(symbols)
 		time_deltas = {
 			'10Y': dt.timedelta(days=365*10),
 			'5Y': dt.timedelta(days=365*5),
@@ -229,15 +320,104 @@ class TimeSeriesChart:
 			'1mo': dt.timedelta(days=int(365 / 12)),
 			'1wk': dt.timedelta(days=7)
 		}
+		# Trading days, counted back from the last one
+		trading_days = {'5d': 5, '1d': 1}
 		if time_period == 'manual':
 			min_date, max_date = self.container.slider(
-				'Select Date Range', value=(min_date, max_date)
+				'Select Date Range', value=(min_date.date(), max_date.date())
+			)
+		elif time_period in time_deltas:
+			min_date = max_date - time_deltas[time_period]
+		elif time_period in trading_days:
+			last = data.dates.searchsorted(max_date, side='right')
+			min_date = max(
+				min_date, data.dates[max(0, last - trading_days[time_period])]
 			)
-		else:
-			if time_period in time_deltas:
-				min_date = max_date - time_deltas[time_period]
 		return min_date, max_date
 
+	def _bar_size(self, start_date, end_date, use_intraday: bool) -> str:
+		"""Finest bar that draws the range with at most CHART_BARS bars per
+		symbol. Short ranges get daily bars unless use_intraday, and so do
+		long ranges with downsampling off, since that's what every bar
+		means there."""
+		bar = intraday.pick_bar_size(
+			len(intraday.trading_days(start_date, end_date)),
+			start_date,
+			CHART_BARS if self.points is None else min(CHART_BARS, self.points),
+			now=data.SOURCE.now()
+		)
+		if intraday.is_intraday(bar):
+			return bar if use_intraday else '1d'
+		return '1d' if self.points is None else bar
+
+	def _intraday_key(self, end_date, bar: str) -> tuple:
+		"""Cache key part that changes when new intraday bars are stored,
+		or once bars of a day still being traded may have gone stale (see
+		IntradayStore)"""
+		if not intraday.is_intraday(bar):
+			return ()
+		key = (data.INTRADAY_STORE.version,)
+		if pd.Timestamp(end_date) >= data.SOURCE.now().normalize():
+			key += (time.time() // intraday.MAX_AGE.total_seconds(),)
+		return key
+
+	@diagnostics.timed('TimeSeriesChart load bars')
+	def _bars(
+		self,
+		prices: panel.PricePanel,
+		symbols: list,
+		start_date,
+		end_date,
+		bar: str
+	) -> tuple:
+		"""(symbol, date) frame of bars of a size, and the size they ended
+		up being: intraday bars come from the intraday store and fall back
+		to daily bars when there are none (like on a holiday)"""
+		if intraday.is_intraday(bar):
+			frame = self._intraday_bars(symbols, start_date, end_date, bar)
+			if frame is not None:
+				return frame, bar
+			bar = '1d'
+		with diagnostics.span('TimeSeriesChart slice panel'):
+			frame = prices.frame(symbols, start=start_date, end=end_date)
+		if bar != '1d' and frame is not None:
+			frame = pd.concat({
+				s: intraday.resample(frame.loc[s], bar)
+				for s in frame.index.unique(level=0)
+			})
+		return frame, bar
+
+	def _intraday_bars(
+		self, symbols: list, start_date, end_date, bar: str
+	) -> pd.DataFrame:
+		interval = intraday.source_interval(
+			bar, start_date, data.SOURCE.now()
+		)
+		result = data.load_intraday(symbols, interval, start_date, end_date)
+		if result.errors:
+			self.container.warning(
+				f'Could not get {interval} bars for {len(result.errors)} '
+				f'symbol(s):\n{result.error_report()}'
+			)
+		out = {}
+		for s, bars in result.loaded.items():
+			if bars.empty:
+				continue
+			if 'adjclose' not in bars.columns:
+				# Intraday bars aren't adjusted
+				bars = bars.assign(adjclose=bars['close'])
+			out[s] = bars if bar == interval else intraday.resample(bars, bar)
+		if not out:
+			return None
+		return pd.concat(out, keys=out.keys())
+
+	def _own_figure(self) -> None:
+		"""Copy a figure that came out of the cache before changing it"""
+		if self._shared:
+			import plotly.graph_objs as go
+			self.fig = go.Figure(self.fig)
+			self._shared = False
+
 	def add_line(self, series: pd.Series):
 		"""Note: only works with adjclose"""
 		# self.fig.add_scatter(
@@ -246,22 +426,73 @@ class TimeSeriesChart:
 		# 	y=series.values
 		# )
 		# st.write(self.fig)
-		self.chart_container.plotly_chart(
-			figure_or_data=self.fig.add_scatter(
-			name='Weighted Portfolio',
-			x=series.index,
-			y=series.values
-		), use_container_width=True)
+		x, y = self._reduce_line(series.index, series)
+		self._own_figure()
+		with diagnostics.span('plotly_chart', points=len(x)):
+			self.chart_container.plotly_chart(
+				figure_or_data=self.fig.add_trace(self.line_trace(
+				name='Weighted Portfolio',
+				x=x,
+				y=y
+			)), use_container_width=True)
+
+	def add_overlay(self, frame: pd.DataFrame, title: str, percent: bool):
+		"""Draw every column of a dates x symbols frame (like the ones
+		analytics.RollingAnalytics makes) against a second y-axis"""
+		self._own_figure()
+		for s in frame.columns:
+			series = frame[s].dropna()
+			if series.empty:
+				continue
+			x, y = self._reduce_line(series.index, series)
+			self.fig.add_trace(self.line_trace(
+				name=f'{s} {title.lower()}', x=x, y=y, yaxis='y2',
+				line={'dash': 'dot'}
+			))
+		self.fig.update_layout(yaxis2={
+			'title': title,
+			'overlaying': 'y',
+			'side': 'right',
+			'showgrid': False,
+			'tickformat': '.0%' if percent else None
+		})
+		with diagnostics.span('plotly_chart', overlay=title):
+			self.chart_container.plotly_chart(
+				figure_or_data=self.fig, use_container_width=True
+			)
+
+	def _reduce_line(self, x: pd.Index, y: pd.Series) -> tuple:
+		"""Downsample a line to the point budget, if downsampling is on"""
+		if self.points is None or len(y) <= self.points:
+			return x, y
+		idx = downsample.lttb(x.values.astype('int64'), y.values, self.points)
+		return x[idx], y.iloc[idx]
 
+	@diagnostics.timed('TimeSeriesChart build figure')
 	def _plot_time_series(
-		self, plot_type: str, price_type: str, norm: bool, log: bool
-	) -> pd.DataFrame:
+		self,
+		prices: pd.DataFrame,
+		plot_type: str,
+		price_type: str,
+		norm: bool,
+		log: bool,
+		bar: str = '1d'
+	) -> tuple:
+		"""Build the figure from a (symbol, date) frame of prices, without
+		changing it. Returns (figure, plotted data, line trace type, points
+		sent, points available)."""
+		# plotly takes a while to import, only pay for it once a chart is drawn
+		import plotly.graph_objs as go
+
 		symbols = self.symbols
 		fig = go.Figure()
 		out = {}
-
-		def _normalize(datum: float, data: pd.Series):
-			return data / datum if norm else data
+		n_available = len(prices)
+		n_sent = 0
+		n_expected = n_available if self.points is None \
+			else min(n_available, self.points * len(symbols))
+		self.line_trace = go.Scattergl if n_expected > WEBGL_THRESHOLD \
+			else go.Scatter
 
 		colors_inc = [
 			'aliceblue',
@@ -281,32 +512,41 @@ class TimeSeriesChart:
 		]
 
 		for i, s in enumerate(symbols):
-			data = self.data.loc[s]
-			datum = data[{
-				'line': price_type, 'OHLC': 'open'
-			}[plot_type]].iloc[0]
-			_open = _normalize(datum, data['open'])
-			_high = _normalize(datum, data['high'])
-			_low = _normalize(datum, data['low'])
-			_close = _normalize(datum, data['close'])
-			_adjclose = _normalize(datum, data['adjclose'])
-			data['open'] = _open
-			data['high'] = _high
-			data['low'] = _low
-			data['close'] = _close
-			data['adjclose'] = _adjclose
+			try:
+				data = prices.loc[s]
+			except KeyError:
+				# No bars in the selected time period
+				continue
+			if norm:
+				datum = data[{
+					'line': price_type, 'OHLC': 'open'
+				}[plot_type]].iloc[0]
+				# A new frame, so the prices passed in are left as they are
+				data = data.assign(**{
+					col: data[col] / datum for col in PRICE_COLUMNS
+				})
+			_open = data['open']
+			_high = data['high']
+			_low = data['low']
+			_close = data['close']
+			_adjclose = data['adjclose']
 			out[s] = data
 			if plot_type == 'OHLC':
-				datum = data['open'].iloc[0]
 				if i == 0:
 					color_inc = None
 					color_dec = None
 				else:
 					color_inc = random.choice(colors_inc)
 					color_dec = random.choice(colors_dec)
+				x, o, h, l, c = (data.index, _open, _high, _low, _close) \
+					if self.points is None else downsample.ohlc_buckets(
+						data.index, _open.values, _high.values, _low.values,
+						_close.values, self.points
+					)
+				n_sent += len(x)
 				fig.add_candlestick(
-					name=s, x=data.index,
-					open=_open, high=_high, low=_low, close=_close,
+					name=s, x=x,
+					open=o, high=h, low=l, close=c,
 					increasing=go.candlestick.Increasing(
 						fillcolor=color_inc, line={'color': color_inc}
 					),
@@ -315,29 +555,45 @@ class TimeSeriesChart:
 					)
 				)
 			elif plot_type == 'line':
-				datum = data[price_type].iloc[0]
-				fig.add_scatter(
-					name=s, x=data.index,
-					y={
-						'open': _open,
-						'high': _high,
-						'low': _low,
-						'close': _close,
-						'adjclose': _adjclose
-					}[price_type]
-				)
+				x, y = self._reduce_line(data.index, {
+					'open': _open,
+					'high': _high,
+					'low': _low,
+					'close': _close,
+					'adjclose': _adjclose
+				}[price_type])
+				n_sent += len(x)
+				fig.add_trace(self.line_trace(name=s, x=x, y=y))
 		if log:
 			fig.update_yaxes(type="log")
+		if intraday.is_intraday(bar):
+			# Leave out nights and weekends instead of drawing them flat
+			fig.update_xaxes(rangebreaks=[
+				{'bounds': ['sat', 'mon']},
+				{'bounds': [16, 9.5], 'pattern': 'hour'}
+			])
 		fig.update_layout(
 			height=600,
 			xaxis_rangeslider_visible=False,
 			hovermode='x', showlegend=True, template='seaborn'
 		)
-		self.chart_container = self.container.empty()
-		self.chart_container.plotly_chart(
-			figure_or_data=fig, use_container_width=True
+		return (
+			fig,
+			pd.concat({k: v for k, v in out.items()}, keys=out.keys()),
+			self.line_trace,
+			n_sent,
+			n_available
 		)
-		self.fig = fig
-		return pd.concat(
-			{k: v for k, v in out.items()}, keys=out.keys()
+
+	def _render(self, plot_type: str, n_sent: int, n_available: int) -> None:
+		self.chart_container = self.container.empty()
+		with diagnostics.span('plotly_chart', points=n_sent):
+			self.chart_container.plotly_chart(
+				figure_or_data=self.fig, use_container_width=True
+			)
+		self.container.caption(
+			f'{n_sent:,} of {n_available:,} points plotted '
+			f'({self.bar_size} bars)' +
+			(' (WebGL)' if plot_type == 'line' and
+				self.line_trace.__name__ == 'Scattergl' else '')
 		)
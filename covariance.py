@@ -0,0 +1,254 @@
+"""Covariance and correlation matrices over the price panel"""
+import os
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import panel
+
+# Label shown in the UI: shrinkage estimator
+SHRINKAGE = {
+	'None': 'none',
+	'Ledoit-Wolf': 'ledoit_wolf',
+	'Constant correlation': 'constant_correlation'
+}
+# Pairs with fewer returns in common than this get NaN
+MIN_PERIODS = int(os.environ.get('STOCKTIME_COV_MIN_PERIODS', 20))
+# Matrices kept per session
+MAX_ENTRIES = int(os.environ.get('STOCKTIME_COV_MAX_ENTRIES', 8))
+
+
+class CovarianceResult:
+	"""Daily return covariance and correlation of a set of symbols"""
+
+	def __init__(
+		self,
+		cov: pd.DataFrame,
+		corr: pd.DataFrame,
+		counts: pd.DataFrame,
+		method: str = 'none',
+		intensity: float = 0.0
+	):
+		self.cov = cov
+		self.corr = corr
+		self.counts = counts
+		self.method = method
+		self.intensity = intensity
+
+	def __repr__(self):
+		return (
+			f'CovarianceResult({len(self.cov)} symbols, {self.method}, '
+			f'intensity={self.intensity:.2f})'
+		)
+
+	def annualized(self, periods: int = analytics.TRADING_DAYS) -> pd.DataFrame:
+		"""Covariance of annual returns"""
+		return self.cov * periods
+
+
+def pairwise(returns: np.ndarray, min_periods: int = MIN_PERIODS) -> tuple:
+	"""Covariance, correlation and observation counts of a dates x symbols
+	returns array, each pair using only the dates both have a return.
+
+	Everything comes out of a handful of masked matrix products: with M the
+	0/1 mask of valid returns and X the returns with NaN as 0, X'X sums the
+	cross products, X'M each symbol's returns on the dates the other has
+	one and M'M the number of dates in common.
+	"""
+	valid = ~np.isnan(returns)
+	mask = valid.astype('float64')
+	x = np.where(valid, returns, 0.0)
+	counts = mask.T @ mask
+	sums = x.T @ mask
+	squares = (x * x).T @ mask
+	products = x.T @ x
+	with np.errstate(divide='ignore', invalid='ignore'):
+		cov = (products - sums * sums.T / counts) / (counts - 1)
+		var = (squares - sums * sums / counts) / (counts - 1)
+		corr = cov / np.sqrt(var * var.T)
+	few = counts < max(2, min_periods)
+	cov[few] = np.nan
+	corr[few] = np.nan
+	np.fill_diagonal(corr, np.where(np.diag(few), np.nan, 1.0))
+	return cov, np.clip(corr, -1, 1), counts
+
+
+def ledoit_wolf(returns: np.ndarray, cov: np.ndarray) -> tuple:
+	"""Shrink towards a scaled identity with the Ledoit-Wolf intensity.
+
+	Missing returns count as the symbol's mean return, which is what the
+	pairwise estimate does too. Returns (shrunk covariance, intensity).
+	"""
+	n, p = returns.shape
+	valid = ~np.isnan(returns)
+	x = np.where(valid, returns, 0.0)
+	x = np.where(valid, x - x.sum(axis=0) / np.maximum(valid.sum(axis=0), 1), 0)
+	mu = np.nanmean(np.diag(cov))
+	target = mu * np.eye(p)
+	sample = np.where(np.isnan(cov), target, cov)
+	d2 = ((sample - target)**2).sum() / p
+	if n == 0 or d2 == 0:
+		return target, 1.0
+	row_norms = (x * x).sum(axis=1)
+	b2 = (
+		(row_norms**2).sum() -
+		2 * ((x @ sample) * x).sum() +
+		n * (sample**2).sum()
+	) / (n**2 * p)
+	intensity = float(np.clip(b2 / d2, 0, 1))
+	return intensity * target + (1 - intensity) * sample, intensity
+
+
+def constant_correlation(
+	cov: np.ndarray, corr: np.ndarray, intensity: float
+) -> np.ndarray:
+	"""Shrink towards every pair having the average correlation"""
+	std = np.sqrt(np.diag(cov))
+	off_diagonal = ~np.eye(len(cov), dtype=bool)
+	rbar = np.nanmean(corr[off_diagonal]) if off_diagonal.any() else 0.0
+	target = rbar * np.outer(std, std)
+	np.fill_diagonal(target, np.diag(cov))
+	sample = np.where(np.isnan(cov), target, cov)
+	return intensity * target + (1 - intensity) * sample
+
+
+def nearest_psd(cov: np.ndarray, floor: float = 1e-10) -> np.ndarray:
+	"""Closest positive semi-definite matrix, by clipping eigenvalues.
+	Pairwise estimates aren't guaranteed to be PSD.
+	"""
+	values, vectors = np.linalg.eigh((cov + cov.T) / 2)
+	return (vectors * np.clip(values, floor, None)) @ vectors.T
+
+
+def _corr(cov: np.ndarray) -> np.ndarray:
+	std = np.sqrt(np.diag(cov))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.clip(cov / np.outer(std, std), -1, 1)
+
+
+def estimate(
+	returns: pd.DataFrame,
+	shrinkage: str = 'none',
+	intensity: float = 0.5,
+	min_periods: int = MIN_PERIODS
+) -> CovarianceResult:
+	"""Covariance and correlation of a dates x symbols returns frame.
+	intensity is only used for the constant correlation target.
+	"""
+	values = returns.to_numpy(dtype='float64')
+	cov, corr, counts = pairwise(values, min_periods)
+	if shrinkage == 'ledoit_wolf':
+		cov, intensity = ledoit_wolf(values, cov)
+		corr = _corr(cov)
+	elif shrinkage == 'constant_correlation':
+		cov = constant_correlation(cov, corr, intensity)
+		corr = _corr(cov)
+	elif shrinkage == 'none':
+		intensity = 0.0
+	else:
+		raise ValueError(f'unknown shrinkage "{shrinkage}"')
+	symbols = returns.columns
+	return CovarianceResult(
+		pd.DataFrame(cov, index=symbols, columns=symbols),
+		pd.DataFrame(corr, index=symbols, columns=symbols),
+		pd.DataFrame(counts.astype('int64'), index=symbols, columns=symbols),
+		shrinkage,
+		intensity
+	)
+
+
+def panel_returns(
+	prices: panel.PricePanel, symbols: list, window: int = None, end=None
+) -> pd.DataFrame:
+	"""Daily adjclose returns over each symbol's last window bars up to end.
+
+	Windows count a symbol's own bars, not rows of the panel's union
+	calendar, so a symbol that doesn't trade on some of the panel's dates
+	still gets window returns. Each return is from the symbol's previous
+	bar (see analytics.fill_prices), and rows it has no bar on are NaN, so
+	every pair uses the dates both actually traded.
+	"""
+	dates = prices.dates
+	last = len(dates) if end is None else \
+		dates.searchsorted(pd.Timestamp(end), side='right')
+	raw = prices.values('adjclose', symbols)[:last].astype('float64')
+	bars = ~np.isnan(raw)
+	if window is None:
+		in_window = bars
+		first = 0
+	else:
+		# Bars each symbol has on or after every row
+		remaining = np.cumsum(bars[::-1], axis=0)[::-1]
+		in_window = bars & (remaining <= window)
+		# The bar before a symbol's first return in the window
+		needed = np.flatnonzero((bars & (remaining <= window + 1)).any(axis=1))
+		first = int(needed[0]) if len(needed) else max(0, last - 1)
+	filled = analytics.fill_prices(
+		raw[first:], np.array([prices.bounds[s][1] for s in symbols]) - first
+	)
+	returns = analytics.simple_returns(filled)[1:]
+	returns[~in_window[first + 1:]] = np.nan
+	return pd.DataFrame(
+		returns, index=dates[first + 1:last], columns=pd.Index(symbols)
+	)
+
+
+class CovarianceCache:
+	"""Estimates kept per (symbol set, window, end, estimator).
+
+	Entries remember the panel version they were computed from and are
+	dropped once the panel changes.
+	"""
+
+	def __init__(self, max_entries: int = MAX_ENTRIES):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __repr__(self):
+		return (
+			f'CovarianceCache({len(self.entries)} entries, '
+			f'{self.hits} hits, {self.misses} misses)'
+		)
+
+	def compute(
+		self,
+		prices: panel.PricePanel,
+		symbols: list,
+		window: int = None,
+		end=None,
+		shrinkage: str = 'none',
+		intensity: float = 0.5,
+		min_periods: int = MIN_PERIODS
+	) -> CovarianceResult:
+		"""Covariance of the symbols' returns over the last window bars"""
+		symbols = [s for s in symbols if s in prices]
+		key = (
+			tuple(sorted(symbols)),
+			window,
+			None if end is None else pd.Timestamp(end),
+			shrinkage,
+			intensity if shrinkage == 'constant_correlation' else None,
+			min_periods
+		)
+		entry = self.entries.get(key)
+		if entry is not None and entry[0] == prices.version:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+		self.misses += 1
+		result = estimate(
+			panel_returns(prices, sorted(symbols), window, end),
+			shrinkage,
+			intensity,
+			min_periods
+		)
+		self.entries[key] = (prices.version, result)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+		return result
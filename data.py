@@ -1,9 +1,16 @@
 """Handle data"""
 import datetime as dt
+import os
+import sys
+import time
 
+import cache
+import diagnostics
+import fetch
+import intraday
 import pandas as pd
-import streamlit as st
-import yahooquery as yq
+import snapshots
+import sources
 
 from numpy import nan
 
@@ -14,10 +21,57 @@ PLACEHOLDERS = {
 	list: [],
 	dict: {}
 }
+# Number of symbols sent in a single multi-symbol request per endpoint
+CHUNK_SIZE = 25
+SOURCE = sources.from_env()
+PRICE_CACHE = cache.PriceCache(SOURCE.cache_dir)
+CHAIN_STORE = snapshots.ChainStore(SOURCE.cache_dir)
+INTRADAY_STORE = intraday.IntradayStore(SOURCE.cache_dir)
+# Endpoints the metadata section is built from
+METADATA_ENDPOINTS = ['asset_profile', 'quote_type', 'price']
+# Sections that are only fetched the first time something reads them
+LAZY_SECTIONS = ['historical_prices', 'option_chain']
+# Store heavy sections with the smallest dtypes that hold their values
+COMPACT = True
+# Option chain text columns with only a handful of distinct values
+CATEGORY_COLUMNS = ['currency', 'contractSize']
 
 
 class SymbolData:
-	"""Stores data about a ticker symbol."""
+	"""Stores data about a ticker symbol.
+
+	Metadata is loaded up front (the filters need it). The price history and
+	option chain are fetched the first time they are read, or in bulk for
+	many symbols by load_sections(), and then kept on the object. A section
+	that failed to load is stored empty with the reason in errors, so it
+	isn't requested again on every rerun.
+
+	The metadata lives in __slots__ and the heavy sections in a separate
+	dict (with their sizes worked out once, when they're stored). The
+	ticker object is only held while a get_* method is using it. Heavy
+	sections can be evicted (see enforce_budget()) and are then read back
+	from disk or fetched again the next time they are used.
+	"""
+	__slots__ = [
+		'asof_raw',
+		'asof',
+		'symbol',
+		'sector',
+		'industry',
+		'asset_type',
+		'country',
+		'state',
+		'city',
+		'short_name',
+		'long_name',
+		'exchange_type',
+		'home_exchange',
+		'errors',
+		'_sections',
+		'_sizes',
+		'_spilled',
+		'_ticker_obj'
+	]
 	asof_raw: dt.datetime
 	asof: str
 	symbol: str
@@ -34,25 +88,142 @@ class SymbolData:
 	option_chain: pd.DataFrame
 	historical_prices: pd.DataFrame
 
-	def __init__(self, symbol: str):
+	def __init__(self, symbol: str, ticker_obj=None):
 		now = dt.datetime.now()
 		date = dt.datetime.strftime(now, '%Y-%m-%d')
 		time = dt.datetime.strftime(now, '%I:%m %p').strip('0')
 		self.asof_raw = now
 		self.asof = f'{date} {time}'
 		self.symbol = symbol
-		self.ticker_obj = yq.Ticker(symbol)
+		self.errors = {}
+		self._sections = {}
+		self._sizes = {}
+		self._spilled = {}
+		self._ticker_obj = ticker_obj
 
 	def __repr__(self):
 		return f'SymbolData({self.symbol})'
 
+	@property
+	def ticker_obj(self):
+		"""Single symbol ticker, only created if something asks for it"""
+		if self._ticker_obj is None:
+			self._ticker_obj = SOURCE.ticker(self.symbol)
+		return self._ticker_obj
+
+	def release_ticker(self) -> None:
+		"""Let go of the ticker (and its requests session)"""
+		self._ticker_obj = None
+
+	def _lazy_section(self, section: str) -> pd.DataFrame:
+		if section not in self._sections:
+			load_sections([self], [section])
+		return self._sections[section]
+
+	@property
+	def historical_prices(self) -> pd.DataFrame:
+		"""Price history, fetched the first time it's read"""
+		return self._lazy_section('historical_prices')
+
+	@historical_prices.setter
+	def historical_prices(self, history: pd.DataFrame) -> None:
+		self._sections['historical_prices'] = history
+		self._sizes['historical_prices'] = cache.sizeof(history)
+
+	@property
+	def option_chain(self) -> pd.DataFrame:
+		"""Option chain, fetched the first time it's read"""
+		return self._lazy_section('option_chain')
+
+	@option_chain.setter
+	def option_chain(self, chain: pd.DataFrame) -> None:
+		self._sections['option_chain'] = chain
+		self._sizes['option_chain'] = cache.sizeof(chain)
+
+	def memory_usage(self) -> dict:
+		"""Bytes held per section (shared sections are counted too)"""
+		metadata = sum([
+			sys.getsizeof(getattr(self, x, None)) for x in self.__slots__
+			if not x.startswith('_')
+		])
+		return {
+			'metadata': metadata,
+			**{x: self._sizes.get(x, 0) for x in LAZY_SECTIONS}
+		}
+
+	def is_loaded(self, section: str) -> bool:
+		"""True if the section has been fetched (successfully or not)"""
+		return section in self._sections
+
+	def evict(self, directory: str = None) -> None:
+		"""Let go of the heavy sections, writing them under directory if set.
+		Sections that failed to load are kept so they aren't retried.
+		"""
+		for section in LAZY_SECTIONS:
+			if section not in self._sections or section in self.errors:
+				continue
+			value = self._sections.pop(section)
+			self._sizes.pop(section, None)
+			if directory is None or value.empty:
+				continue
+			path = os.path.join(
+				directory, self.symbol.replace(os.sep, '_'), f'{section}.parquet'
+			)
+			try:
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				value.to_parquet(path)
+				self._spilled[section] = path
+			except Exception as e:
+				print(f'spill err {self.symbol} {section}: {e}')
+
+	def restore(self, section: str) -> bool:
+		"""Read a section back from disk, if it was spilled there"""
+		path = self._spilled.pop(section, None)
+		if path is None:
+			return False
+		try:
+			setattr(self, section, pd.read_parquet(path))
+			os.remove(path)
+			return True
+		except Exception as e:
+			print(f'restore err {self.symbol} {section}: {e}')
+			return False
+
+	def discard_spilled(self, section: str) -> None:
+		"""Delete a section's spill file, if it has one"""
+		path = self._spilled.pop(section, None)
+		if path is not None and os.path.exists(path):
+			os.remove(path)
+
+	def set_section(self, section: str, *responses) -> None:
+		"""Store a section from the endpoint data it is built from"""
+		if section == 'metadata':
+			self.set_metadata(*responses)
+		else:
+			setattr(self, section, responses[0])
+		self.errors.pop(section, None)
+
+	def set_section_error(self, section: str, error: Exception) -> None:
+		"""Remember that a section could not be loaded"""
+		self.errors[section] = str(error)
+		if section in LAZY_SECTIONS:
+			setattr(self, section, pd.DataFrame())
+
 	def get_metadata(self) -> None:
 		"""Overview"""
 		# YQ ENDPOINTS
-		asset_profile = self.ticker_obj.asset_profile[self.symbol]
-		quote_type = self.ticker_obj.quote_type[self.symbol]
-		price = self.ticker_obj.price[self.symbol]
-		# EXTRACT DATA FROM ENDPOINTS
+		ticker = self.ticker_obj
+		self.set_metadata(
+			ticker.asset_profile[self.symbol],
+			ticker.quote_type[self.symbol],
+			ticker.price[self.symbol]
+		)
+		self.release_ticker()
+
+	def set_metadata(
+		self, asset_profile: dict, quote_type: dict, price: dict
+	) -> None:
+		"""Extract the overview from already fetched endpoint data"""
 		for str_key in ['sector', 'industry', 'country', 'state', 'city']:
 			self.__setattr__(
 				str_key, asset_profile.get(str_key, PLACEHOLDERS[str])
@@ -63,6 +234,7 @@ class SymbolData:
 		self.long_name = quote_type.get('longName', PLACEHOLDERS[str])
 		self.exchange_type = price.get('exchange', PLACEHOLDERS[str])
 		self.home_exchange = price.get('exchangeName',  PLACEHOLDERS[str])
+		self._sections['metadata'] = True
 
 	def get_fundamental_data(self) -> None:
 		"""Fundamental data"""
@@ -70,9 +242,10 @@ class SymbolData:
 
 	def get_historical_prices(self) -> None:
 		"""Historical price data"""
-		self.historical_prices = self.ticker_obj.history(
-			period='max'
-		).loc[self.symbol]
+		self.historical_prices = compact(_symbol_response(
+			load_history(self.ticker_obj, [self.symbol]), self.symbol
+		))
+		self.release_ticker()
 
 	def get_analyst_data(self) -> None:
 		"""Analyst info"""
@@ -80,66 +253,479 @@ class SymbolData:
 
 	def get_option_chain(self) -> None:
 		"""Option chain"""
-		self.option_chain = self.ticker_obj.option_chain.loc[self.symbol]
+		self.option_chain = compact(
+			self.ticker_obj.option_chain.loc[self.symbol]
+		)
+		self.release_ticker()
 
 
-def get_data(
+def compact(frame: pd.DataFrame) -> pd.DataFrame:
+	"""Copy of a section's frame using the smallest dtypes that fit.
+
+	Prices go to float32 (plenty for ~7 significant digits), integer
+	columns to the smallest integer type holding their range and repeated
+	labels to categoricals. Does nothing if COMPACT is off.
+	"""
+	if not COMPACT or not isinstance(frame, pd.DataFrame) or frame.empty:
+		return frame
+	dtypes = {}
+	for col, dtype in frame.dtypes.items():
+		if pd.api.types.is_float_dtype(dtype):
+			dtypes[col] = 'float32'
+		elif pd.api.types.is_integer_dtype(dtype):
+			dtypes[col] = pd.to_numeric(frame[col], downcast='integer').dtype
+		elif col in CATEGORY_COLUMNS:
+			dtypes[col] = 'category'
+	return frame.astype(dtypes)
+
+
+def set_source(source: sources.DataSource) -> None:
+	"""Switch where data comes from, along with the caches that hold it"""
+	global SOURCE, PRICE_CACHE, CHAIN_STORE, INTRADAY_STORE
+	SOURCE = source
+	PRICE_CACHE = cache.PriceCache(source.cache_dir)
+	CHAIN_STORE = snapshots.ChainStore(source.cache_dir)
+	INTRADAY_STORE = intraday.IntradayStore(source.cache_dir)
+	cache.SHARED.clear()
+
+
+def _chunks(symbols: list, size: int) -> list:
+	"""Split a list of symbols into lists of at most size symbols"""
+	return [symbols[i:i + size] for i in range(0, len(symbols), max(1, size))]
+
+
+def _symbol_response(response, symbol: str):
+	"""Pull a single symbol out of a multi-symbol yahooquery response.
+
+	Dict endpoints map each symbol to either a dict or an error message,
+	DataFrame endpoints have the symbol as the first index level and simply
+	leave out symbols without data. history() falls back to a dict of
+	{symbol: DataFrame or error} if any symbol in the request failed.
+	"""
+	if isinstance(response, pd.DataFrame):
+		if symbol not in response.index.get_level_values(0):
+			raise KeyError(f'no data returned for {symbol}')
+		return response.loc[symbol]
+	if isinstance(response, dict):
+		value = response.get(symbol, f'no data returned for {symbol}')
+		if isinstance(value, str):
+			raise ValueError(value)
+		return value
+	raise ValueError(response)
+
+
+@diagnostics.timed()
+def load_history(
+	ticker,
 	symbols: list,
-	p_cont: st.container,
-	m_cont: st.container,
-	STATE: st.session_state
+	interval: str = '1d',
+	price_cache: cache.PriceCache = None
+) -> dict:
+	"""Daily price history for many symbols, going through the price cache.
+
+	Fresh cached histories are used as they are. Stale ones are topped up
+	with a single request starting at the oldest last cached date, and
+	symbols that were never cached get their full history in one request.
+	Returns {symbol: DataFrame or error message} like yahooquery does.
+	"""
+	price_cache = price_cache if price_cache is not None else PRICE_CACHE
+	out = {}
+	cold = []
+	warm = {}
+	start_time = time.perf_counter()
+	for s in symbols:
+		history = price_cache.load(s, interval)
+		if history is None or history.empty:
+			cold.append(s)
+		elif price_cache.is_stale(s, interval):
+			warm[s] = history
+		else:
+			out[s] = history
+
+	if warm:
+		ticker.symbols = list(warm.keys())
+		start = min(price_cache.last_date(h) for h in warm.values())
+		try:
+			response = fetch.call(
+				ticker.history,
+				start=dt.datetime.strftime(start, '%Y-%m-%d'),
+				interval=interval
+			)
+		except Exception as e:
+			response = str(e)
+		for s, history in warm.items():
+			try:
+				new_bars = _symbol_response(response, s)
+				new_bars = new_bars.loc[
+					new_bars.index >= price_cache.last_date(history)
+				]
+			except Exception as e:
+				# Still have everything up to the last cached bar
+				print(f'cache refresh err {s}: {e}')
+				new_bars = None
+			out[s] = price_cache.append(s, history, new_bars, interval)
+	if len(out):
+		price_cache.record_timing(
+			'warm', len(out), time.perf_counter() - start_time
+		)
+
+	if cold:
+		start_time = time.perf_counter()
+		ticker.symbols = cold
+		response = fetch.call(ticker.history, period='max', interval=interval)
+		for s in cold:
+			try:
+				out[s] = price_cache.save(
+					s, _symbol_response(response, s), interval
+				)
+			except Exception as e:
+				out[s] = str(e)
+		price_cache.record_timing(
+			'cold', len(cold), time.perf_counter() - start_time
+		)
+
+	ticker.symbols = symbols
+	return out
+
+
+def _load_chunk(
+	ticker, symbol_objs: list, section: str
+) -> fetch.FetchResult:
+	"""Fetch one section for a chunk of symbols, one request per endpoint"""
+	result = fetch.FetchResult()
+	chunk = [x.symbol for x in symbol_objs]
+	try:
+		if section == 'metadata':
+			responses = [
+				fetch.call(getattr, ticker, endpoint)
+				for endpoint in METADATA_ENDPOINTS
+			]
+		elif section == 'historical_prices':
+			responses = [load_history(ticker, chunk)]
+		else:
+			responses = [fetch.call(getattr, ticker, section)]
+	except Exception as e:
+		responses = [str(e)]
+
+	for symbol_obj in symbol_objs:
+		s = symbol_obj.symbol
+		try:
+			symbol_responses = tuple([
+				compact(_symbol_response(r, s)) for r in responses
+			])
+			symbol_obj.set_section(section, *symbol_responses)
+		except Exception as e:
+			symbol_obj.set_section_error(section, e)
+			result.errors[s] = f'{section}: {e}'
+			continue
+		cache.SHARED.put(s, section, symbol_responses)
+		result.loaded[s] = symbol_obj
+		if section == 'option_chain' and snapshots.ENABLED:
+			try:
+				CHAIN_STORE.append(s, symbol_responses[0])
+			except Exception as e:
+				print(f'snapshot err {s}: {e}')
+	return result
+
+
+@diagnostics.timed()
+def load_sections(
+	symbol_objs: list,
+	sections: list,
+	chunk_size: int = CHUNK_SIZE,
+	max_workers: int = fetch.MAX_WORKERS,
+	on_complete=None,
+	session=None
+) -> fetch.FetchResult:
+	"""Fetch sections that aren't loaded yet for many symbols at once.
+
+	Sections another session already fetched come straight out of the
+	shared in-process cache. For the rest, each (section, chunk of symbols)
+	is one task, and tasks run concurrently, each with its own Ticker
+	sharing one requests session. Failures are tracked per symbol so one
+	bad symbol (or chunk) doesn't take down the others.
+	"""
+	result = fetch.FetchResult()
+	tasks = {}
+	for section in sections:
+		missing = []
+		for x in symbol_objs:
+			if x.is_loaded(section):
+				continue
+			# The shared copy first: restoring a spilled section would make
+			# a second copy of a frame other sessions still hold
+			cached = cache.SHARED.get(x.symbol, section)
+			if cached is not None:
+				x.discard_spilled(section)
+				x.set_section(section, *cached)
+				result.loaded[x.symbol] = x
+			elif not x.restore(section):
+				missing.append(x)
+		for chunk in _chunks(missing, chunk_size):
+			symbols = [x.symbol for x in chunk]
+			chunk_ticker = SOURCE.ticker(symbols, session=session)
+			session = chunk_ticker.session
+			tasks[f'{section} {symbols[0]}-{symbols[-1]}'] = \
+				lambda t=chunk_ticker, c=chunk, x=section: _load_chunk(t, c, x)
+	if tasks:
+		result.merge(fetch.run_tasks(tasks, max_workers, on_complete))
+		if 'historical_prices' in sections:
+			PRICE_CACHE.prune()
+	return result
+
+
+def enforce_budget(
+	symbols_data: dict,
+	budget: cache.MemoryBudget,
+	price_panel=None,
+	pinned: list = None
 ) -> list:
-	"""Create all Symbol objects and add to the session"""
-	symbols = sorted([
-		x for x in yq.Ticker(symbols, validate=True).symbols
-		if x not in STATE.symbols_data.keys()
-	])
+	"""Evict the least recently used symbols' heavy sections until the
+	session is back under budget. Metadata always stays, so the filters keep
+	working. Returns the evicted symbols.
+	"""
+	sizes = {
+		s: sum(x._sizes.values()) for s, x in symbols_data.items()
+	}
+	evicted = budget.victims(sizes, pinned)
+	for s in evicted:
+		symbols_data[s].evict(budget.spill_dir)
+		if price_panel is not None and s in price_panel:
+			price_panel.remove(s)
+	budget.evictions += len(evicted)
+	return evicted
+
+
+@diagnostics.timed()
+def get_data(
+	symbols: list,
+	known: dict = None,
+	chunk_size: int = CHUNK_SIZE,
+	on_complete=None
+) -> fetch.FetchResult:
+	"""SymbolData objects (metadata only) for the symbols not in known.
 
+	Doesn't touch streamlit: the caller decides what to do with the loaded
+	objects and how to show progress (on_complete is passed on to
+	fetch.run_tasks). Symbols Yahoo doesn't know end up in the errors.
+	"""
+	known = known if known is not None else {}
+	symbols = [x for x in symbols if x not in known]
+	# Symbols with cached metadata were already validated by some session
+	uncached = [x for x in symbols if (x, 'metadata') not in cache.SHARED]
+	with diagnostics.span('validate symbols', symbols=len(uncached)):
+		ticker = SOURCE.ticker(uncached, validate=True) if uncached else None
+	invalid = {
+		s: 'not found on Yahoo! Finance'
+		for s in getattr(ticker, 'invalid_symbols', None) or []
+	}
+	symbols = sorted([x for x in symbols if x not in invalid])
 	if not symbols:
-		return symbols
-
-	def _update_progress(n: int):
-		for x in range(1, n + 1):
-			yield x / n
-
-	def update_progress(msg: str):
-		"""Update the progress bar"""
-		info_container.text(msg)
-		progress.progress(next(progress_vals))
-
-	successful = []
-	info_container = m_cont.empty()
-	progress_cont = p_cont.empty()
-	progress_vals = _update_progress(5*len(symbols))
-	progress = progress_cont.progress(0)
-	for s in symbols:
-		symbol_obj = SymbolData(s)
-		failed = False
+		return fetch.FetchResult(errors=invalid)
+
+	result = load_sections(
+		[SymbolData(s) for s in symbols],
+		['metadata'],
+		chunk_size,
+		on_complete=on_complete,
+		session=ticker.session if ticker is not None else None
+	)
+	result.errors.update(invalid)
+	return result
+
+
+def prefetch_history(
+	symbols: list,
+	interval: str = '1d',
+	chunk_size: int = CHUNK_SIZE,
+	max_workers: int = fetch.MAX_WORKERS,
+	on_complete=None
+) -> fetch.FetchResult:
+	"""Bring the price cache up to date for many symbols without keeping
+	the histories around. The result's loaded maps each symbol to its
+	number of bars.
+	"""
+	def run(chunk: list) -> fetch.FetchResult:
+		result = fetch.FetchResult()
+		for s, history in load_history(
+			SOURCE.ticker(chunk), chunk, interval
+		).items():
+			if isinstance(history, pd.DataFrame):
+				result.loaded[s] = len(history)
+			else:
+				result.errors[s] = history
+		return result
+
+	tasks = {
+		f'{chunk[0]}-{chunk[-1]}': lambda c=chunk: run(c)
+		for chunk in _chunks(symbols, chunk_size)
+	}
+	result = fetch.run_tasks(tasks, max_workers, on_complete)
+	PRICE_CACHE.prune()
+	return result
+
+
+def snapshot_chains(
+	symbols: list,
+	chunk_size: int = CHUNK_SIZE,
+	max_workers: int = fetch.MAX_WORKERS,
+	on_complete=None
+) -> fetch.FetchResult:
+	"""Fetch the option chains of many symbols straight into the chain
+	store. The result's loaded maps each symbol to its number of contracts.
+	"""
+	def run(chunk: list) -> fetch.FetchResult:
+		result = fetch.FetchResult()
 		try:
-			update_progress(f'Getting {s} metadata')
-			symbol_obj.get_metadata()
-			update_progress(f'Getting {s} fundamentals')
-			symbol_obj.get_fundamental_data()
-			update_progress(f'Getting {s} price history')
-			symbol_obj.get_historical_prices()
-			update_progress(f'Getting {s} analyst info')
-			symbol_obj.get_analyst_data()
-			update_progress(f'Getting {s} option chain')
-			symbol_obj.get_option_chain()
-			# successful.append(s)
+			response = fetch.call(getattr, SOURCE.ticker(chunk), 'option_chain')
 		except Exception as e:
-			failed = True
-			print(f'getdata err {s}: {e}')
+			response = str(e)
+		for s in chunk:
+			try:
+				chain = _symbol_response(response, s)
+				CHAIN_STORE.append(s, chain)
+				result.loaded[s] = len(chain)
+			except Exception as e:
+				result.errors[s] = str(e)
+		return result
+
+	tasks = {
+		f'{chunk[0]}-{chunk[-1]}': lambda c=chunk: run(c)
+		for chunk in _chunks(symbols, chunk_size)
+	}
+	return fetch.run_tasks(tasks, max_workers, on_complete)
+
+
+def _intraday_windows(days: list, interval: str) -> list:
+	"""Split days into runs short enough to ask for in one request"""
+	windows = []
+	for day in sorted(days):
+		if windows and day - windows[-1][0] < pd.Timedelta(
+			days=intraday.REQUEST_DAYS[interval]
+		):
+			windows[-1].append(day)
+		else:
+			windows.append([day])
+	return windows
+
 
-		if not failed:
-			STATE.symbols.append(s)
-			STATE.symbols_data[s] = symbol_obj
+def _intraday_days(interval: str, start, end) -> list:
+	"""Trading days from start to end that the source still has bars for"""
+	now = SOURCE.now()
+	days = intraday.trading_days(start, min(pd.Timestamp(end), now))
+	return [
+		d for d in days if d >= now.normalize() - intraday.LOOKBACK[interval]
+	]
+
+
+def _store_intraday(chunk: list, interval: str, days: list) -> tuple:
+	"""Fetch the days of a chunk of symbols the intraday store doesn't
+	have for good into it. Returns the bars written and the errors, per
+	symbol."""
+	written = {s: 0 for s in chunk}
+	errors = {}
+	missing = {s: INTRADAY_STORE.missing(s, interval, days) for s in chunk}
+	needed = sorted({d for x in missing.values() for d in x})
+	ticker = SOURCE.ticker([s for s in chunk if missing[s]]) \
+		if needed else None
+	for window in _intraday_windows(needed, interval):
+		ticker.symbols = [
+			s for s in chunk if any(d in missing[s] for d in window)
+		]
+		try:
+			response = fetch.call(
+				ticker.history,
+				start=f'{window[0]:%Y-%m-%d}',
+				end=f'{window[-1] + pd.Timedelta(days=1):%Y-%m-%d}',
+				interval=interval
+			)
+		except Exception as e:
+			response = str(e)
+		for s in ticker.symbols:
+			try:
+				bars = _symbol_response(response, s)
+			except KeyError:
+				# Bars came back, just none of this symbol's: it didn't trade
+				# (a holiday), so its days are stored empty and not asked
+				# for again
+				bars = pd.DataFrame(
+					columns=list(intraday.DTYPES),
+					index=pd.DatetimeIndex([], name='date')
+				)
+			except Exception as e:
+				errors[s] = str(e)
+				continue
+			try:
+				written[s] += INTRADAY_STORE.save(
+					s, interval, bars, [d for d in window if d in missing[s]]
+				)
+			except Exception as e:
+				errors[s] = str(e)
+	return written, errors
+
+
+@diagnostics.timed()
+def load_intraday(
+	symbols: list,
+	interval: str,
+	start,
+	end,
+	chunk_size: int = CHUNK_SIZE,
+	max_workers: int = fetch.MAX_WORKERS,
+	on_complete=None
+) -> fetch.FetchResult:
+	"""Intraday bars of many symbols for the days from start to end.
+
+	Only the days the intraday store doesn't have for good are fetched, one
+	request per chunk of symbols and run of at most REQUEST_DAYS days, and
+	written to the store day by day. The result's loaded maps each symbol
+	to its bars, read back from the store for the days asked for only.
+	"""
+	days = _intraday_days(interval, start, end)
+
+	def run(chunk: list) -> fetch.FetchResult:
+		result = fetch.FetchResult()
+		_, result.errors = _store_intraday(chunk, interval, days)
+		for s in chunk:
+			if s not in result.errors:
+				result.loaded[s] = INTRADAY_STORE.load(s, interval, start, end)
+		return result
+
+	tasks = {
+		f'{chunk[0]}-{chunk[-1]}': lambda c=chunk: run(c)
+		for chunk in _chunks(symbols, chunk_size)
+	}
+	result = fetch.run_tasks(tasks, max_workers, on_complete)
+	INTRADAY_STORE.prune()
+	return result
+
+
+def prefetch_intraday(
+	symbols: list,
+	interval: str,
+	chunk_size: int = CHUNK_SIZE,
+	max_workers: int = fetch.MAX_WORKERS,
+	on_complete=None
+) -> fetch.FetchResult:
+	"""Bring the intraday store up to date for many symbols, as far back as
+	the source keeps the interval, without reading any bars back. The
+	result's loaded maps each symbol to the number of bars written.
+	"""
+	now = SOURCE.now()
+	days = _intraday_days(interval, now - intraday.LOOKBACK[interval], now)
 
-	info_container.empty()
-	progress_cont.empty()
+	def run(chunk: list) -> fetch.FetchResult:
+		result = fetch.FetchResult()
+		written, result.errors = _store_intraday(chunk, interval, days)
+		result.loaded = {
+			s: n for s, n in written.items() if s not in result.errors
+		}
+		return result
 
-	STATE.symbols = sorted(STATE.symbols)
-	STATE.symbols_data = {
-		k: STATE.symbols_data[k]
-		for k in sorted(list(STATE.symbols_data.keys()))
+	tasks = {
+		f'{chunk[0]}-{chunk[-1]}': lambda c=chunk: run(c)
+		for chunk in _chunks(symbols, chunk_size)
 	}
+	result = fetch.run_tasks(tasks, max_workers, on_complete)
+	INTRADAY_STORE.prune()
+	return result
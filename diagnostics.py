@@ -0,0 +1,267 @@
+"""Timing spans and request counters, to see where a rerun's time goes
+
+Usage
+-----
+import diagnostics
+
+trace = diagnostics.start('rerun')
+with diagnostics.span('build chart', symbols=10):
+	...
+diagnostics.stop()
+trace.summary()              # time per span name
+trace.counter_frame()        # remote calls and bytes per endpoint
+diagnostics.chrome_trace([trace])   # for chrome://tracing or Perfetto
+
+A trace belongs to the thread that started it; fetch.run_tasks hands it on
+to its worker threads. Outside a trace span() returns a shared no-op
+context manager and timed() calls straight through, so leaving the
+instrumentation in costs next to nothing when it's off.
+"""
+import json
+import os
+import threading
+import time
+
+from contextlib import nullcontext
+from functools import wraps
+
+import pandas as pd
+
+# Record traces without having to tick the sidebar checkbox first
+ENABLED = os.environ.get('STOCKTIME_DIAGNOSTICS', '0') != '0'
+# Reruns kept per session
+MAX_TRACES = int(os.environ.get('STOCKTIME_DIAGNOSTICS_TRACES', 10))
+
+_NULL = nullcontext()
+
+
+class _Local(threading.local):
+	# A class default, so threads that never started a trace don't pay for
+	# an AttributeError on every lookup
+	trace = None
+
+
+_LOCAL = _Local()
+
+
+class Trace:
+	"""Spans and counters recorded during one rerun"""
+
+	def __init__(self, name: str = 'rerun'):
+		self.name = name
+		self.started = time.time()
+		self.origin = time.perf_counter()
+		self.ended = None
+		# (name, seconds after origin, seconds, thread id, args)
+		self.spans = []
+		# endpoint: {'calls', 'errors', 'bytes', 'seconds'}
+		self.counters = {}
+		self.threads = {}
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return (
+			f'Trace({self.name}, {len(self.spans)} spans, '
+			f'{self.duration * 1e3:.0f}ms)'
+		)
+
+	@property
+	def duration(self) -> float:
+		end = self.ended if self.ended is not None else time.perf_counter()
+		return end - self.origin
+
+	def add_span(
+		self, name: str, start: float, seconds: float, args: dict
+	) -> None:
+		thread = threading.current_thread()
+		with self.lock:
+			self.threads[thread.ident] = thread.name
+			self.spans.append(
+				(name, start - self.origin, seconds, thread.ident, args)
+			)
+
+	def count(
+		self, endpoint: str, nbytes: int, seconds: float, failed: bool
+	) -> None:
+		with self.lock:
+			counter = self.counters.setdefault(endpoint, {
+				'calls': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0
+			})
+			counter['calls'] += 1
+			counter['errors'] += failed
+			counter['bytes'] += nbytes
+			counter['seconds'] += seconds
+
+	def summary(self) -> pd.DataFrame:
+		"""Calls, total and longest seconds per span name, in the order the
+		spans started"""
+		if not self.spans:
+			return pd.DataFrame(columns=['calls', 'seconds', 'max', 'share'])
+		df = pd.DataFrame(
+			[x[:3] for x in self.spans], columns=['name', 'start', 'seconds']
+		).sort_values('start', kind='stable')
+		out = df.groupby('name', sort=False)['seconds'].agg(
+			calls='count', seconds='sum', max='max'
+		)
+		out['share'] = out['seconds'] / self.duration
+		return out
+
+	def counter_frame(self) -> pd.DataFrame:
+		"""Remote calls per endpoint"""
+		return pd.DataFrame.from_dict(
+			self.counters, orient='index',
+			columns=['calls', 'errors', 'bytes', 'seconds']
+		).rename_axis('endpoint')
+
+	def to_dict(self) -> dict:
+		return {
+			'name': self.name,
+			'started': self.started,
+			'seconds': self.duration,
+			'spans': [
+				{
+					'name': name,
+					'start': start,
+					'seconds': seconds,
+					'thread': self.threads.get(thread, str(thread)),
+					'args': args
+				}
+				for name, start, seconds, thread, args in self.spans
+			],
+			'counters': self.counters
+		}
+
+
+class _Span:
+	"""Times its with block into a trace"""
+	__slots__ = ['trace', 'name', 'args', 'start']
+
+	def __init__(self, trace: Trace, name: str, args: dict):
+		self.trace = trace
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.trace.add_span(
+			self.name, self.start, time.perf_counter() - self.start, self.args
+		)
+		return False
+
+
+def current() -> Trace:
+	"""Trace being recorded by this thread, or None"""
+	return _LOCAL.trace
+
+
+def start(name: str = 'rerun') -> Trace:
+	"""Record spans and counters of this thread into a new trace"""
+	_LOCAL.trace = Trace(name)
+	return _LOCAL.trace
+
+
+def stop() -> Trace:
+	"""Stop recording and return the trace"""
+	trace = current()
+	_LOCAL.trace = None
+	if trace is not None:
+		trace.ended = time.perf_counter()
+	return trace
+
+
+def span(name: str, **args):
+	"""Context manager timing a block into this thread's trace"""
+	trace = _LOCAL.trace
+	if trace is None:
+		return _NULL
+	return _Span(trace, name, args)
+
+
+def timed(name: str = None):
+	"""Decorator putting every call of a function in a span"""
+	def decorator(func):
+		label = name or func.__qualname__
+
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			trace = _LOCAL.trace
+			if trace is None:
+				return func(*args, **kwargs)
+			with _Span(trace, label, {}):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def bind(func):
+	"""func, made to record into the calling thread's trace from whatever
+	thread runs it"""
+	trace = current()
+	if trace is None:
+		return func
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		previous = current()
+		_LOCAL.trace = trace
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_LOCAL.trace = previous
+	return wrapper
+
+
+def count(
+	endpoint: str, response=None, seconds: float = 0.0, failed: bool = False
+) -> None:
+	"""Count a remote call and the size of what came back"""
+	trace = current()
+	if trace is None:
+		return
+	import cache
+
+	nbytes = 0 if response is None else cache.sizeof(response)
+	trace.count(endpoint, nbytes, seconds, failed)
+
+
+def to_json(traces: list) -> str:
+	"""Traces as JSON, spans in seconds after their trace started"""
+	return json.dumps([x.to_dict() for x in traces], indent=1, default=str)
+
+
+def chrome_trace(traces: list) -> str:
+	"""Traces in the Trace Event Format read by chrome://tracing and
+	Perfetto, laid out on one timeline with each rerun's counters attached
+	to its top level event"""
+	pid = os.getpid()
+	events = []
+	threads = {0: 'reruns'}
+	for trace in traces:
+		origin = trace.started * 1e6
+		threads.update(trace.threads)
+		events.append({
+			'name': trace.name, 'cat': 'rerun', 'ph': 'X', 'pid': pid,
+			'tid': 0, 'ts': origin, 'dur': trace.duration * 1e6,
+			'args': trace.counters
+		})
+		events += [
+			{
+				'name': name, 'cat': 'span', 'ph': 'X', 'pid': pid,
+				'tid': thread, 'ts': origin + start * 1e6,
+				'dur': seconds * 1e6, 'args': args
+			}
+			for name, start, seconds, thread, args in trace.spans
+		]
+	events += [
+		{
+			'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+			'args': {'name': name}
+		}
+		for tid, name in threads.items()
+	]
+	return json.dumps(
+		{'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str
+	)
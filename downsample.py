@@ -0,0 +1,69 @@
+"""Downsampling series for plotting"""
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+	"""Positions of the points Largest-Triangle-Three-Buckets keeps.
+
+	The first and last points are always kept. The rest are split into
+	n_out - 2 buckets and from each bucket the point forming the largest
+	triangle with the point kept from the previous bucket and the average of
+	the next bucket is kept, which holds on to peaks and troughs far better
+	than taking every nth point. x must be increasing and numeric.
+	"""
+	n = len(y)
+	if n_out >= n or n_out < 3:
+		return np.arange(n)
+	x = np.asarray(x, dtype='float64')
+	y = np.asarray(y, dtype='float64')
+	edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+	# Averages of every bucket (plus the last point as the final "bucket")
+	sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+	sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+	counts = np.diff(edges)
+	avg_x = np.r_[sums_x / counts, x[-1]]
+	avg_y = np.r_[sums_y / counts, y[-1]]
+	out = np.empty(n_out, dtype='int64')
+	out[0] = 0
+	out[-1] = n - 1
+	a = 0
+	for i in range(n_out - 2):
+		start, stop = edges[i], edges[i + 1]
+		seg_x = x[start:stop]
+		seg_y = y[start:stop]
+		area = np.abs(
+			(x[a] - avg_x[i + 1]) * (seg_y - y[a]) -
+			(x[a] - seg_x) * (avg_y[i + 1] - y[a])
+		)
+		a = start + int(np.argmax(area))
+		out[i + 1] = a
+	return out
+
+
+def ohlc_buckets(
+	x: np.ndarray,
+	open_: np.ndarray,
+	high: np.ndarray,
+	low: np.ndarray,
+	close: np.ndarray,
+	n_out: int
+) -> tuple:
+	"""Merge consecutive bars into at most n_out bars.
+
+	Each merged bar opens at its first bar's open, closes at its last bar's
+	close and covers the highest high and lowest low in between, so no
+	price extreme is lost. Returns (x, open, high, low, close), with x being
+	the first x of every bucket.
+	"""
+	n = len(x)
+	if n_out >= n or n_out < 1:
+		return x, open_, high, low, close
+	starts = np.unique(np.linspace(0, n, n_out, endpoint=False).astype('int64'))
+	ends = np.r_[starts[1:], n] - 1
+	return (
+		x[starts],
+		np.asarray(open_)[starts],
+		np.maximum.reduceat(np.asarray(high), starts),
+		np.minimum.reduceat(np.asarray(low), starts),
+		np.asarray(close)[ends]
+	)
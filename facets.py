@@ -0,0 +1,86 @@
+"""Metadata facet index used by the symbol filters"""
+from typing import Iterable
+
+# SymbolData attributes the sidebar filters on
+FACETS = [
+	'asset_type',
+	'home_exchange',
+	'sector',
+	'industry',
+	'country',
+	'state',
+	'city'
+]
+
+
+class FacetIndex:
+	"""For every attribute, maps each value to the set of symbols having it.
+
+	Symbols are indexed once, when their metadata is loaded, so filtering is
+	set operations on symbol names and never touches price data.
+	"""
+
+	def __init__(self, attrs: list = None):
+		self.attrs = attrs if attrs is not None else FACETS
+		self.index = {attr: {} for attr in self.attrs}
+		self.values = {}
+
+	def __repr__(self):
+		return f'FacetIndex({len(self.values)} symbols)'
+
+	def __len__(self):
+		return len(self.values)
+
+	def __contains__(self, symbol: str) -> bool:
+		return symbol in self.values
+
+	@property
+	def symbols(self) -> set:
+		"""Every indexed symbol"""
+		return set(self.values.keys())
+
+	def add(self, symbol_obj) -> None:
+		"""Index a SymbolData's metadata"""
+		symbol = symbol_obj.symbol
+		if symbol in self.values:
+			self.remove(symbol)
+		self.values[symbol] = {
+			attr: getattr(symbol_obj, attr) for attr in self.attrs
+		}
+		for attr, value in self.values[symbol].items():
+			self.index[attr].setdefault(value, set()).add(symbol)
+
+	def remove(self, symbol: str) -> None:
+		"""Drop a symbol from the index"""
+		for attr, value in self.values.pop(symbol).items():
+			symbols = self.index[attr][value]
+			symbols.discard(symbol)
+			if not symbols:
+				del self.index[attr][value]
+
+	def sync(self, symbols_data: dict) -> None:
+		"""Index symbols that were added to the session, drop removed ones"""
+		if len(self.values) == len(symbols_data) \
+			and all(s in symbols_data for s in self.values):
+			return
+		for s in [x for x in self.values if x not in symbols_data]:
+			self.remove(s)
+		for s, symbol_obj in symbols_data.items():
+			if s not in self.values:
+				self.add(symbol_obj)
+
+	def options(self, attr: str, within: set = None) -> list:
+		"""Sorted values of attr held by at least one symbol in within"""
+		if within is None:
+			return sorted(self.index[attr].keys())
+		return sorted([
+			value for value, symbols in self.index[attr].items()
+			if not symbols.isdisjoint(within)
+		])
+
+	def lookup(self, attr: str, values: Iterable) -> set:
+		"""Symbols whose attr is any of values"""
+		out = set()
+		for value in values:
+			out |= self.index[attr].get(value, set())
+		return out
@@ -0,0 +1,145 @@
+"""Concurrent fetching"""
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict
+
+from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+import diagnostics
+
+# Number of requests allowed to be in flight at once
+MAX_WORKERS = 4
+# Token bucket settings: sustained requests per second and burst size
+RATE = 4.0
+BURST = 8
+# Attempts per request before the error is passed on
+ATTEMPTS = 3
+
+
+class RateLimiter:
+	"""Token bucket shared by every worker thread."""
+
+	def __init__(self, rate: float = RATE, capacity: int = BURST):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = float(capacity)
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return f'RateLimiter({self.rate}/s, burst={self.capacity})'
+
+	def acquire(self) -> None:
+		"""Block until a request is allowed"""
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(
+					self.capacity, self.tokens + (now - self.updated)*self.rate
+				)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+
+LIMITER = RateLimiter()
+
+
+class FetchResult:
+	"""Everything that came back from a batch of fetch tasks.
+
+	loaded maps a key (usually a symbol) to its data and errors maps a key
+	to the reason it failed, so the UI can show failures instead of them
+	only being printed.
+	"""
+
+	def __init__(self, loaded: dict = None, errors: dict = None):
+		self.loaded = loaded if loaded is not None else {}
+		self.errors = errors if errors is not None else {}
+		self.elapsed = 0.0
+
+	def __repr__(self):
+		return (
+			f'FetchResult({len(self.loaded)} loaded, '
+			f'{len(self.errors)} failed, {self.elapsed:.1f}s)'
+		)
+
+	def merge(self, other: 'FetchResult') -> None:
+		"""Add the results of another batch to this one"""
+		self.loaded.update(other.loaded)
+		self.errors.update(other.errors)
+		self.elapsed += other.elapsed
+
+	def error_report(self) -> str:
+		"""Markdown list of failures"""
+		return '\n'.join([
+			f'- **{k}**: {v}' for k, v in sorted(self.errors.items())
+		])
+
+
+def call(
+	func: Callable,
+	*args,
+	limiter: RateLimiter = LIMITER,
+	attempts: int = ATTEMPTS,
+	**kwargs
+):
+	"""Call func once a token is available, retrying with backoff.
+	getattr(ticker, endpoint) calls are counted under the endpoint's name."""
+	for attempt in Retrying(
+		stop=stop_after_attempt(attempts),
+		wait=wait_exponential(multiplier=0.5, max=8),
+		reraise=True
+	):
+		with attempt:
+			limiter.acquire()
+			if diagnostics.current() is None:
+				return func(*args, **kwargs)
+			endpoint = args[1] if func is getattr else func.__name__
+			response = None
+			failed = True
+			start = time.perf_counter()
+			try:
+				with diagnostics.span(f'fetch {endpoint}'):
+					response = func(*args, **kwargs)
+				failed = False
+				return response
+			finally:
+				diagnostics.count(
+					endpoint, response, time.perf_counter() - start, failed
+				)
+
+
+def run_tasks(
+	tasks: Dict[str, Callable[[], FetchResult]],
+	max_workers: int = MAX_WORKERS,
+	on_complete: Callable[[int, int, str], None] = None
+) -> FetchResult:
+	"""Run tasks on a bounded thread pool and merge their results.
+
+	on_complete(n_done, n_total, key) is called from the calling thread as
+	each task finishes, so it is safe to update streamlit widgets from it.
+	A task that raises is recorded as an error under its key.
+	"""
+	result = FetchResult()
+	start_time = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+		futures = {
+			pool.submit(diagnostics.bind(task)): key
+			for key, task in tasks.items()
+		}
+		for n, future in enumerate(as_completed(futures), start=1):
+			key = futures[future]
+			try:
+				result.merge(future.result())
+			except Exception as e:
+				result.errors[key] = str(e)
+			if on_complete is not None:
+				on_complete(n, len(tasks), key)
+	result.elapsed = time.perf_counter() - start_time
+	return result
@@ -0,0 +1,326 @@
+"""Intraday bars: a store partitioned by day, OHLCV resampling and bar sizes"""
+import datetime as dt
+import math
+import os
+import threading
+import time
+
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+# Bar sizes charts can be drawn with, finest first. None means calendar months
+BAR_SIZES = {
+	'1m': np.timedelta64(1, 'm'),
+	'2m': np.timedelta64(2, 'm'),
+	'5m': np.timedelta64(5, 'm'),
+	'15m': np.timedelta64(15, 'm'),
+	'30m': np.timedelta64(30, 'm'),
+	'1h': np.timedelta64(1, 'h'),
+	'1d': np.timedelta64(1, 'D'),
+	'1wk': np.timedelta64(7, 'D'),
+	'1mo': None
+}
+# Weeks start on Monday (1970-01-05), not on the epoch's Thursday
+ORIGINS = {'1wk': np.timedelta64(4, 'D')}
+# Intervals fetched from the source, and how far back Yahoo has them
+INTERVALS = ['1m', '5m', '1h']
+LOOKBACK = {
+	'1m': dt.timedelta(days=30),
+	'5m': dt.timedelta(days=60),
+	'1h': dt.timedelta(days=730)
+}
+# Longest range Yahoo returns in one request
+REQUEST_DAYS = {'1m': 7, '5m': 60, '1h': 730}
+# A regular US session, for guessing how many bars a range has
+SESSION_MINUTES = 390
+# Stored bars and days are in the exchange's local time
+EXCHANGE_TZ = os.environ.get('STOCKTIME_EXCHANGE_TZ', 'America/New_York')
+# How each column is merged into a coarser bar
+AGGREGATIONS = {
+	'open': 'first',
+	'high': 'max',
+	'low': 'min',
+	'close': 'last',
+	'adjclose': 'last',
+	'volume': 'sum'
+}
+DTYPES = {
+	'open': 'float32',
+	'high': 'float32',
+	'low': 'float32',
+	'close': 'float32',
+	'adjclose': 'float32',
+	'volume': 'float64'
+}
+# Total size the intraday files are allowed to take up on disk
+MAX_BYTES = int(os.environ.get('STOCKTIME_INTRADAY_MAX_BYTES', 1024**3))
+# A day still being traded is fetched again once its file is this old
+MAX_AGE = dt.timedelta(
+	minutes=float(os.environ.get('STOCKTIME_INTRADAY_MAX_AGE_MINUTES', 5))
+)
+
+
+def is_intraday(bar: str) -> bool:
+	return BAR_SIZES[bar] is not None and BAR_SIZES[bar] < BAR_SIZES['1d']
+
+
+def _minutes(bar: str) -> int:
+	return int(BAR_SIZES[bar] / np.timedelta64(1, 'm'))
+
+
+def bar_count(bar: str, trading_days: int) -> int:
+	"""Rough number of bars of a size in a range of trading days"""
+	if is_intraday(bar):
+		return trading_days * math.ceil(SESSION_MINUTES / _minutes(bar))
+	return math.ceil(trading_days / {'1d': 1, '1wk': 5, '1mo': 21}[bar])
+
+
+def source_interval(bar: str, start, now=None) -> str:
+	"""Coarsest fetched interval an intraday bar can be built from, going
+	back as far as start, or None if Yahoo doesn't keep any that long"""
+	now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+	for interval in reversed(INTERVALS):
+		if _minutes(bar) % _minutes(interval) == 0 and \
+			pd.Timestamp(start) >= now.normalize() - LOOKBACK[interval]:
+			return interval
+	return None
+
+
+def pick_bar_size(trading_days: int, start, max_bars: int, now=None) -> str:
+	"""Finest bar size that draws a range of trading days (starting at
+	start) with at most max_bars bars per symbol"""
+	for bar in BAR_SIZES:
+		if bar_count(bar, trading_days) > max_bars:
+			continue
+		if is_intraday(bar) and source_interval(bar, start, now) is None:
+			continue
+		return bar
+	return '1mo'
+
+
+def _size_origin(bar: str) -> tuple:
+	"""Nanoseconds in a fixed size bar, and since the epoch to the first"""
+	origin = ORIGINS.get(bar, np.timedelta64(0, 'D'))
+	return (
+		int(BAR_SIZES[bar] / np.timedelta64(1, 'ns')),
+		int(origin / np.timedelta64(1, 'ns'))
+	)
+
+
+def _bucket_ids(t: np.ndarray, bar: str) -> np.ndarray:
+	"""Number of the bar every datetime64[ns] timestamp falls in"""
+	if BAR_SIZES[bar] is None:
+		return t.astype('datetime64[M]').view('int64')
+	size, origin = _size_origin(bar)
+	return (t.view('int64') - origin) // size
+
+
+def _bucket_starts(ids: np.ndarray, bar: str) -> np.ndarray:
+	"""Start time of numbered bars"""
+	if BAR_SIZES[bar] is None:
+		return ids.astype('datetime64[M]').astype('datetime64[ns]')
+	size, origin = _size_origin(bar)
+	return (ids * size + origin).view('datetime64[ns]')
+
+
+def resample(bars: pd.DataFrame, bar: str) -> pd.DataFrame:
+	"""Merge a symbol's date-sorted bars into coarser bars.
+
+	Every bar opens at the first open in it, closes at the last close and
+	covers the highest high and lowest low, with volumes added up. Buckets
+	are numbered in one vectorized pass and each column is merged with a
+	ufunc reduceat, about as fast as pandas' resample without building
+	its groupby. Bars without a close (Yahoo sends those for minutes
+	nothing traded) are dropped.
+	"""
+	if bars is None or bars.empty:
+		return bars
+	traded = bars['close'].notna().to_numpy()
+	if not traded.all():
+		bars = bars.loc[traded]
+	ids = _bucket_ids(bars.index.values.astype('datetime64[ns]'), bar)
+	starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+	ends = np.r_[starts[1:], len(ids)] - 1
+	out = {}
+	for col in bars.columns:
+		values = bars[col].to_numpy()
+		how = AGGREGATIONS.get(col, 'last')
+		if how == 'first':
+			out[col] = values[starts]
+		elif how == 'last':
+			out[col] = values[ends]
+		elif how == 'max':
+			out[col] = np.fmax.reduceat(values, starts)
+		elif how == 'min':
+			out[col] = np.fmin.reduceat(values, starts)
+		else:
+			out[col] = np.add.reduceat(np.nan_to_num(values), starts)
+	return pd.DataFrame(out, index=pd.DatetimeIndex(
+		_bucket_starts(ids[starts], bar), name=bars.index.name
+	))
+
+
+def trading_days(start, end) -> pd.DatetimeIndex:
+	"""Weekdays from start to end, both included"""
+	return pd.bdate_range(
+		pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+	)
+
+
+class IntradayStore:
+	"""Intraday bars stored as one Parquet file per interval, symbol and day:
+
+		<directory>/interval=<interval>/symbol=<symbol>/<day>.parquet
+
+	Charts only read the days they show, so months of minute bars never
+	have to be in memory at once, and topping up a symbol only writes the
+	days that changed. A day's file is final once it was written after the
+	day was over in EXCHANGE_TZ. Days without bars (holidays) get an empty
+	file, so they aren't asked for again.
+	"""
+
+	def __init__(
+		self,
+		directory: str = cache.CACHE_DIR,
+		max_bytes: int = MAX_BYTES,
+		max_age: dt.timedelta = MAX_AGE
+	):
+		self.directory = os.path.join(directory, 'intraday')
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		# Goes up with every write, so charts built from the store can be
+		# cached until it changes
+		self.version = 0
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return f'IntradayStore({self.directory})'
+
+	def _symbol_dir(self, symbol: str, interval: str) -> str:
+		return os.path.join(
+			self.directory, f'interval={interval}',
+			f'symbol={quote(symbol, safe="")}'
+		)
+
+	def _path(self, symbol: str, interval: str, day: pd.Timestamp) -> str:
+		return os.path.join(
+			self._symbol_dir(symbol, interval), f'{day:%Y-%m-%d}.parquet'
+		)
+
+	def days(self, symbol: str, interval: str) -> list:
+		"""Days stored for a symbol, oldest first"""
+		path = self._symbol_dir(symbol, interval)
+		if not os.path.isdir(path):
+			return []
+		return sorted(
+			pd.Timestamp(x[:-len('.parquet')]) for x in os.listdir(path)
+			if x.endswith('.parquet')
+		)
+
+	def _is_final(self, path: str, day: pd.Timestamp) -> bool:
+		try:
+			mtime = os.path.getmtime(path)
+		except FileNotFoundError:
+			return False
+		# The server's clock can be in any timezone, the day is the exchange's
+		written = pd.Timestamp(mtime, unit='s', tz='UTC').tz_convert(
+			EXCHANGE_TZ
+		)
+		day_end = (day + pd.Timedelta(days=1)).tz_localize(EXCHANGE_TZ)
+		if written >= day_end:
+			return True
+		return time.time() - mtime < self.max_age.total_seconds()
+
+	def missing(self, symbol: str, interval: str, days: list) -> list:
+		"""Days that have to be fetched: never stored, or stored while they
+		were still being traded and since gone stale"""
+		return [
+			day for day in days
+			if not self._is_final(self._path(symbol, interval, day), day)
+		]
+
+	def save(
+		self, symbol: str, interval: str, bars: pd.DataFrame, days: list
+	) -> int:
+		"""Store bars fetched for the given days, replacing what was stored
+		for them. Returns the number of bars written."""
+		bars = bars.astype({
+			col: dtype for col, dtype in DTYPES.items() if col in bars.columns
+		}).sort_index()
+		bars.index = pd.DatetimeIndex(bars.index, name='date')
+		if bars.index.tz is not None:
+			# Exchange time, like yahooquery's daily dates
+			bars.index = bars.index.tz_localize(None)
+		days = pd.DatetimeIndex(days)
+		bar_days = bars.index.normalize()
+		written = 0
+		for day in days:
+			day_bars = bars.loc[bar_days == day]
+			cache.write_atomic(
+				self._path(symbol, interval, day), day_bars.to_parquet
+			)
+			written += len(day_bars)
+		with self.lock:
+			self.version += 1
+		return written
+
+	def load(
+		self,
+		symbol: str,
+		interval: str,
+		start,
+		end,
+		columns: list = None
+	) -> pd.DataFrame:
+		"""Bars of the days from start to end (both included), read from
+		the day files in range only"""
+		start = pd.Timestamp(start).normalize()
+		end = pd.Timestamp(end).normalize()
+		frames = []
+		for day in self.days(symbol, interval):
+			if start <= day <= end:
+				try:
+					frames.append(pd.read_parquet(
+						self._path(symbol, interval, day), columns=columns
+					))
+				except Exception as e:
+					print(f'intraday err {symbol} {day:%Y-%m-%d}: {e}')
+		frames = [x for x in frames if not x.empty]
+		if not frames:
+			return pd.DataFrame(columns=columns or list(DTYPES))
+		return pd.concat(frames).sort_index()
+
+	def size(self) -> int:
+		"""Bytes used on disk"""
+		return sum(os.path.getsize(path) for path in self._files())
+
+	def _files(self) -> list:
+		if not os.path.isdir(self.directory):
+			return []
+		return [
+			os.path.join(root, f)
+			for root, _, files in os.walk(self.directory)
+			for f in files if f.endswith('.parquet')
+		]
+
+	def prune(self) -> None:
+		"""Delete the oldest days until under max_bytes"""
+		with self.lock:
+			files = []
+			for path in self._files():
+				try:
+					files.append(
+						(os.path.basename(path), os.path.getsize(path), path)
+					)
+				except FileNotFoundError:
+					continue
+			total = sum(size for _, size, _ in files)
+			for _, size, path in sorted(files):
+				if total <= self.max_bytes:
+					break
+				os.remove(path)
+				total -= size
@@ -0,0 +1,234 @@
+"""Monte Carlo simulation of portfolio value paths"""
+import hashlib
+import multiprocessing
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Label shown in the UI: method
+METHODS = {
+	'Bootstrap': 'bootstrap',
+	'Block bootstrap': 'block_bootstrap',
+	'Normal': 'normal'
+}
+PERCENTILES = [5, 25, 50, 75, 95]
+# Paths simulated at a time: chunk x horizon doubles per array
+CHUNK_PATHS = int(os.environ.get('STOCKTIME_MC_CHUNK_PATHS', 10000))
+# Processes chunks are spread over (1 runs them in the calling process)
+WORKERS = int(
+	os.environ.get('STOCKTIME_MC_WORKERS', min(4, os.cpu_count() or 1))
+)
+# Histogram bins per day used to merge the percentiles of every chunk
+BINS = 2048
+# Results kept in memory, keyed on the returns and the settings
+MAX_RESULTS = 8
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+# Shared by every session, so only touched while holding _RESULTS_LOCK
+_RESULTS = OrderedDict()
+_RESULTS_LOCK = threading.Lock()
+
+
+class SimulationResult:
+	"""Distribution of simulated portfolio values, starting from 1"""
+
+	def __init__(
+		self,
+		percentiles: pd.DataFrame,
+		terminal: np.ndarray,
+		n_paths: int,
+		method: str,
+		seed: int
+	):
+		self.percentiles = percentiles
+		self.terminal = terminal
+		self.n_paths = n_paths
+		self.method = method
+		self.seed = seed
+
+	def __repr__(self):
+		return (
+			f'SimulationResult({self.n_paths} paths x '
+			f'{len(self.percentiles) - 1} days, {self.method}, seed={self.seed})'
+		)
+
+	def var(self, level: float = 0.95) -> float:
+		"""Value at risk: the loss over the horizon that is only exceeded
+		with probability 1 - level, as a fraction of the starting value"""
+		return float(-np.quantile(self.terminal - 1, 1 - level))
+
+	def cvar(self, level: float = 0.95) -> float:
+		"""Conditional value at risk: the average loss beyond the VaR"""
+		returns = self.terminal - 1
+		tail = returns[returns <= np.quantile(returns, 1 - level)]
+		return float(-tail.mean()) if len(tail) else np.nan
+
+
+def _draw(
+	rng: np.random.Generator,
+	returns: np.ndarray,
+	method: str,
+	n_paths: int,
+	horizon: int,
+	block: int
+) -> np.ndarray:
+	"""n_paths x horizon daily log returns"""
+	log_returns = np.log1p(returns)
+	if method == 'bootstrap':
+		return log_returns[rng.integers(0, len(log_returns), (n_paths, horizon))]
+	if method == 'block_bootstrap':
+		block = max(1, min(block, len(log_returns)))
+		n_blocks = -(-horizon // block)
+		starts = rng.integers(
+			0, len(log_returns) - block + 1, (n_paths, n_blocks, 1)
+		)
+		idx = (starts + np.arange(block)).reshape(n_paths, -1)[:, :horizon]
+		return log_returns[idx]
+	if method == 'normal':
+		return rng.normal(
+			log_returns.mean(), log_returns.std(ddof=1), (n_paths, horizon)
+		)
+	raise ValueError(f'unknown method "{method}"')
+
+
+def _bin_edges(returns: np.ndarray, horizon: int) -> tuple:
+	"""Lowest log value and bin width of every day's histogram, wide
+	enough that only the far tails end up in the outer bins"""
+	log_returns = np.log1p(returns)
+	days = np.arange(horizon + 1)
+	spread = max(log_returns.std(ddof=1), 1e-6)
+	worst = max(-log_returns.min(), log_returns.max(), spread)
+	half_width = np.minimum(8 * spread * np.sqrt(days), worst * days) + 1e-9
+	center = log_returns.mean() * days
+	return center - half_width, 2 * half_width / BINS
+
+
+def _simulate_chunk(
+	returns: np.ndarray,
+	method: str,
+	n_paths: int,
+	horizon: int,
+	block: int,
+	seed: np.random.SeedSequence,
+	lows: np.ndarray,
+	widths: np.ndarray
+) -> tuple:
+	"""Histogram of every day's log value and the terminal values of one
+	chunk of paths"""
+	rng = np.random.default_rng(seed)
+	paths = np.zeros((n_paths, horizon + 1))
+	np.cumsum(
+		_draw(rng, returns, method, n_paths, horizon, block),
+		axis=1,
+		out=paths[:, 1:]
+	)
+	bins = np.clip(((paths - lows) / widths).astype('int64'), 0, BINS - 1)
+	bins += np.arange(horizon + 1) * BINS
+	counts = np.bincount(bins.ravel(), minlength=(horizon + 1) * BINS)
+	return counts.reshape(horizon + 1, BINS), np.exp(paths[:, -1])
+
+
+def _pool() -> ProcessPoolExecutor:
+	"""Process pool shared by every session, started on first use"""
+	global _POOL
+	with _POOL_LOCK:
+		if _POOL is None:
+			_POOL = ProcessPoolExecutor(
+				max_workers=WORKERS,
+				mp_context=multiprocessing.get_context('spawn')
+			)
+		return _POOL
+
+
+def _percentiles(
+	counts: np.ndarray, lows: np.ndarray, widths: np.ndarray, q: list
+) -> np.ndarray:
+	"""Percentiles of every day from its histogram, interpolating linearly
+	inside a bin"""
+	cumulative = np.cumsum(counts, axis=1)
+	out = np.empty((len(counts), len(q)))
+	rows = np.arange(len(counts))
+	for j, p in enumerate(q):
+		target = p / 100 * cumulative[:, -1]
+		idx = np.minimum((cumulative < target[:, None]).sum(axis=1), BINS - 1)
+		before = np.where(idx > 0, cumulative[rows, np.maximum(idx - 1, 0)], 0)
+		inside = counts[rows, idx]
+		frac = np.divide(
+			target - before, inside,
+			out=np.full(len(counts), 0.5), where=inside > 0
+		)
+		out[:, j] = lows + (idx + frac) * widths
+	return np.exp(out)
+
+
+def simulate(
+	returns: pd.Series,
+	horizon: int = 252,
+	n_paths: int = 10000,
+	method: str = 'bootstrap',
+	seed: int = 0,
+	block: int = 21,
+	chunk_paths: int = CHUNK_PATHS,
+	workers: int = WORKERS
+) -> SimulationResult:
+	"""Simulate n_paths value paths horizon days ahead from daily returns.
+
+	Paths are generated chunk_paths at a time, each chunk with its own seed
+	spawned from seed, so results only depend on seed and chunk_paths (not
+	on workers or the order chunks finish in). A chunk is reduced to one
+	histogram per day plus its terminal values before the next is made:
+	memory is bounded by the chunk size, and percentiles are read off the
+	merged histograms. VaR and CVaR use the exact terminal values.
+	"""
+	values = pd.Series(returns).dropna().to_numpy(dtype='float64')
+	if len(values) < 2:
+		raise ValueError('need at least 2 daily returns to simulate')
+	# Chunks get their own random streams, so chunk_paths changes the paths
+	key = (
+		hashlib.sha1(values.tobytes()).hexdigest(),
+		horizon, n_paths, method, seed, block if method == 'block_bootstrap'
+		else None, chunk_paths
+	)
+	with _RESULTS_LOCK:
+		if key in _RESULTS:
+			_RESULTS.move_to_end(key)
+			return _RESULTS[key]
+
+	lows, widths = _bin_edges(values, horizon)
+	sizes = [
+		min(chunk_paths, n_paths - start)
+		for start in range(0, n_paths, chunk_paths)
+	]
+	seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+	args = [
+		(values, method, size, horizon, block, s, lows, widths)
+		for size, s in zip(sizes, seeds)
+	]
+	if workers > 1 and len(args) > 1:
+		chunks = list(_pool().map(_simulate_chunk, *zip(*args)))
+	else:
+		chunks = [_simulate_chunk(*x) for x in args]
+	counts = sum(x[0] for x in chunks)
+	result = SimulationResult(
+		pd.DataFrame(
+			_percentiles(counts, lows, widths, PERCENTILES),
+			index=pd.RangeIndex(horizon + 1, name='day'),
+			columns=PERCENTILES
+		),
+		np.concatenate([x[1] for x in chunks]),
+		n_paths,
+		method,
+		seed
+	)
+	with _RESULTS_LOCK:
+		_RESULTS[key] = result
+		_RESULTS.move_to_end(key)
+		while len(_RESULTS) > MAX_RESULTS:
+			_RESULTS.popitem(last=False)
+	return result
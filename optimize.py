@@ -0,0 +1,263 @@
+"""Portfolio weight optimizer"""
+import numpy as np
+import pandas as pd
+
+import analytics
+import covariance
+
+# Label shown in the UI: objective
+OBJECTIVES = {
+	'Minimum variance': 'min_variance',
+	'Maximum Sharpe': 'max_sharpe',
+	'Risk parity': 'risk_parity'
+}
+MAX_ITER = 5000
+TOL = 1e-9
+# Tolerance while searching the efficient frontier for the best Sharpe ratio
+SEARCH_TOL = 1e-6
+
+
+class OptimizationResult:
+	"""Weights an optimizer picked and what they are expected to do"""
+
+	def __init__(
+		self,
+		weights: pd.Series,
+		expected_return: float,
+		volatility: float,
+		risk_free: float,
+		iterations: int
+	):
+		self.weights = weights
+		self.expected_return = expected_return
+		self.volatility = volatility
+		self.risk_free = risk_free
+		self.iterations = iterations
+
+	def __repr__(self):
+		return (
+			f'OptimizationResult({len(self.weights)} symbols, '
+			f'return={self.expected_return:.2%}, vol={self.volatility:.2%})'
+		)
+
+	@property
+	def sharpe(self) -> float:
+		"""Expected excess return per unit of volatility"""
+		if not self.volatility:
+			return np.nan
+		return (self.expected_return - self.risk_free) / self.volatility
+
+	def risk_contributions(self, cov: pd.DataFrame) -> pd.Series:
+		"""Share of the portfolio variance each symbol is responsible for"""
+		w = self.weights.to_numpy()
+		c = w * (cov.loc[self.weights.index, self.weights.index].to_numpy() @ w)
+		return pd.Series(c / c.sum(), index=self.weights.index)
+
+
+def project(v: np.ndarray, lower: float, upper: float) -> np.ndarray:
+	"""Closest weights to v that add up to 1 with lower <= w <= upper.
+
+	The projection is clip(v - tau, lower, upper) for the tau that makes the
+	weights add up to 1. That sum is piecewise linear in tau with kinks at
+	v - upper and v - lower, so it is evaluated at every kink at once from
+	sorted cumulative sums and tau is interpolated between the two kinks
+	around 1.
+	"""
+	n = len(v)
+	if not n * lower <= 1 <= n * upper:
+		raise ValueError(
+			f'{n} weights between {lower} and {upper} cannot add up to 1'
+		)
+	s = np.sort(v)
+	cumsum = np.concatenate(([0.0], np.cumsum(s)))
+	upper_kinks = s - upper
+	lower_kinks = s - lower
+	kinks = np.sort(np.concatenate((upper_kinks, lower_kinks)))
+	# Weights stuck at upper (v - tau >= upper) and at lower (v - tau <= lower)
+	n_upper = n - upper_kinks.searchsorted(kinks)
+	n_lower = lower_kinks.searchsorted(kinks, side='right')
+	totals = n_upper * upper + n_lower * lower + \
+		cumsum[n - n_upper] - cumsum[n_lower] - \
+		(n - n_upper - n_lower) * kinks
+	i = min(int((-totals).searchsorted(-1.0)), 2 * n - 1)
+	if i == 0 or totals[i] == totals[i - 1]:
+		tau = kinks[i]
+	else:
+		tau = kinks[i - 1] + (totals[i - 1] - 1) * \
+			(kinks[i] - kinks[i - 1]) / (totals[i - 1] - totals[i])
+	return np.minimum(np.maximum(v - tau, lower), upper)
+
+
+def mean_variance(
+	cov: np.ndarray,
+	mu: np.ndarray,
+	risk_aversion: float,
+	lower: float,
+	upper: float,
+	w0: np.ndarray = None,
+	step: float = None,
+	tol: float = TOL
+) -> tuple:
+	"""Maximize mu'w - risk_aversion / 2 * w'cov w over the bounded weights.
+
+	Accelerated projected gradient (FISTA) with adaptive restart: every
+	iteration is one matrix-vector product and one projection, and the
+	momentum is reset whenever it stops pointing downhill. Returns
+	(weights, iterations).
+	"""
+	n = len(mu)
+	step = step if step is not None else 1 / np.linalg.eigvalsh(cov)[-1]
+	step = step / risk_aversion
+	w = project(np.full(n, 1 / n) if w0 is None else w0, lower, upper)
+	y = w
+	t = 1.0
+	for i in range(1, MAX_ITER + 1):
+		grad = risk_aversion * (cov @ y) - mu
+		w_next = project(y - step * grad, lower, upper)
+		if grad @ (w_next - w) > 0:
+			t = 1.0
+		t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+		y = w_next + (t - 1) / t_next * (w_next - w)
+		done = np.abs(w_next - w).max() < tol
+		w, t = w_next, t_next
+		if done:
+			break
+	return w, i
+
+
+def min_variance(cov: np.ndarray, lower: float, upper: float) -> tuple:
+	"""Lowest variance weights"""
+	return mean_variance(cov, np.zeros(len(cov)), 1.0, lower, upper)
+
+
+def max_sharpe(
+	cov: np.ndarray,
+	mu: np.ndarray,
+	risk_free: float,
+	lower: float,
+	upper: float,
+	evaluations: int = 25
+) -> tuple:
+	"""Highest Sharpe ratio weights.
+
+	The best Sharpe ratio lies on the efficient frontier, so this searches
+	the frontier (indexed by log risk aversion) with a golden section
+	search, each point solved loosely and warm started from the last one.
+	The best point is then solved to full precision.
+	"""
+	step = 1 / np.linalg.eigvalsh(cov)[-1]
+	w = None
+	iterations = 0
+	cache = {}
+
+	def sharpe(log_aversion: float) -> float:
+		nonlocal w, iterations
+		w, i = mean_variance(
+			cov, mu, np.exp(log_aversion), lower, upper, w, step, SEARCH_TOL
+		)
+		iterations += i
+		vol = np.sqrt(max(w @ cov @ w, 0))
+		cache[log_aversion] = w
+		return (mu @ w - risk_free) / vol if vol else -np.inf
+
+	ratio = (np.sqrt(5) - 1) / 2
+	a, b = np.log(1e-3), np.log(1e4)
+	c, d = b - ratio * (b - a), a + ratio * (b - a)
+	fc, fd = sharpe(c), sharpe(d)
+	for _ in range(evaluations):
+		if fc > fd:
+			b, d, fd = d, c, fc
+			c = b - ratio * (b - a)
+			fc = sharpe(c)
+		else:
+			a, c, fc = c, d, fd
+			d = a + ratio * (b - a)
+			fd = sharpe(d)
+	best = c if fc > fd else d
+	w, i = mean_variance(
+		cov, mu, np.exp(best), lower, upper, cache[best], step
+	)
+	return w, iterations + i
+
+
+def risk_parity(
+	cov: np.ndarray, budgets: np.ndarray = None, max_iter: int = 100
+) -> tuple:
+	"""Long only weights where every symbol adds the same share of risk
+	(or the share in budgets).
+
+	Newton's method on Spinu's convex formulation: minimizing
+	y'cov y / 2 - budgets'log(y) gives risk contributions proportional to
+	budgets, and y / sum(y) are the weights.
+	"""
+	n = len(cov)
+	b = np.full(n, 1 / n) if budgets is None else budgets / budgets.sum()
+	y = 1 / np.sqrt(np.diag(cov))
+	y *= np.sqrt(b.sum() / (y @ cov @ y))
+
+	def objective(y):
+		return y @ cov @ y / 2 - b @ np.log(y)
+
+	for i in range(1, max_iter + 1):
+		grad = cov @ y - b / y
+		hessian = cov + np.diag(b / y**2)
+		dy = np.linalg.solve(hessian, grad)
+		step = 1.0
+		# Stay positive, and make sure the objective goes down
+		while np.any(y - step * dy <= 0) or \
+			objective(y - step * dy) > objective(y):
+			step /= 2
+			if step < 1e-12:
+				break
+		y = y - step * dy
+		if np.abs(step * dy / y).max() < TOL:
+			break
+	return y / y.sum(), i
+
+
+def optimize(
+	objective: str,
+	returns: pd.DataFrame,
+	cov: pd.DataFrame,
+	risk_free: float = 0.0,
+	lower: float = 0.0,
+	upper: float = 1.0,
+	periods: int = analytics.TRADING_DAYS,
+	min_periods: int = covariance.MIN_PERIODS
+) -> OptimizationResult:
+	"""Weights for the columns of a dates x symbols daily returns frame.
+
+	cov is the daily covariance of those returns (e.g. from
+	covariance.CovarianceCache, shrunk or not); it is made positive
+	semi-definite before use, with pairs it has no estimate for treated as
+	uncorrelated. Symbols with fewer than min_periods returns are left out.
+	Weights add up to 1 and stay between lower and upper (0 and 1 is long
+	only). Risk parity is always long only; bounds are applied to its
+	weights afterwards.
+	"""
+	symbols = list(returns.columns[returns.count() >= min_periods])
+	if not symbols:
+		raise ValueError(
+			f'no symbol has {min_periods} daily returns in the window'
+		)
+	sigma = covariance.nearest_psd(np.nan_to_num(
+		cov.loc[symbols, symbols].to_numpy(dtype='float64') * periods
+	))
+	mu = returns[symbols].mean().to_numpy(dtype='float64') * periods
+	if objective == 'min_variance':
+		w, iterations = min_variance(sigma, lower, upper)
+	elif objective == 'max_sharpe':
+		w, iterations = max_sharpe(sigma, mu, risk_free, lower, upper)
+	elif objective == 'risk_parity':
+		w, iterations = risk_parity(sigma)
+		if lower > 0 or upper < w.max():
+			w = project(w, lower, upper)
+	else:
+		raise ValueError(f'unknown objective "{objective}"')
+	return OptimizationResult(
+		pd.Series(w, index=symbols, name='weight'),
+		float(mu @ w),
+		float(np.sqrt(max(w @ sigma @ w, 0))),
+		risk_free,
+		iterations
+	)
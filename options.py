@@ -1,17 +1,175 @@
 """Options page"""
+import pandas as pd
+
+import data
+import pricing
 import template
 import streamlit as st
 
+# Label shown in the UI: contracts the smile and surface are drawn from
+SIDES = {
+	'Out of the money': 'otm',
+	'Calls': 'calls',
+	'Puts': 'puts'
+}
+GREEK_COLUMNS = [
+	'expiration', 'optionType', 'contractSymbol', 'strike', 'mid', 'days',
+	'iv', 'delta', 'gamma', 'vega', 'theta', 'volume', 'openInterest'
+]
+
 
 class Options(template.Page):
 	"""Options page"""
+	sections = ['historical_prices', 'option_chain']
+
+	def _analyze(self, symbols: list, rate: float, asof=None) -> pd.DataFrame:
+		"""Implied volatility and greeks of every contract of the symbols,
+		priced off each symbol's last close. With asof, the chains are the
+		stored snapshots in effect at the end of that day."""
+		if asof is None:
+			chains = {
+				s: self.STATE.symbols_data[s].option_chain for s in symbols
+			}
+		else:
+			chains = {s: data.CHAIN_STORE.surface(s, asof) for s in symbols}
+			chains = {s: x for s, x in chains.items() if x is not None}
+		closes = {
+			s: self.panel.symbol_frame(s, ['close'], end=asof).dropna()
+			for s in chains
+		}
+		last = {s: x.iloc[-1] for s, x in closes.items() if not x.empty}
+		return pricing.analyze_chains(
+			{s: chains[s] for s in last},
+			{s: float(x['close']) for s, x in last.items()},
+			{s: x.name for s, x in last.items()},
+			rate
+		)
+
+	@staticmethod
+	def _controls(symbols: list) -> tuple:
+		columns = st.columns(3)
+		rate = columns[0].number_input(
+			'Risk-free rate', min_value=0.0, max_value=0.2,
+			value=pricing.RISK_FREE, step=0.005, format='%.3f'
+		)
+		side = SIDES[columns[1].selectbox(
+			'Contracts', options=list(SIDES.keys()),
+			help='''Out of the money uses puts below the last close and calls
+			above it, the most liquid side at every strike.'''
+		)]
+		dates = sorted(
+			{d for s in symbols for d in data.CHAIN_STORE.dates(s)},
+			reverse=True
+		)
+		asof = columns[2].selectbox(
+			'As of', options=[None] + dates,
+			format_func=lambda x: 'Latest' if x is None else f'{x:%Y-%m-%d}',
+			help='Chains from the snapshots stored every time one is fetched'
+		)
+		return rate, side, asof
+
+	@staticmethod
+	def _side(df: pd.DataFrame, side: str) -> pd.DataFrame:
+		if side == 'otm':
+			calls = df['optionType'] == 'calls'
+			above = df['strike'] >= df['spot']
+			return df.loc[(calls & above) | (~calls & ~above)]
+		return df.loc[df['optionType'] == side]
+
+	@staticmethod
+	def _smile(df: pd.DataFrame) -> None:
+		"""Implied volatility against strike, one line per expiry"""
+		import plotly.graph_objs as go
+
+		expiries = sorted(df['expiration'].unique())
+		selected = st.multiselect(
+			'Expiries',
+			options=expiries,
+			default=expiries[:6],
+			format_func=lambda x: f'{pd.Timestamp(x):%Y-%m-%d}'
+		)
+		fig = go.Figure()
+		for expiry, group in df.loc[df['expiration'].isin(selected)].groupby(
+			'expiration'
+		):
+			group = group.sort_values('strike')
+			fig.add_trace(go.Scatter(
+				x=group['strike'], y=group['iv'], mode='lines+markers',
+				name=f'{pd.Timestamp(expiry):%Y-%m-%d}'
+			))
+		fig.add_vline(x=df['spot'].iloc[0], line_dash='dot', line_color='gray')
+		fig.update_layout(
+			height=500, template='seaborn', hovermode='x unified',
+			xaxis_title='Strike', yaxis_title='Implied volatility',
+			yaxis_tickformat='.0%'
+		)
+		st.plotly_chart(figure_or_data=fig, use_container_width=True)
+
+	@staticmethod
+	def _surface(df: pd.DataFrame) -> None:
+		"""Implied volatility over strike and days to expiry"""
+		import plotly.graph_objs as go
+
+		grid = df.pivot_table(
+			index='days', columns='strike', values='iv', aggfunc='mean'
+		)
+		fig = go.Figure(go.Surface(
+			x=grid.columns, y=grid.index, z=grid.values,
+			colorscale='Viridis', colorbar_tickformat='.0%'
+		))
+		fig.update_layout(
+			height=700, template='seaborn',
+			scene=dict(
+				xaxis_title='Strike',
+				yaxis_title='Days to expiry',
+				zaxis_title='Implied volatility',
+				zaxis_tickformat='.0%'
+			)
+		)
+		st.plotly_chart(figure_or_data=fig, use_container_width=True)
+
+	def _chain(self, df: pd.DataFrame, side: str) -> None:
+		solved = df['iv'].notna()
+		st.caption(
+			f'Last close {df["spot"].iloc[0]:,.2f} on '
+			f'{pd.Timestamp(df["asof"].iloc[0]):%Y-%m-%d}; implied volatility '
+			f'solved for {solved.sum():,} of {len(df):,} contracts'
+		)
+		shown = self._side(df.loc[solved], side)
+		if shown.empty:
+			st.warning('No contracts with an implied volatility to show')
+			return
+		st.markdown('''### Volatility smile''')
+		self._smile(shown)
+		st.markdown('''### Volatility surface''')
+		self._surface(shown)
+		with st.expander('Greeks'):
+			st.dataframe(df[GREEK_COLUMNS])
 
 	def _single_symbol(self, symbol: str):
-		st.markdown('''
-		Eventually 
-		[Options3D](https://github.com/BrononymousEngineer/options3d) will be 
-		migrated to this page.
-		''')
+		rate, side, asof = self._controls([symbol])
+		df = self._analyze([symbol], rate, asof)
+		if df.empty:
+			st.warning(f'No option chain for {symbol}')
+			return
+		self._chain(df, side)
 
 	def _multi_symbols(self, symbols: list):
-		self._single_symbol(symbols[0] if symbols else symbols)
+		rate, side, asof = self._controls(symbols)
+		df = self._analyze(symbols, rate, asof)
+		if df.empty:
+			st.warning('No option chains to show')
+			return
+		df['atm'] = (df['moneyness'] - 1).abs()
+		nearest = df.loc[df['iv'].notna()].sort_values(['days', 'atm'])
+		summary = pd.DataFrame({
+			'Contracts': df.groupby('symbol').size(),
+			'Solved': df.groupby('symbol')['iv'].count(),
+			'Nearest expiry': nearest.groupby('symbol')['expiration'].first(),
+			'ATM implied volatility': nearest.groupby('symbol')['iv'].first()
+		})
+		st.dataframe(summary.style.format(
+			{'ATM implied volatility': '{:.1%}'}
+		))
+		symbol = st.selectbox('Symbol', options=list(summary.index))
+		self._chain(df.loc[df['symbol'] == symbol], side)
@@ -0,0 +1,209 @@
+"""Date-aligned price panel"""
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['open', 'high', 'low', 'close', 'adjclose', 'volume']
+# float32 halves the memory at the cost of precision
+DTYPE = os.environ.get('STOCKTIME_PANEL_DTYPE', 'float64')
+
+
+class PricePanel:
+	"""Price history of many symbols as one array per column.
+
+	Every array is dates x symbols, with the dates being the sorted union of
+	all the symbols' dates (NaN where a symbol has no bar). Symbols are added
+	and removed one at a time, so keeping the panel in the session means a
+	rerun only pays for the symbols that changed, and pages can cut out just
+	the rows, symbols and columns they need.
+	"""
+
+	def __init__(self, dtype: str = DTYPE, columns: list = None):
+		self.dtype = np.dtype(dtype)
+		self.columns = columns if columns is not None else COLUMNS
+		self.dates = pd.DatetimeIndex([], name='date')
+		self.symbols = []
+		self.positions = {}
+		self.bounds = {}
+		self.version = 0
+		self._histories = {}
+		self._values = {
+			col: np.empty((0, 0), dtype=self.dtype) for col in self.columns
+		}
+
+	def __repr__(self):
+		return (
+			f'PricePanel({len(self.symbols)} symbols x {len(self.dates)} dates, '
+			f'{self.dtype})'
+		)
+
+	def __contains__(self, symbol: str) -> bool:
+		return symbol in self.positions
+
+	def __len__(self):
+		return len(self.symbols)
+
+	@property
+	def nbytes(self) -> int:
+		"""Memory held by the arrays"""
+		return sum(x.nbytes for x in self._values.values())
+
+	def _grow_dates(self, dates: pd.DatetimeIndex) -> None:
+		"""Make room for dates the panel doesn't have yet"""
+		new_dates = self.dates.union(dates)
+		if len(new_dates) == len(self.dates):
+			return
+		rows = new_dates.get_indexer(self.dates)
+		for col, values in self._values.items():
+			grown = np.full(
+				(len(new_dates), values.shape[1]), np.nan, dtype=self.dtype
+			)
+			grown[rows] = values
+			self._values[col] = grown
+		self.bounds = {
+			s: (rows[first], rows[last])
+			for s, (first, last) in self.bounds.items()
+		}
+		self.dates = new_dates
+
+	def _grow_symbols(self) -> None:
+		"""Double the number of symbol slots when they run out"""
+		for col, values in self._values.items():
+			grown = np.full(
+				(values.shape[0], max(8, 2*values.shape[1])),
+				np.nan,
+				dtype=self.dtype
+			)
+			grown[:, :values.shape[1]] = values
+			self._values[col] = grown
+
+	def add(self, symbol: str, history: pd.DataFrame) -> None:
+		"""Add (or replace) a symbol's history"""
+		if symbol in self.positions:
+			self.remove(symbol)
+		dates = pd.DatetimeIndex(pd.to_datetime(history.index), name='date')
+		self._grow_dates(dates)
+		if len(self.symbols) == next(iter(self._values.values())).shape[1]:
+			self._grow_symbols()
+		position = len(self.symbols)
+		rows = self.dates.get_indexer(dates)
+		for col, values in self._values.items():
+			if col in history.columns:
+				values[rows, position] = history[col].to_numpy(dtype=self.dtype)
+		self.symbols.append(symbol)
+		self.positions[symbol] = position
+		self.bounds[symbol] = (rows.min(), rows.max()) if len(rows) else (0, -1)
+		self._histories[symbol] = history
+		self.version += 1
+
+	def remove(self, symbol: str) -> None:
+		"""Drop a symbol, moving the last symbol into its slot"""
+		position = self.positions.pop(symbol)
+		last = len(self.symbols) - 1
+		if position != last:
+			moved = self.symbols[last]
+			for values in self._values.values():
+				values[:, position] = values[:, last]
+			self.symbols[position] = moved
+			self.positions[moved] = position
+		self.symbols.pop()
+		for values in self._values.values():
+			values[:, last] = np.nan
+		del self.bounds[symbol]
+		del self._histories[symbol]
+		self.version += 1
+
+	def sync(self, symbols_data: dict, symbols: list) -> None:
+		"""Bring the panel in line with the session.
+
+		symbols are added (or replaced, if their history object changed) and
+		anything no longer in symbols_data is dropped. Only the given symbols
+		are looked at, so the cost doesn't depend on how many are loaded.
+		"""
+		for s in [x for x in self.symbols if x not in symbols_data]:
+			self.remove(s)
+		for s in symbols:
+			history = symbols_data[s].historical_prices
+			if self._histories.get(s) is not history and not history.empty:
+				self.add(s, history)
+
+	def date_range(self, symbols: list = None) -> tuple:
+		"""First and last date of the symbols, from the stored bounds"""
+		symbols = self.symbols if symbols is None else symbols
+		first, last = self._rows(symbols)
+		return self.dates[first], self.dates[last - 1]
+
+	def _rows(self, symbols: list, start=None, end=None) -> tuple:
+		"""First and last+1 row covering the symbols between start and end"""
+		bounds = [self.bounds[s] for s in symbols]
+		first = min([b[0] for b in bounds], default=0)
+		last = max([b[1] for b in bounds], default=-1) + 1
+		if start is not None:
+			first = max(first, self.dates.searchsorted(pd.Timestamp(start)))
+		if end is not None:
+			last = min(
+				last, self.dates.searchsorted(pd.Timestamp(end), side='right')
+			)
+		return first, max(first, last)
+
+	def matrix(
+		self, column: str, symbols: list = None, start=None, end=None
+	) -> pd.DataFrame:
+		"""Wide dates x symbols frame of one column"""
+		symbols = self.symbols if symbols is None else symbols
+		first, last = self._rows(symbols, start, end)
+		positions = [self.positions[s] for s in symbols]
+		return pd.DataFrame(
+			self._values[column][first:last, positions],
+			index=self.dates[first:last],
+			columns=pd.Index(symbols, name='symbol')
+		)
+
+	def values(
+		self, column: str, symbols: list = None, first: int = 0
+	) -> np.ndarray:
+		"""Rows from first on of one column as a dates x symbols array (a
+		copy)"""
+		symbols = self.symbols if symbols is None else symbols
+		positions = [self.positions[s] for s in symbols]
+		return self._values[column][first:, positions]
+
+	def last_value(self, column: str, symbol: str, row: int) -> float:
+		"""A symbol's value on its last bar at or before row, carried over
+		gaps like analytics.fill_prices does. NaN before its first bar and
+		after its last one."""
+		values = self._values[column]
+		position = self.positions[symbol]
+		first, last = self.bounds[symbol]
+		if row > last:
+			return np.nan
+		for r in range(row, first - 1, -1):
+			if not np.isnan(values[r, position]):
+				return float(values[r, position])
+		return np.nan
+
+	def symbol_frame(
+		self, symbol: str, columns: list = None, start=None, end=None
+	) -> pd.DataFrame:
+		"""One symbol's history, without the dates it has no bar for"""
+		columns = self.columns if columns is None else columns
+		first, last = self._rows([symbol], start, end)
+		position = self.positions[symbol]
+		values = np.column_stack([
+			self._values[col][first:last, position] for col in columns
+		]) if columns else np.empty((last - first, 0))
+		df = pd.DataFrame(values, index=self.dates[first:last], columns=columns)
+		return df.loc[~np.isnan(values).all(axis=1)] if columns else df
+
+	def frame(
+		self, symbols: list = None, columns: list = None, start=None, end=None
+	) -> pd.DataFrame:
+		"""(symbol, date) MultiIndex frame like utils.concat_obj_data makes"""
+		symbols = self.symbols if symbols is None else symbols
+		if not symbols:
+			return None
+		return pd.concat(
+			{s: self.symbol_frame(s, columns, start, end) for s in symbols},
+			keys=symbols
+		)
@@ -0,0 +1,185 @@
+"""Portfolio engine"""
+import numpy as np
+import pandas as pd
+
+# Label shown in the UI: rebalancing mode
+REBALANCE_MODES = {
+	'Daily': 'daily',
+	'Monthly': 'monthly',
+	'Quarterly': 'quarterly',
+	'Drift threshold': 'threshold',
+	'Buy and hold': 'none'
+}
+# Dates x symbols are processed this many dates at a time when looking for
+# the next drift threshold breach
+_LOOKAHEAD = 256
+
+
+class PortfolioResult:
+	"""Value path of a weighted portfolio and what it cost to keep it there"""
+
+	def __init__(
+		self,
+		value: pd.Series,
+		rebalance_dates: pd.Index,
+		turnover: pd.Series
+	):
+		self.value = value
+		self.rebalance_dates = rebalance_dates
+		self.turnover = turnover
+
+	def __repr__(self):
+		return (
+			f'PortfolioResult({len(self.value)} dates, '
+			f'{len(self.rebalance_dates)} rebalances, '
+			f'{self.total_turnover:.2f} turnover)'
+		)
+
+	@property
+	def total_turnover(self) -> float:
+		"""Sum of one-way turnover over every rebalance"""
+		return float(self.turnover.sum())
+
+	@property
+	def annual_turnover(self) -> float:
+		"""Average one-way turnover per year"""
+		if len(self.value) < 2:
+			return 0.0
+		years = (self.value.index[-1] - self.value.index[0]).days / 365.25
+		return self.total_turnover / years if years > 0 else 0.0
+
+
+def returns_matrix(prices: pd.DataFrame) -> np.ndarray:
+	"""Simple returns of a dates x symbols price frame.
+
+	The dates are the union of every symbol's dates, so a symbol can have
+	gaps where another one traded (crypto on weekends, foreign holidays).
+	Its last price is carried over them, so the move across a gap lands on
+	its next bar instead of being lost. Days before a symbol listed count
+	as a zero return, and the first row is all zeros.
+
+	>>> dates = pd.to_datetime(['2024-01-05', '2024-01-06', '2024-01-08'])
+	>>> prices = pd.DataFrame(
+	...     {'BTC': [100.0, 110.0, 121.0], 'SPY': [10.0, np.nan, 11.0]},
+	...     index=dates
+	... )
+	>>> returns_matrix(prices).round(4).tolist()
+	[[0.0, 0.0], [0.1, 0.0], [0.1, 0.1]]
+	>>> build(prices, {'SPY': 1.0}, 'none').value.round(4).tolist()
+	[1.0, 1.0, 1.1]
+	>>> build(prices, {'BTC': 0.5, 'SPY': 0.5}, 'none').value.round(4).tolist()
+	[1.0, 1.05, 1.155]
+	"""
+	values = prices.ffill().to_numpy(dtype='float64')
+	returns = np.zeros_like(values)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		returns[1:] = values[1:] / values[:-1] - 1
+	returns[~np.isfinite(returns)] = 0
+	return returns
+
+
+def _calendar_starts(dates: pd.DatetimeIndex, mode: str) -> np.ndarray:
+	"""Positions of the dates where a new holding period starts"""
+	n = len(dates)
+	if mode == 'daily':
+		return np.arange(n)
+	if mode == 'none':
+		return np.array([0])
+	periods = {
+		'monthly': dates.year * 12 + dates.month,
+		'quarterly': dates.year * 4 + (dates.month - 1) // 3
+	}[mode]
+	periods = np.asarray(periods)
+	return np.r_[0, np.flatnonzero(periods[1:] != periods[:-1]) + 1]
+
+
+def _growth(weights: np.ndarray, cash: float, rel: np.ndarray) -> np.ndarray:
+	"""Portfolio growth since the last rebalance"""
+	return rel @ weights + cash
+
+
+def _threshold_starts(
+	cum: np.ndarray, weights: np.ndarray, cash: float, threshold: float
+) -> np.ndarray:
+	"""Rebalance whenever any weight drifts more than threshold away"""
+	n = len(cum) - 1
+	starts = [0]
+	start = 0
+	block = start
+	while block < n:
+		stop = min(n, block + _LOOKAHEAD)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			rel = np.nan_to_num(cum[block + 1:stop + 1] / cum[start])
+		growth = _growth(weights, cash, rel)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			drift = np.abs(rel * weights / growth[:, None] - weights).max(axis=1)
+		breaches = np.flatnonzero(drift > threshold)
+		if len(breaches):
+			start = block + breaches[0] + 1
+			if start >= n:
+				break
+			starts.append(start)
+			block = start
+		else:
+			block = stop
+	return np.array(starts)
+
+
+def build(
+	prices: pd.DataFrame,
+	weights: dict,
+	rebalance: str = 'daily',
+	threshold: float = 0.05
+) -> PortfolioResult:
+	"""Value of a weighted portfolio of the columns of prices.
+
+	prices is a dates x symbols frame. Weights don't have to add up to 1;
+	whatever is left over sits in cash earning nothing. rebalance is one of
+	REBALANCE_MODES' values: back to the target weights every day, at the
+	first close of each month/quarter, whenever a weight drifts more than
+	threshold away from its target, or never.
+
+	The portfolio is split into holding periods between rebalances. Within a
+	period every symbol just compounds, so all periods are computed at once
+	from the cumulative growth matrix; only the value carried from one
+	period to the next is chained.
+	"""
+	symbols = list(weights.keys())
+	dates = pd.DatetimeIndex(prices.index)
+	w = np.array([weights[s] for s in symbols], dtype='float64')
+	cash = 1 - w.sum()
+	returns = returns_matrix(prices[symbols])
+	n = len(dates)
+	# cum[k] is each symbol's growth over the first k dates
+	cum = np.vstack([
+		np.ones((1, len(symbols))), np.cumprod(1 + returns, axis=0)
+	])
+
+	if rebalance == 'threshold':
+		starts = _threshold_starts(cum, w, cash, threshold)
+	else:
+		starts = _calendar_starts(dates, rebalance)
+	is_start = np.zeros(n, dtype=bool)
+	is_start[starts] = True
+	period = np.cumsum(is_start) - 1
+	with np.errstate(divide='ignore', invalid='ignore'):
+		rel = np.nan_to_num(cum[1:] / cum[starts[period]])
+	growth = _growth(w, cash, rel)
+	ends = np.r_[starts[1:] - 1, n - 1]
+	start_value = np.r_[1, np.cumprod(growth[ends])[:-1]]
+	value = start_value[period] * growth
+
+	# Turnover at each rebalance: how far the weights drifted in the period
+	with np.errstate(divide='ignore', invalid='ignore'):
+		drifted = rel[ends[:-1]] * w / growth[ends[:-1], None]
+		drifted_cash = cash / growth[ends[:-1]]
+	turnover = 0.5 * (
+		np.nan_to_num(np.abs(drifted - w)).sum(axis=1) +
+		np.nan_to_num(np.abs(drifted_cash - cash))
+	)
+	rebalance_dates = dates[starts[1:]]
+	return PortfolioResult(
+		pd.Series(value, index=dates, name='Weighted Portfolio'),
+		rebalance_dates,
+		pd.Series(turnover, index=rebalance_dates, name='turnover')
+	)
@@ -0,0 +1,142 @@
+"""Warm the price cache for a universe of symbols without the app
+
+Usage
+-----
+python prefetch.py SP500.txt [more.txt ...] [--interval 1d] [--force]
+	[--option-chains] [--intraday 1m 5m 1h]
+
+Symbol files have one symbol per line, like the ones the app takes. Symbols
+whose cached history is still fresh are skipped, so a run that was stopped
+part way picks up where it left off when started again. Set STOCKTIME_SOURCE
+and STOCKTIME_CACHE_DIR the same way as for the app. Exits with 1 if any
+symbol failed.
+
+With --option-chains every symbol's option chain is also fetched and added
+to the chain store, so running it once a day (e.g. from cron) builds up the
+history the Options page's "As of" dates come from.
+
+With --intraday the intraday store is topped up with bars of the given
+intervals, as far back as Yahoo keeps them. Days already stored are only
+fetched again if they were still being traded when stored.
+"""
+import argparse
+import sys
+import time
+
+import data
+import fetch
+import intraday
+
+
+def read_universe(paths: list) -> list:
+	"""Sorted unique upper case symbols from one or more files"""
+	symbols = set()
+	for path in paths:
+		with open(path) as f:
+			symbols |= {x.strip().upper() for x in f if x.strip()}
+	return sorted(symbols)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+	parser = argparse.ArgumentParser(
+		description='Fetch price history for a universe into the price cache'
+	)
+	parser.add_argument('files', nargs='+', help='symbol files')
+	parser.add_argument('--interval', default='1d')
+	parser.add_argument('--chunk-size', type=int, default=data.CHUNK_SIZE)
+	parser.add_argument('--workers', type=int, default=fetch.MAX_WORKERS)
+	parser.add_argument(
+		'--force', action='store_true',
+		help='refresh symbols whose cached history is still fresh'
+	)
+	parser.add_argument(
+		'--option-chains', action='store_true',
+		help='also snapshot every symbol\'s option chain'
+	)
+	parser.add_argument(
+		'--intraday', nargs='+', default=[], choices=intraday.INTERVALS,
+		help='also store intraday bars of these intervals'
+	)
+	parser.add_argument(
+		'--quiet', action='store_true', help='only print the summary'
+	)
+	return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+	args = parse_args(argv)
+	universe = read_universe(args.files)
+	if args.force:
+		symbols = universe
+	else:
+		symbols = [
+			s for s in universe
+			if data.PRICE_CACHE.is_stale(s, args.interval)
+		]
+	skipped = len(universe) - len(symbols)
+	print(
+		f'{len(universe)} symbols, {skipped} fresh in {data.PRICE_CACHE}, '
+		f'fetching {len(symbols)} from {data.SOURCE}'
+	)
+
+	def progress(n_done: int, n_total: int, chunk: str):
+		if not args.quiet:
+			print(f'  {chunk} ({n_done}/{n_total} chunks)')
+
+	size_before = data.PRICE_CACHE.size()
+	start_time = time.perf_counter()
+	result = data.prefetch_history(
+		symbols, args.interval, args.chunk_size, args.workers, progress
+	) if symbols else fetch.FetchResult()
+	elapsed = time.perf_counter() - start_time
+	size_after = data.PRICE_CACHE.size()
+
+	rate = len(result.loaded) / elapsed if elapsed else 0.0
+	print(
+		f'fetched {len(result.loaded)} symbols '
+		f'({sum(result.loaded.values())} bars) in {elapsed:.1f}s, '
+		f'{rate:.1f} symbols/s; '
+		f'{len(result.errors)} failed; {skipped} skipped; '
+		f'cache {size_after / 1024**2:.1f}MB '
+		f'({(size_after - size_before) / 1024**2:.1f}MB written)'
+	)
+	if data.PRICE_CACHE.timing_report():
+		print(data.PRICE_CACHE.timing_report())
+	for s, error in sorted(result.errors.items()):
+		print(f'  failed {s}: {error}')
+	failed = bool(result.errors)
+
+	if args.option_chains:
+		start_time = time.perf_counter()
+		chains = data.snapshot_chains(
+			universe, args.chunk_size, args.workers, progress
+		)
+		print(
+			f'snapshot {len(chains.loaded)} option chains '
+			f'({sum(chains.loaded.values())} contracts) in '
+			f'{time.perf_counter() - start_time:.1f}s to {data.CHAIN_STORE}; '
+			f'{len(chains.errors)} failed'
+		)
+		for s, error in sorted(chains.errors.items()):
+			print(f'  failed {s}: {error}')
+		failed = failed or bool(chains.errors)
+
+	for interval in args.intraday:
+		start_time = time.perf_counter()
+		bars = data.prefetch_intraday(
+			universe, interval, args.chunk_size, args.workers, progress
+		)
+		print(
+			f'stored {interval} bars of {len(bars.loaded)} symbols '
+			f'({sum(bars.loaded.values())} bars written) in '
+			f'{time.perf_counter() - start_time:.1f}s to {data.INTRADAY_STORE}; '
+			f'{len(bars.errors)} failed'
+		)
+		for s, error in sorted(bars.errors.items()):
+			print(f'  failed {s}: {error}')
+		failed = failed or bool(bars.errors)
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
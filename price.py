@@ -1,4 +1,5 @@
 """Price page"""
+import analytics
 import components
 import template
 import utils
@@ -10,13 +11,54 @@ import streamlit as st
 class Price(template.Page):
 	"""Price page"""
 
-	def _create_ts_chart(self) -> components.TimeSeriesChart:
+	def __init__(self, symbols: list, STATE: st.session_state):
+		super().__init__(symbols, STATE)
+		if not hasattr(STATE, 'analytics'):
+			STATE.analytics = analytics.RollingAnalytics()
+
+	def _create_ts_chart(
+		self, container: st.container
+	) -> components.TimeSeriesChart:
 		return components.TimeSeriesChart(
-			st.expander('Chart', expanded=True), self.symbols, self.data
+			container, self.symbols, self.panel, cache=self.STATE.charts
+		)
+
+	def _overlay(
+		self, container: st.container, chart: components.TimeSeriesChart
+	):
+		"""Rolling analytics drawn over the chart"""
+		columns = container.columns(3)
+		label = columns[0].selectbox(
+			'Overlay', options=['None'] + list(analytics.METRICS.keys())
 		)
+		if label == 'None':
+			return
+		metric = analytics.METRICS[label]
+		window = columns[1].number_input(
+			'Window (bars)', min_value=2, max_value=2520, value=63, step=1,
+			help='63 bars is about 3 months of daily bars'
+		) if metric not in analytics.NO_WINDOW else None
+		benchmark = columns[2].selectbox(
+			'Benchmark', options=list(self.STATE.symbols_data.keys())
+		) if metric == 'beta' else None
+		if benchmark is not None:
+			self.panel.sync(self.STATE.symbols_data, [benchmark])
+		try:
+			frame = self.STATE.analytics.compute(
+				self.panel, metric, self.symbols, window, benchmark,
+				chart.start_date, chart.end_date
+			)
+		except ValueError as e:
+			container.warning(e)
+			return
+		chart.add_overlay(frame, label, percent=metric != 'beta')
 
 	def _single_symbol(self, symbol: str):
-		chart = self._create_ts_chart()
+		container = st.expander('Chart', expanded=True)
+		chart = self._create_ts_chart(container)
+		self._overlay(container, chart)
 
 	def _multi_symbols(self, symbols: list):
-		chart = self._create_ts_chart()
+		container = st.expander('Chart', expanded=True)
+		chart = self._create_ts_chart(container)
+		self._overlay(container, chart)
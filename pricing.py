@@ -0,0 +1,222 @@
+"""Black-Scholes prices, implied volatility and greeks for whole option
+chains"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Volatilities the implied volatility solver searches between
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+MAX_ITER = 100
+# Solved once the model price is this close to the market price
+TOL = 1e-8
+# Used when the UI doesn't ask for one
+RISK_FREE = float(os.environ.get('STOCKTIME_RISK_FREE', 0.04))
+_SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+	"""Standard normal density"""
+	return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+	"""Standard normal distribution function, to ~1e-16, without scipy.
+
+	Near zero it sums the series x + x^3/3 + x^5/(3*5) + ... and in the
+	tails it evaluates the continued fraction for the Mills ratio, which
+	keeps tiny probabilities accurate relative to their size.
+	"""
+	x = np.asarray(x, dtype='float64')
+	out = np.empty_like(x)
+	pdf = norm_pdf(x)
+	near = np.abs(x) < 3
+	xn = x[near]
+	x2 = xn * xn
+	term = xn.copy()
+	total = xn.copy()
+	for n in range(1, 50):
+		term = term * x2 / (2 * n + 1)
+		total += term
+	out[near] = 0.5 + pdf[near] * total
+	z = np.abs(x[~near])
+	fraction = z.copy()
+	for k in range(40, 0, -1):
+		fraction = z + k / fraction
+	tail = pdf[~near] / fraction
+	out[~near] = np.where(x[~near] > 0, 1 - tail, tail)
+	return out
+
+
+def _d1(spot, strike, t, sigma, rate, dividend):
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return (
+			np.log(spot / strike) + (rate - dividend + sigma * sigma / 2) * t
+		) / (sigma * np.sqrt(t))
+
+
+def price(
+	spot: np.ndarray,
+	strike: np.ndarray,
+	t: np.ndarray,
+	sigma: np.ndarray,
+	rate: float = RISK_FREE,
+	dividend: float = 0.0,
+	is_call: np.ndarray = True
+) -> np.ndarray:
+	"""Black-Scholes price of European options, t in years"""
+	d1 = _d1(spot, strike, t, sigma, rate, dividend)
+	d2 = d1 - sigma * np.sqrt(t)
+	sign = np.where(is_call, 1.0, -1.0)
+	return sign * (
+		spot * np.exp(-dividend * t) * norm_cdf(sign * d1) -
+		strike * np.exp(-rate * t) * norm_cdf(sign * d2)
+	)
+
+
+def implied_volatility(
+	premium: np.ndarray,
+	spot: np.ndarray,
+	strike: np.ndarray,
+	t: np.ndarray,
+	rate: float = RISK_FREE,
+	dividend: float = 0.0,
+	is_call: np.ndarray = True
+) -> np.ndarray:
+	"""Volatility that makes the Black-Scholes price equal premium.
+
+	Every contract is solved at once: each iteration takes a Newton step
+	on the contracts still unsolved, and falls back to bisecting the
+	bracket a contract's volatility is known to be in whenever the step
+	would leave it (far from the money, where vega is tiny). Premiums
+	outside the no-arbitrage bounds have no solution and get NaN.
+	"""
+	premium, spot, strike, t, is_call = [
+		np.broadcast_to(np.asarray(x), np.shape(premium)).ravel()
+		for x in [premium, spot, strike, t, is_call]
+	]
+	premium, spot, strike, t = [
+		x.astype('float64') for x in [premium, spot, strike, t]
+	]
+	forward = spot * np.exp(-dividend * t)
+	discounted = strike * np.exp(-rate * t)
+	intrinsic = np.maximum(np.where(
+		is_call, forward - discounted, discounted - forward
+	), 0)
+	ceiling = np.where(is_call, forward, discounted)
+	out = np.full(len(premium), np.nan)
+	active = np.flatnonzero(
+		(t > 0) & (premium > intrinsic) & (premium < ceiling)
+	)
+	# Manaster-Koehler guess away from the money, Brenner-Subrahmanyam at it
+	sigma = np.clip(np.maximum(
+		np.sqrt(2 * np.abs(np.log(forward / discounted)) / t),
+		premium / spot * np.sqrt(2 * np.pi / t)
+	)[active], 0.05, 2.0)
+	low = np.full(len(active), MIN_VOL)
+	high = np.full(len(active), MAX_VOL)
+	args = [x[active] for x in [spot, strike, t, premium, is_call]]
+	for _ in range(MAX_ITER):
+		if not len(active):
+			break
+		s, k, tt, p, c = args
+		d1 = _d1(s, k, tt, sigma, rate, dividend)
+		diff = price(s, k, tt, sigma, rate, dividend, c) - p
+		vega = s * np.exp(-dividend * tt) * norm_pdf(d1) * np.sqrt(tt)
+		done = (np.abs(diff) < TOL) | (high - low < TOL)
+		out[active[done]] = sigma[done]
+		high = np.where(diff > 0, sigma, high)
+		low = np.where(diff < 0, sigma, low)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			step = sigma - diff / vega
+		sigma = np.where(
+			(step > low) & (step < high), step, (low + high) / 2
+		)
+		keep = ~done
+		active, sigma, low, high = active[keep], sigma[keep], low[keep], \
+			high[keep]
+		args = [x[keep] for x in args]
+	return out
+
+
+def greeks(
+	spot: np.ndarray,
+	strike: np.ndarray,
+	t: np.ndarray,
+	sigma: np.ndarray,
+	rate: float = RISK_FREE,
+	dividend: float = 0.0,
+	is_call: np.ndarray = True
+) -> dict:
+	"""Delta, gamma, vega (per 1 point of volatility) and theta (per
+	calendar day) of European options"""
+	sqrt_t = np.sqrt(t)
+	d1 = _d1(spot, strike, t, sigma, rate, dividend)
+	d2 = d1 - sigma * sqrt_t
+	sign = np.where(is_call, 1.0, -1.0)
+	carry = np.exp(-dividend * t)
+	discount = np.exp(-rate * t)
+	pdf = norm_pdf(d1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		gamma = carry * pdf / (spot * sigma * sqrt_t)
+		theta = (
+			-spot * carry * pdf * sigma / (2 * sqrt_t) +
+			sign * (
+				dividend * spot * carry * norm_cdf(sign * d1) -
+				rate * strike * discount * norm_cdf(sign * d2)
+			)
+		) / 365
+	return {
+		'delta': sign * carry * norm_cdf(sign * d1),
+		'gamma': gamma,
+		'vega': spot * carry * pdf * sqrt_t / 100,
+		'theta': theta
+	}
+
+
+def analyze_chains(
+	chains: dict,
+	spots: dict,
+	asof: dict,
+	rate: float = RISK_FREE,
+	dividend: float = 0.0
+) -> pd.DataFrame:
+	"""Implied volatility and greeks of every contract in many chains.
+
+	chains map symbols to SymbolData.option_chain frames, spots to the
+	underlying's price and asof to the date of that price. Contracts are
+	priced at the bid/ask midpoint (the last price if there's no quote),
+	and all the symbols are solved in one vectorized pass.
+	"""
+	frames = [
+		chain.reset_index().assign(symbol=s, spot=spots[s], asof=asof[s])
+		for s, chain in chains.items()
+		if isinstance(chain, pd.DataFrame) and not chain.empty
+	]
+	if not frames:
+		return pd.DataFrame()
+	df = pd.concat(frames, ignore_index=True)
+	bid = df['bid'].to_numpy(dtype='float64')
+	ask = df['ask'].to_numpy(dtype='float64')
+	df['mid'] = np.where(
+		(bid > 0) & (ask >= bid), (bid + ask) / 2,
+		df['lastPrice'].to_numpy(dtype='float64')
+	)
+	df['days'] = np.maximum(
+		(pd.to_datetime(df['expiration']) - pd.to_datetime(df['asof'])).dt.days,
+		1
+	)
+	t = df['days'].to_numpy(dtype='float64') / 365
+	spot = df['spot'].to_numpy(dtype='float64')
+	strike = df['strike'].to_numpy(dtype='float64')
+	is_call = (df['optionType'] == 'calls').to_numpy()
+	df['moneyness'] = strike / spot
+	df['iv'] = implied_volatility(
+		df['mid'].to_numpy(), spot, strike, t, rate, dividend, is_call
+	)
+	for name, values in greeks(
+		spot, strike, t, df['iv'].to_numpy(), rate, dividend, is_call
+	).items():
+		df[name] = values
+	return df
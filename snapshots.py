@@ -0,0 +1,223 @@
+"""Option chain snapshots kept on disk"""
+import datetime as dt
+import os
+
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pyarrow import fs
+
+import cache
+
+# Record every option chain fetched from the source
+ENABLED = os.environ.get('STOCKTIME_CHAIN_SNAPSHOTS', '1') != '0'
+# Directory levels under the store's directory
+PARTITIONS = pa.schema([
+	('symbol', pa.string()),
+	('date', pa.date32()),
+	('expiration', pa.date32())
+])
+
+
+class ChainStore:
+	"""Append-only store of option chain snapshots.
+
+	Every snapshot of a chain is written once and never changed, as one
+	Parquet file per expiry:
+
+		<directory>/symbol=<symbol>/date=<snapshot date>/
+			expiration=<expiry>/<HHMMSS>.parquet
+
+	so finding the snapshot in effect on a date only lists directories,
+	and reading it touches that snapshot's files only. Files are memory
+	mapped when read, so the OS pages in just the columns asked for.
+	"""
+
+	def __init__(self, directory: str = cache.CACHE_DIR):
+		self.directory = os.path.join(directory, 'option_chains')
+		self.filesystem = fs.LocalFileSystem(use_mmap=True)
+
+	def __repr__(self):
+		return f'ChainStore({self.directory})'
+
+	def _symbol_dir(self, symbol: str) -> str:
+		return os.path.join(self.directory, f'symbol={quote(symbol, safe="")}')
+
+	@staticmethod
+	def _listdir(path: str, prefix: str) -> list:
+		"""Partition values of the subdirectories of path, sorted"""
+		if not os.path.isdir(path):
+			return []
+		return sorted(
+			unquote(x[len(prefix) + 1:]) for x in os.listdir(path)
+			if x.startswith(f'{prefix}=')
+		)
+
+	def append(
+		self, symbol: str, chain: pd.DataFrame, snapshot: dt.datetime = None
+	) -> int:
+		"""Store a SymbolData.option_chain frame taken at snapshot (now if
+		None). Returns the number of files written."""
+		if not isinstance(chain, pd.DataFrame) or chain.empty:
+			return 0
+		snapshot = pd.Timestamp(snapshot or dt.datetime.now()).floor('s')
+		df = chain.reset_index()
+		# Same types in every file, whatever compact() picked for this chain
+		dtypes = {}
+		for col, dtype in df.dtypes.items():
+			if pd.api.types.is_categorical_dtype(dtype):
+				dtypes[col] = 'str'
+			elif pd.api.types.is_bool_dtype(dtype) or col == 'expiration':
+				continue
+			elif pd.api.types.is_numeric_dtype(dtype):
+				dtypes[col] = 'float32'
+		df = df.astype(dtypes).sort_values('expiration', kind='stable')
+		df['snapshot'] = snapshot
+		expirations = pd.DatetimeIndex(df.pop('expiration'))
+		# Files are small, so leave out what would only bloat their footers:
+		# the pandas schema and column statistics (partitions do the pruning)
+		table = pa.Table.from_pandas(
+			df, preserve_index=False
+		).replace_schema_metadata(None)
+		day_dir = os.path.join(
+			self._symbol_dir(symbol), f'date={snapshot.date()}'
+		)
+		starts = [0] + list(
+			(expirations[1:] != expirations[:-1]).nonzero()[0] + 1
+		) + [len(df)]
+		for first, last in zip(starts[:-1], starts[1:]):
+			path = os.path.join(
+				day_dir,
+				f'expiration={expirations[first].date()}',
+				f'{snapshot:%H%M%S}.parquet'
+			)
+			cache.write_atomic(path, lambda tmp_path: pq.write_table(
+				table.slice(first, last - first), tmp_path,
+				write_statistics=False
+			))
+		return len(starts) - 1
+
+	def symbols(self) -> list:
+		"""Symbols with at least one snapshot"""
+		return self._listdir(self.directory, 'symbol')
+
+	def dates(self, symbol: str) -> list:
+		"""Dates a symbol has snapshots for, oldest first"""
+		return [
+			pd.Timestamp(x) for x in self._listdir(self._symbol_dir(symbol), 'date')
+		]
+
+	def _snapshot_files(self, symbol: str, asof: pd.Timestamp) -> list:
+		"""Files of the last snapshot taken at or before asof"""
+		symbol_dir = self._symbol_dir(symbol)
+		dates = self._listdir(symbol_dir, 'date')
+		for date in reversed(dates):
+			if pd.Timestamp(date) > asof.normalize():
+				continue
+			day_dir = os.path.join(symbol_dir, f'date={date}')
+			files = [
+				(name, os.path.join(day_dir, x, name))
+				for x in os.listdir(day_dir)
+				for name in os.listdir(os.path.join(day_dir, x))
+				if name.endswith('.parquet')
+			]
+			cutoff = f'{asof:%H%M%S}.parquet' \
+				if pd.Timestamp(date) == asof.normalize() else None
+			names = [n for n, _ in files if cutoff is None or n <= cutoff]
+			if names:
+				return [path for n, path in files if n == max(names)]
+		return []
+
+	def surface(
+		self, symbol: str, asof=None, columns: list = None
+	) -> pd.DataFrame:
+		"""The chain as it was at asof (a date means the end of that day),
+		indexed like SymbolData.option_chain, or None if there's no
+		snapshot that old"""
+		asof = pd.Timestamp.now() if asof is None else pd.Timestamp(asof)
+		if asof == asof.normalize():
+			asof = asof + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+		files = self._snapshot_files(symbol, asof)
+		if not files:
+			return None
+		if columns is not None:
+			columns = list(dict.fromkeys(['optionType'] + list(columns)))
+		tables = []
+		expirations = []
+		for path in sorted(files):
+			tables.append(pq.read_table(path, columns=columns, memory_map=True))
+			expirations += [
+				os.path.basename(os.path.dirname(path)).split('=')[1]
+			] * tables[-1].num_rows
+		df = pa.concat_tables(tables, promote=True).to_pandas()
+		df.index = pd.MultiIndex.from_arrays(
+			[pd.DatetimeIndex(expirations), df.pop('optionType')],
+			names=['expiration', 'optionType']
+		)
+		return df.sort_index()
+
+	def history(
+		self,
+		symbols: list = None,
+		start=None,
+		end=None,
+		columns: list = None,
+		daily: bool = True
+	) -> pd.DataFrame:
+		"""Every snapshot of the symbols taken between start and end dates,
+		as one long frame with symbol, date and expiration columns.
+
+		Only the partitions in range are handed to pyarrow, which scans them
+		memory mapped and reads just the columns asked for. With daily,
+		only each day's last snapshot is kept.
+		"""
+		symbols = self.symbols() if symbols is None else symbols
+		start = None if start is None else pd.Timestamp(start).normalize()
+		end = None if end is None else pd.Timestamp(end).normalize()
+		paths = []
+		for symbol in symbols:
+			symbol_dir = self._symbol_dir(symbol)
+			for date in self._listdir(symbol_dir, 'date'):
+				if (start is not None and pd.Timestamp(date) < start) or \
+					(end is not None and pd.Timestamp(date) > end):
+					continue
+				day_dir = os.path.join(symbol_dir, f'date={date}')
+				paths += [
+					os.path.join(root, name)
+					for root, _, files in os.walk(day_dir)
+					for name in files if name.endswith('.parquet')
+				]
+		if not paths:
+			return pd.DataFrame()
+		dataset = ds.dataset(
+			paths,
+			format='parquet',
+			filesystem=self.filesystem,
+			partitioning=ds.partitioning(PARTITIONS, flavor='hive'),
+			partition_base_dir=self.directory
+		)
+		if columns is not None:
+			columns = list(dict.fromkeys(
+				list(PARTITIONS.names) + ['snapshot'] + list(columns)
+			))
+		df = dataset.to_table(columns=columns).to_pandas()
+		for col in ['date', 'expiration']:
+			df[col] = pd.to_datetime(df[col])
+		if daily:
+			last = df.groupby(['symbol', 'date'])['snapshot'].transform('max')
+			df = df.loc[df['snapshot'] == last]
+		return df.sort_values(['symbol', 'snapshot', 'expiration']).reset_index(
+			drop=True
+		)
+
+	def size(self) -> int:
+		"""Bytes used on disk"""
+		return sum(
+			os.path.getsize(os.path.join(root, name))
+			for root, _, files in os.walk(self.directory)
+			for name in files if name.endswith('.parquet')
+		)
@@ -0,0 +1,584 @@
+"""Data sources
+
+data.py only talks to ticker objects with the part of the yahooquery.Ticker
+interface it needs:
+
+	ticker.symbols                           settable list of symbols
+	ticker.session                           passed on to other tickers
+	ticker.invalid_symbols                   set when validate=True
+	ticker.asset_profile / quote_type / price
+	                                         {symbol: dict or error message}
+	ticker.history(period, interval, start, end)
+	                                         (symbol, date) MultiIndex frame,
+	                                         or {symbol: frame or error}
+	ticker.option_chain                      (symbol, expiration, optionType)
+	                                         MultiIndex frame or error message
+
+A DataSource hands out those ticker objects. YahooSource uses yahooquery,
+ReplaySource plays back responses recorded with record(), and
+SyntheticSource makes up realistic looking data. Every source can add an
+artificial delay to each request so the fetch pipeline can be benchmarked
+offline.
+"""
+import datetime as dt
+import json
+import math
+import os
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from abc import ABC, abstractmethod
+
+import cache
+import intraday
+
+# Endpoints that return {symbol: dict}
+DICT_ENDPOINTS = ['asset_profile', 'quote_type', 'price']
+
+
+class DataSource(ABC):
+	"""Hands out ticker objects for data.py"""
+	name: str
+
+	def __init__(self, latency: float = 0.0):
+		self.latency = latency
+
+	def __repr__(self):
+		return f'{self.__class__.__name__}(latency={self.latency})'
+
+	@property
+	def cache_dir(self) -> str:
+		"""Where the on-disk caches for this source's data live"""
+		return os.path.join(cache.CACHE_DIR, self.name)
+
+	def now(self) -> pd.Timestamp:
+		"""Current time as far as the source's data goes"""
+		return pd.Timestamp.now()
+
+	@abstractmethod
+	def ticker(self, symbols: list, validate: bool = False, session=None):
+		"""Ticker object for a list of symbols"""
+		raise NotImplementedError(
+			'need to implement ticker(self, symbols, validate, session) ' +
+			f'in class: {self.__class__.__name__}'
+		)
+
+
+class YahooSource(DataSource):
+	"""Yahoo! Finance through yahooquery"""
+	name = 'yahoo'
+
+	@property
+	def cache_dir(self) -> str:
+		return cache.CACHE_DIR
+
+	def ticker(self, symbols: list, validate: bool = False, session=None):
+		if not self.latency:
+			import yahooquery as yq
+
+			return yq.Ticker(symbols, validate=validate, session=session)
+		ticker = _latency_ticker()(symbols, validate=validate, session=session)
+		ticker.latency = self.latency
+		return ticker
+
+
+_LATENCY_TICKER = None
+
+
+def _latency_ticker() -> type:
+	"""yahooquery Ticker that waits its latency before every request. Made
+	once, on first use, so yahooquery is only imported if Yahoo is used"""
+	global _LATENCY_TICKER
+	if _LATENCY_TICKER is None:
+		import yahooquery as yq
+
+		class LatencyTicker(yq.Ticker):
+			latency = 0.0
+
+			def _get_data(self, *args, **kwargs):
+				time.sleep(self.latency)
+				return super()._get_data(*args, **kwargs)
+
+		_LATENCY_TICKER = LatencyTicker
+	return _LATENCY_TICKER
+
+
+class OfflineTicker:
+	"""Base for tickers that don't go through yahooquery"""
+
+	def __init__(self, source: DataSource, symbols: list, validate: bool):
+		self.source = source
+		self.session = None
+		self.invalid_symbols = None
+		self.symbols = symbols
+		if validate:
+			valid = [s for s in self.symbols if self._is_valid(s)]
+			self.invalid_symbols = [
+				s for s in self.symbols if s not in valid
+			] or None
+			self.symbols = valid
+
+	@property
+	def symbols(self) -> list:
+		return self._symbols
+
+	@symbols.setter
+	def symbols(self, symbols) -> None:
+		self._symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+
+	def _wait(self) -> None:
+		if self.source.latency:
+			time.sleep(self.source.latency)
+
+	def _is_valid(self, symbol: str) -> bool:
+		return True
+
+	def _endpoint(self, name: str) -> dict:
+		self._wait()
+		out = {}
+		for s in self.symbols:
+			try:
+				out[s] = self._symbol_endpoint(s, name)
+			except Exception as e:
+				out[s] = f'No {name} data found for {s}: {e}'
+		return out
+
+	@property
+	def asset_profile(self) -> dict:
+		return self._endpoint('asset_profile')
+
+	@property
+	def quote_type(self) -> dict:
+		return self._endpoint('quote_type')
+
+	@property
+	def price(self) -> dict:
+		return self._endpoint('price')
+
+	def history(
+		self, period: str = 'ytd', interval: str = '1d', start=None, end=None
+	):
+		self._wait()
+		out = {}
+		for s in self.symbols:
+			try:
+				df = self._symbol_history(s, interval, start, end)
+				if start is not None:
+					df = df.loc[df.index >= _as_index_date(start, df.index)]
+				if end is not None:
+					df = df.loc[df.index <= _as_index_date(end, df.index)]
+				out[s] = df
+			except Exception as e:
+				out[s] = f'No {interval} price data found for {s}: {e}'
+		if all(isinstance(x, pd.DataFrame) for x in out.values()):
+			return pd.concat(out, names=['symbol', 'date'], sort=False)
+		return out
+
+	@property
+	def option_chain(self):
+		self._wait()
+		chains = {}
+		for s in self.symbols:
+			try:
+				chains[s] = self._symbol_option_chain(s)
+			except Exception:
+				continue
+		if not chains:
+			return 'No option chain data found'
+		return pd.concat(chains, names=['symbol'], sort=False).sort_index()
+
+	def _symbol_endpoint(self, symbol: str, name: str) -> dict:
+		raise NotImplementedError
+
+	def _symbol_history(
+		self, symbol: str, interval: str, start=None, end=None
+	) -> pd.DataFrame:
+		"""start and end are only a hint, history() does the filtering"""
+		raise NotImplementedError
+
+	def _symbol_option_chain(self, symbol: str) -> pd.DataFrame:
+		raise NotImplementedError
+
+
+def _as_index_date(value, index: pd.Index):
+	"""Turn a date string/datetime into whatever the index is made of"""
+	value = pd.Timestamp(value)
+	if len(index) and isinstance(index[0], dt.date) \
+		and not isinstance(index[0], dt.datetime):
+		return value.date()
+	return value
+
+
+# ------------------------------------------------------------------------------
+# Replay
+# ------------------------------------------------------------------------------
+class ReplayTicker(OfflineTicker):
+	"""Reads responses recorded by record()"""
+
+	def _path(self, symbol: str, name: str) -> str:
+		return os.path.join(self.source.directory, symbol, name)
+
+	def _is_valid(self, symbol: str) -> bool:
+		return os.path.exists(self._path(symbol, 'metadata.json'))
+
+	def _symbol_endpoint(self, symbol: str, name: str) -> dict:
+		with open(self._path(symbol, 'metadata.json')) as f:
+			return json.load(f)[name]
+
+	def _symbol_history(
+		self, symbol: str, interval: str, start=None, end=None
+	) -> pd.DataFrame:
+		return pd.read_parquet(self._path(symbol, f'history_{interval}.parquet'))
+
+	def _symbol_option_chain(self, symbol: str) -> pd.DataFrame:
+		return pd.read_parquet(self._path(symbol, 'option_chain.parquet'))
+
+
+class ReplaySource(DataSource):
+	"""Plays back responses recorded to a local directory"""
+	name = 'replay'
+
+	def __init__(self, directory: str, latency: float = 0.0):
+		super().__init__(latency)
+		self.directory = directory
+
+	def __repr__(self):
+		return f'ReplaySource({self.directory}, latency={self.latency})'
+
+	def ticker(self, symbols: list, validate: bool = False, session=None):
+		return ReplayTicker(self, symbols, validate)
+
+
+def record(
+	symbols: list,
+	directory: str,
+	source: DataSource = None,
+	intervals: tuple = ('1d',)
+) -> dict:
+	"""Save responses from a source so ReplaySource can play them back.
+
+	Returns {symbol: error message} for symbols that couldn't be recorded.
+	"""
+	source = source if source is not None else YahooSource()
+	ticker = source.ticker(symbols)
+	endpoints = {name: getattr(ticker, name) for name in DICT_ENDPOINTS}
+	histories = {i: ticker.history(period='max', interval=i) for i in intervals}
+	option_chain = ticker.option_chain
+	errors = {}
+	for s in ticker.symbols:
+		try:
+			path = os.path.join(directory, s)
+			os.makedirs(path, exist_ok=True)
+			metadata = {name: endpoints[name][s] for name in DICT_ENDPOINTS}
+			if any(isinstance(x, str) for x in metadata.values()):
+				raise ValueError('no metadata')
+			with open(os.path.join(path, 'metadata.json'), 'w') as f:
+				json.dump(metadata, f, default=str)
+			for interval, history in histories.items():
+				history = history[s] if isinstance(history, dict) \
+					else history.loc[s]
+				if isinstance(history, pd.DataFrame):
+					history.to_parquet(
+						os.path.join(path, f'history_{interval}.parquet')
+					)
+			if isinstance(option_chain, pd.DataFrame) \
+				and s in option_chain.index.get_level_values(0):
+				option_chain.loc[s].to_parquet(
+					os.path.join(path, 'option_chain.parquet')
+				)
+		except Exception as e:
+			errors[s] = str(e)
+	return errors
+
+
+# ------------------------------------------------------------------------------
+# Synthetic
+# ------------------------------------------------------------------------------
+SECTORS = {
+	'Technology': ['Software—Infrastructure', 'Semiconductors'],
+	'Healthcare': ['Biotechnology', 'Medical Devices'],
+	'Financial Services': ['Banks—Diversified', 'Asset Management'],
+	'Energy': ['Oil & Gas Integrated', 'Oil & Gas E&P'],
+	'Consumer Cyclical': ['Internet Retail', 'Auto Manufacturers'],
+	'Industrials': ['Aerospace & Defense', 'Railroads']
+}
+PLACES = [
+	('United States', 'CA', 'Cupertino'),
+	('United States', 'WA', 'Seattle'),
+	('United States', 'NY', 'New York'),
+	('United States', 'TX', 'Houston'),
+	('Canada', 'ON', 'Toronto')
+]
+EXCHANGES = [('NMS', 'NasdaqGS'), ('NYQ', 'NYSE')]
+
+
+def _norm_cdf(x: np.ndarray) -> np.ndarray:
+	return 0.5 * (1 + np.vectorize(math.erf)(x / math.sqrt(2)))
+
+
+class SyntheticTicker(OfflineTicker):
+	"""Made up, but deterministic, data for any symbol"""
+
+	def _rng(self, symbol: str, salt: str) -> np.random.Generator:
+		seed = zlib.crc32(f'{self.source.seed}:{symbol}:{salt}'.encode())
+		return np.random.default_rng(seed)
+
+	def _is_valid(self, symbol: str) -> bool:
+		return symbol not in self.source.invalid
+
+	def _symbol_endpoint(self, symbol: str, name: str) -> dict:
+		rng = self._rng(symbol, 'metadata')
+		sector = list(SECTORS.keys())[rng.integers(len(SECTORS))]
+		industry = SECTORS[sector][rng.integers(len(SECTORS[sector]))]
+		country, state, city = PLACES[rng.integers(len(PLACES))]
+		exchange, exchange_name = EXCHANGES[rng.integers(len(EXCHANGES))]
+		return {
+			'asset_profile': {
+				'sector': sector,
+				'industry': industry,
+				'country': country,
+				'state': state,
+				'city': city
+			},
+			'quote_type': {
+				'quoteType': 'EQUITY',
+				'shortName': f'{symbol} Inc.',
+				'longName': f'{symbol} Incorporated'
+			},
+			'price': {
+				'exchange': exchange,
+				'exchangeName': exchange_name,
+				'regularMarketPrice': self._spot(symbol)
+			}
+		}[name]
+
+	def _symbol_history(
+		self, symbol: str, interval: str, start=None, end=None
+	) -> pd.DataFrame:
+		if interval in intraday.INTERVALS:
+			return self._symbol_intraday(symbol, interval, start, end)
+		if interval != '1d':
+			raise ValueError(f'interval {interval} not available')
+		source = self.source
+		rng = self._rng(symbol, 'history')
+		# Symbols list at different times, like real ones do
+		years = source.years * rng.uniform(0.3, 1.0) \
+			if source.ragged else source.years
+		dates = source.calendar[-max(2, int(years * 252)):]
+		n = len(dates)
+		mu = rng.normal(0.08, 0.05) / 252
+		sigma = rng.uniform(0.15, 0.6) / math.sqrt(252)
+		log_ret = rng.normal(mu - sigma**2 / 2, sigma, n)
+		close = rng.uniform(10, 300) * np.exp(np.cumsum(log_ret))
+		open_ = close * np.exp(rng.normal(0, sigma / 2, n))
+		spread = np.abs(rng.normal(0, sigma, n))
+		high = np.maximum(open_, close) * np.exp(spread)
+		low = np.minimum(open_, close) * np.exp(-spread)
+		# Dividend adjustment drifts adjclose away from close going back
+		adjclose = close * np.exp(-rng.uniform(0, 0.02) / 252 * np.arange(n)[::-1])
+		volume = rng.lognormal(14, 1, n).astype('int64')
+		df = pd.DataFrame({
+			'high': high,
+			'low': low,
+			'open': open_,
+			'close': close,
+			'volume': volume,
+			'adjclose': adjclose
+		}, index=pd.Index(dates, name='date'))
+		return df
+
+	def _symbol_intraday(
+		self, symbol: str, interval: str, start=None, end=None
+	) -> pd.DataFrame:
+		"""Bars of a regular session for every day from start to end that
+		Yahoo would still have. Each day is a random walk pinned to that
+		day's daily open and close, made from its own seed, so any range of
+		days (at any interval) always comes out the same."""
+		daily = self._symbol_history(symbol, '1d')
+		now = self.source.now()
+		days = pd.DatetimeIndex(daily.index)
+		keep = (days >= now.normalize() - intraday.LOOKBACK[interval]) & \
+			(days <= now)
+		if start is not None:
+			keep &= days >= pd.Timestamp(start).normalize()
+		if end is not None:
+			keep &= days <= pd.Timestamp(end)
+		if not keep.any():
+			raise ValueError('no bars in range')
+		minutes = intraday.SESSION_MINUTES
+		sigma = np.log(daily['close']).diff().std() / math.sqrt(minutes)
+		day_open = np.log(daily['open'].to_numpy()[keep])[:, None]
+		day_close = np.log(daily['close'].to_numpy()[keep])[:, None]
+		noise = np.stack([
+			self._rng(symbol, f'intraday {day:%Y-%m-%d}').normal(
+				size=(3, minutes)
+			)
+			for day in days[keep]
+		])
+		# Brownian bridge from the day's open to its close
+		walk = np.cumsum(noise[:, 0] * sigma, axis=1)
+		share = np.arange(1, minutes + 1) / minutes
+		close = np.exp(
+			day_open + share * (day_close - day_open) +
+			walk - share * walk[:, -1:]
+		)
+		open_ = np.c_[np.exp(day_open), close[:, :-1]]
+		high = np.maximum(open_, close) * np.exp(np.abs(noise[:, 1]) * sigma / 2)
+		low = np.minimum(open_, close) * np.exp(-np.abs(noise[:, 2]) * sigma / 2)
+		# More trading around the open and the close
+		weights = 1 + 2 * (np.linspace(-1, 1, minutes) ** 2)
+		volume = daily['volume'].to_numpy()[keep][:, None] * \
+			weights / weights.sum()
+		index = pd.DatetimeIndex((
+			days[keep].values[:, None] + np.timedelta64(570, 'm') +
+			np.arange(minutes).astype('timedelta64[m]')
+		).ravel(), name='date')
+		df = pd.DataFrame({
+			'open': open_.ravel(),
+			'high': high.ravel(),
+			'low': low.ravel(),
+			'close': close.ravel(),
+			'volume': np.round(volume.ravel())
+		}, index=index)
+		df = df.loc[df.index <= now]
+		return df if interval == '1m' else intraday.resample(df, interval)
+
+	def _spot(self, symbol: str) -> float:
+		return float(self._symbol_history(symbol, '1d')['close'].iloc[-1])
+
+	def _symbol_option_chain(self, symbol: str) -> pd.DataFrame:
+		source = self.source
+		rng = self._rng(symbol, 'options')
+		spot = self._spot(symbol)
+		now = pd.Timestamp(source.end)
+		expiries = pd.date_range(
+			now + pd.Timedelta(days=7), periods=source.expiries, freq='W-FRI'
+		) if source.expiries <= 8 else pd.date_range(
+			now + pd.Timedelta(days=7), periods=source.expiries, freq='BM'
+		)
+		strikes = np.round(
+			spot * np.linspace(0.5, 1.5, source.strikes), 2
+		)
+		base_vol = rng.uniform(0.2, 0.6)
+		frames = []
+		for option_type in ['calls', 'puts']:
+			exp, strike = [
+				x.ravel() for x in np.meshgrid(expiries, strikes, indexing='ij')
+			]
+			t = np.maximum(
+				(pd.DatetimeIndex(exp) - now).days.values / 365, 1 / 365
+			)
+			moneyness = np.log(strike / spot)
+			iv = base_vol + 0.4 * moneyness**2 - 0.1 * moneyness
+			d1 = (-moneyness + iv**2 / 2 * t) / (iv * np.sqrt(t))
+			d2 = d1 - iv * np.sqrt(t)
+			if option_type == 'calls':
+				price = spot * _norm_cdf(d1) - strike * _norm_cdf(d2)
+				itm = strike < spot
+			else:
+				price = strike * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+				itm = strike > spot
+			price = np.maximum(price, 0.01)
+			half_spread = price * rng.uniform(0.01, 0.05, len(price))
+			letter = 'C' if option_type == 'calls' else 'P'
+			frames.append(pd.DataFrame({
+				'expiration': exp,
+				'optionType': option_type,
+				'contractSymbol': [
+					f'{symbol}{pd.Timestamp(e):%y%m%d}{letter}{int(k * 1000):08d}'
+					for e, k in zip(exp, strike)
+				],
+				'strike': strike,
+				'currency': 'USD',
+				'lastPrice': np.round(price, 2),
+				'change': 0.0,
+				'percentChange': 0.0,
+				'volume': rng.integers(0, 5000, len(price)).astype(float),
+				'openInterest': rng.integers(0, 20000, len(price)).astype(float),
+				'bid': np.round(price - half_spread, 2),
+				'ask': np.round(price + half_spread, 2),
+				'contractSize': 'REGULAR',
+				'lastTradeDate': now,
+				'impliedVolatility': iv,
+				'inTheMoney': itm
+			}))
+		return pd.concat(frames).set_index(
+			['expiration', 'optionType']
+		).sort_index()
+
+
+class SyntheticSource(DataSource):
+	"""Generates N symbols x M years of OHLCV, metadata and option chains.
+
+	Every symbol is valid except those in invalid, and the same symbol always
+	gets the same data for the same seed and end date.
+	"""
+	name = 'synthetic'
+
+	def __init__(
+		self,
+		years: float = 20,
+		expiries: int = 8,
+		strikes: int = 25,
+		seed: int = 0,
+		end: str = None,
+		ragged: bool = True,
+		invalid: tuple = (),
+		latency: float = 0.0
+	):
+		super().__init__(latency)
+		self.years = years
+		self.expiries = expiries
+		self.strikes = strikes
+		self.seed = seed
+		self.end = pd.Timestamp(end if end is not None else dt.date.today())
+		self.ragged = ragged
+		self.invalid = set(invalid)
+		self._calendar = None
+
+	def __repr__(self):
+		return (
+			f'SyntheticSource({self.years}Y, {self.expiries}x{self.strikes} '
+			f'chains, seed={self.seed}, latency={self.latency})'
+		)
+
+	@property
+	def calendar(self) -> np.ndarray:
+		"""Business days (as datetime.date, like yahooquery) up to end"""
+		if self._calendar is None:
+			days = np.arange(
+				np.datetime64(self.end.date() - dt.timedelta(
+					days=int(self.years * 366) + 7
+				)),
+				np.datetime64(self.end.date()) + 1
+			)
+			days = days[np.is_busday(days)]
+			self._calendar = days[-int(self.years * 252):].astype(object)
+		return self._calendar
+
+	def now(self) -> pd.Timestamp:
+		"""The end of the end date, if that's in the past"""
+		return min(
+			pd.Timestamp.now(),
+			self.end.normalize() + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+		)
+
+	def ticker(self, symbols: list, validate: bool = False, session=None):
+		return SyntheticTicker(self, symbols, validate)
+
+
+def from_env() -> DataSource:
+	"""Source picked with STOCKTIME_SOURCE (yahoo, synthetic or replay:<dir>)
+	and STOCKTIME_SOURCE_LATENCY (seconds per request)"""
+	name = os.environ.get('STOCKTIME_SOURCE', 'yahoo')
+	latency = float(os.environ.get('STOCKTIME_SOURCE_LATENCY', 0))
+	if name == 'synthetic':
+		return SyntheticSource(latency=latency)
+	if name.startswith('replay:'):
+		return ReplaySource(name.split(':', 1)[1], latency=latency)
+	if name == 'yahoo':
+		return YahooSource(latency=latency)
+	raise ValueError(f'unknown STOCKTIME_SOURCE: {name}')
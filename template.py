@@ -16,7 +16,10 @@ class ExamplePage(template.Page):
 
 
 """
-import utils
+import cache
+import data
+import diagnostics
+import panel
 
 from abc import abstractmethod
 import streamlit as st
@@ -24,11 +27,65 @@ import streamlit as st
 
 class Page:
 	"""Page template"""
+	# SymbolData sections the page needs, loaded for the selected symbols only
+	sections = ['historical_prices']
 
 	def __init__(self, symbols: list, STATE: st.session_state):
-		self.symbols = symbols
 		self.STATE = STATE
-		self.data = utils.concat_obj_data(STATE.symbols_data)
+		with diagnostics.span('page sections', sections=self.sections):
+			self.symbols = self._load_sections(symbols)
+		self.panel = None
+		if 'historical_prices' in self.sections:
+			if not hasattr(STATE, 'price_panel'):
+				STATE.price_panel = panel.PricePanel()
+			self.panel = STATE.price_panel
+			with diagnostics.span('panel sync', symbols=len(self.symbols)):
+				self.panel.sync(STATE.symbols_data, self.symbols)
+		if not hasattr(STATE, 'memory'):
+			STATE.memory = cache.MemoryBudget(
+				directory=data.SOURCE.cache_dir
+			)
+		STATE.memory.touch(self.symbols)
+		with diagnostics.span('enforce budget'):
+			data.enforce_budget(
+				STATE.symbols_data, STATE.memory, self.panel,
+				pinned=self.symbols
+			)
+
+	@property
+	def data(self):
+		"""Full history of the selected symbols as a MultiIndex dataframe.
+		Only built if a page asks for it, charts slice the panel directly.
+		"""
+		if self.panel is None:
+			return None
+		return self.panel.frame(self.symbols)
+
+	def _load_sections(self, symbols: list) -> list:
+		"""Fetch what the page needs and drop symbols that don't have it"""
+		symbol_objs = [self.STATE.symbols_data[s] for s in symbols]
+		if any(
+			not x.is_loaded(section)
+			for x in symbol_objs for section in self.sections
+		):
+			with st.spinner(f'Getting data for {len(symbols)} symbols'):
+				data.load_sections(symbol_objs, self.sections)
+			if 'historical_prices' in self.sections:
+				st.caption(
+					f'Price history load times: '
+					f'{data.PRICE_CACHE.timing_report()}'
+				)
+		errors = {
+			x.symbol: x.errors[section]
+			for x in symbol_objs for section in self.sections
+			if section in x.errors
+		}
+		if errors:
+			st.warning(
+				f'No data for {len(errors)} symbol(s):\n' +
+				'\n'.join([f'- **{k}**: {v}' for k, v in errors.items()])
+			)
+		return [s for s in symbols if s not in errors]
 
 	@abstractmethod
 	def _single_symbol(self, symbol: str):
@@ -52,9 +109,16 @@ class Page:
 		"""Display the page"""
 		try:
 			if len(self.symbols) == 1:
-				self._single_symbol(self.symbols[0])
+				with diagnostics.span(
+					f'{self.__class__.__name__} page', symbols=1
+				):
+					self._single_symbol(self.symbols[0])
 			elif len(self.symbols) > 1:
-				self._multi_symbols(self.symbols)
+				with diagnostics.span(
+					f'{self.__class__.__name__} page',
+					symbols=len(self.symbols)
+				):
+					self._multi_symbols(self.symbols)
 			else:
 				st.markdown('''
 					### Page not finished   
@@ -6,6 +6,8 @@ from typing import List
 import pandas as pd
 import streamlit as st
 
+import diagnostics
+
 
 def signify(n, unit_type: str = 'bytes'):
 	"""Human readable number to largest significance.
@@ -41,9 +43,19 @@ def get_all_attributes(attrs: List[str], STATE: st.session_state) -> List[list]:
 	]
 
 
+@diagnostics.timed()
 def concat_obj_data(data: dict) -> pd.DataFrame:
 	"""Turn a dict of dataframes into a MultiIndex dataframe"""
 	if data:
 		return pd.concat(
 			{x: data[x].historical_prices for x in data.keys()}, keys=data.keys()
 		)
+
+
+def memory_report(symbols_data: dict) -> pd.DataFrame:
+	"""Bytes held by each symbol in the session, broken down by section"""
+	return pd.DataFrame.from_dict(
+		{s: x.memory_usage() for s, x in symbols_data.items()},
+		orient='index',
+		columns=['metadata', 'historical_prices', 'option_chain']
+	)